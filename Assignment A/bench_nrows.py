@@ -0,0 +1,87 @@
+import os
+import sys
+import multiprocessing as mp
+
+
+def legacy_get_nrows(file, read_mode="rb"):
+    # The line iterating implementation chunkers.get_nrows used to have
+    counter = 0
+    with open(file, read_mode) as f:
+        for a_line in f:
+            counter += 1
+
+    return counter
+
+
+def make_synthetic(saveloc, size_gb, template="data.txt"):
+    """Build a synthetic tick file of roughly size_gb by repeating template"""
+    target = int(size_gb * 1e9)
+
+    if os.path.exists(saveloc) and os.stat(saveloc).st_size >= target:
+        return
+
+    with open(template, "rb") as f:
+        block = f.read()
+
+    # Repeat the template in ~64 MB writes
+    block = block * max(1, (2 ** 26) // len(block))
+
+    written = 0
+    with open(saveloc, "wb") as f:
+        while written < target:
+            f.write(block)
+            written += len(block)
+
+
+if __name__ == "__main__":
+    # Usage: python bench_nrows.py [sizes in GB, comma separated] [directory]
+    wdir = os.path.dirname(os.path.realpath(__file__))
+    os.chdir(wdir)
+
+    sys.path.append("/".join([os.getcwd(), "..", "lib"]))
+
+    import chunkers as chk
+    import Timetrack
+
+    try:
+        sizes = [float(i) for i in sys.argv[1].split(",")]
+
+    except IndexError:
+        sizes = [1, 10]
+
+    try:
+        savedir = sys.argv[2]
+
+    except IndexError:
+        savedir = "../Archive"
+
+    tt = Timetrack.Timetrack()
+
+    for size_gb in sizes:
+        saveloc = os.path.join(savedir,
+                               "data-bench-{0}gb.txt".format(size_gb))
+        make_synthetic(saveloc, size_gb)
+
+        results = list()
+
+        tt.new_time("legacy")
+        nrows = legacy_get_nrows(saveloc)
+        tt.pause_time("legacy")
+        results.append(("line iteration", nrows,
+                        tt.elapsed_seconds("legacy")))
+
+        for nprocs in sorted(set([1, mp.cpu_count()])):
+            tag = "count_lines-{0}".format(nprocs)
+            tt.new_time(tag)
+            nrows = chk.count_lines(saveloc, nprocs=nprocs)
+            tt.pause_time(tag)
+            results.append(("count_lines nprocs={0}".format(nprocs), nrows,
+                            tt.elapsed_seconds(tag)))
+
+        print("{0} ({1} bytes)".format(saveloc, os.stat(saveloc).st_size))
+
+        base_time = results[0][2]
+        for name, nrows, seconds in results:
+            msg = "  {0:<24} rows: {1:>12}  seconds: {2:>9.3f}  speedup: "
+            msg += "{3:.1f}x"
+            print(msg.format(name, nrows, seconds, base_time / seconds))
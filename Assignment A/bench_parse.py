@@ -0,0 +1,72 @@
+import os
+import sys
+import io
+import re
+import numpy as np
+
+
+def legacy_parse(rows, noiserow_check, delimiter=","):
+    # The regex and split path scrub.worker used to have
+    valid = np.array([noiserow_check.match(a_row) is not None
+                      for a_row in rows], dtype=bool)
+
+    numeric_data = [rows[i].split(delimiter.encode("ascii"))[1:]
+                    for i in np.flatnonzero(valid)]
+    prices = np.array([i[0] for i in numeric_data], dtype=np.float64)
+    units_traded = np.array([i[1] for i in numeric_data], dtype=np.int64)
+
+    return valid, prices, units_traded
+
+
+if __name__ == "__main__":
+    # Usage: python bench_parse.py [data file] [number of copies]
+    wdir = os.path.dirname(os.path.realpath(__file__))
+    os.chdir(wdir)
+
+    sys.path.append("/".join([os.getcwd(), "..", "lib"]))
+
+    import tickparse as tp
+    import Timetrack
+
+    try:
+        dataloc = sys.argv[1]
+
+    except IndexError:
+        dataloc = "data.txt"
+
+    try:
+        ncopies = int(sys.argv[2])
+
+    except IndexError:
+        ncopies = 10
+
+    with open(dataloc, "rb") as f:
+        data = f.read() * ncopies
+
+    rows = io.BytesIO(data).readlines()
+    noiserow_check = re.compile(tp.ROW_REGEX.encode("ascii"))
+    tt = Timetrack.Timetrack()
+
+    tt.new_time("legacy")
+    valid, prices, units_traded = legacy_parse(rows, noiserow_check)
+    tt.pause_time("legacy")
+
+    tt.new_time("kernel")
+    k_valid, k_prices, k_units = tp.parse_ticks(data)
+    tt.pause_time("kernel")
+
+    same = np.array_equal(valid, k_valid)
+    same = same and np.array_equal(prices.view(np.int64),
+                                   k_prices[k_valid].view(np.int64))
+    same = same and np.array_equal(units_traded, k_units[k_valid])
+
+    print("{0} rows, {1} invalid".format(len(rows), np.sum(~valid)))
+    print("  identical output: {0}".format(same))
+
+    base_time = tt.elapsed_seconds("legacy")
+    for name in ["legacy", "kernel"]:
+        seconds = tt.elapsed_seconds(name)
+        msg = "  {0:<8} seconds: {1:>8.3f}  rows / sec: {2:>12.0f}  "
+        msg += "speedup: {3:.1f}x"
+        print(msg.format(name, seconds, len(rows) / seconds,
+                         base_time / seconds))
@@ -0,0 +1,92 @@
+import os
+import sys
+import itertools as it
+import numpy as np
+
+
+def legacy_sliding_chunker(iterable, chunk_size=1000, inc=2):
+    # The list rebuilding implementation chunkers.sliding_chunker used to have
+    chunking_iter = iter(iterable)
+    element_block = list(it.islice(chunking_iter, chunk_size))
+
+    if len(element_block) == chunk_size:
+        yield element_block
+
+    counting_index = 0
+    inc_elements = list()
+    for an_element in chunking_iter:
+        inc_elements += [an_element]
+        counting_index += 1
+
+        if (counting_index % inc) == 0:
+            element_block = element_block[inc:] + inc_elements
+
+            yield element_block
+
+            counting_index = 0
+            inc_elements = list()
+
+
+def consume(windows):
+    # Touch the last element of every window so lazy views are exercised
+    total = 0.0
+    for a_window in windows:
+        total += a_window[-1]
+
+    return total
+
+
+if __name__ == "__main__":
+    # Usage: python bench_sliding.py [number of window steps] [increment]
+    wdir = os.path.dirname(os.path.realpath(__file__))
+    os.chdir(wdir)
+
+    sys.path.append("/".join([os.getcwd(), "..", "lib"]))
+
+    import chunkers as chk
+    import Timetrack
+
+    try:
+        nsteps = int(sys.argv[1])
+
+    except IndexError:
+        nsteps = 10000
+
+    try:
+        inc = int(sys.argv[2])
+
+    except IndexError:
+        inc = 2
+
+    tt = Timetrack.Timetrack()
+
+    for chunk_size in [10 ** i for i in range(2, 7)]:
+        prices = np.random.lognormal(7.1528596, 0.1721931,
+                                     chunk_size + nsteps * inc)
+        price_list = prices.tolist()
+
+        runs = [
+            ("list rebuild (legacy)",
+             lambda: legacy_sliding_chunker(price_list, chunk_size, inc)),
+            # The default: a list copy of the window per step, still
+            # O(window size) per step like the legacy rebuild
+            ("deque copied (default)",
+             lambda: chk.sliding_chunker(iter(price_list), chunk_size, inc)),
+            ("deque reused",
+             lambda: chk.sliding_chunker(iter(price_list), chunk_size, inc,
+                                         reuse=True)),
+            ("numpy strided view",
+             lambda: chk.sliding_chunker(prices, chunk_size, inc))
+        ]
+
+        print("window size: {0}, steps: {1}, increment: {2}".format(
+            chunk_size, nsteps, inc))
+
+        for name, make_windows in runs:
+            tt.new_time(name)
+            consume(make_windows())
+            tt.pause_time(name)
+
+            seconds = tt.elapsed_seconds(name)
+            msg = "  {0:<22} seconds: {1:>9.4f}  per window (us): {2:>10.3f}"
+            print(msg.format(name, seconds, seconds * 1e6 / (nsteps + 1)))
@@ -0,0 +1,89 @@
+import os
+import sys
+import io
+import datetime as dt
+import numpy as np
+
+
+TIMESTAMP_FORMAT = "%Y%m%d:%H:%M:%S.%f"
+EPOCH = dt.datetime(1970, 1, 1)
+
+
+def legacy_timestamps(rows, delimiter=","):
+    # One datetime.strptime call per row, NAT where it fails
+    result = np.empty(len(rows), dtype=np.int64)
+    for i, a_row in enumerate(rows):
+        field = a_row.split(delimiter.encode(), 1)[0].rstrip(b"\r\n")
+
+        try:
+            delta = dt.datetime.strptime(field.decode("latin-1"),
+                                         TIMESTAMP_FORMAT) - EPOCH
+            result[i] = ((delta.days * 86400 + delta.seconds) * 10 ** 9 +
+                         delta.microseconds * 1000)
+
+        except ValueError:
+            result[i] = np.iinfo(np.int64).min
+
+    return result
+
+
+if __name__ == "__main__":
+    # Usage: python bench_timestamps.py [data file] [number of copies]
+    wdir = os.path.dirname(os.path.realpath(__file__))
+    os.chdir(wdir)
+
+    sys.path.append("/".join([os.getcwd(), "..", "lib"]))
+
+    import chunkers as chk
+    import tickparse as tp
+    import Timetrack
+
+    try:
+        dataloc = sys.argv[1]
+
+    except IndexError:
+        dataloc = "data.txt"
+
+    try:
+        ncopies = int(sys.argv[2])
+
+    except IndexError:
+        ncopies = 10
+
+    with open(dataloc, "rb") as f:
+        data = f.read() * ncopies
+
+    rows = io.BytesIO(data).readlines()
+    buf = np.frombuffer(data, dtype=np.uint8)
+    starts = chk.line_starts(buf)
+    tt = Timetrack.Timetrack()
+
+    tt.new_time("legacy")
+    timestamps = legacy_timestamps(rows)
+    tt.pause_time("legacy")
+
+    tt.new_time("kernel")
+    k_timestamps, k_errors = tp.parse_timestamps(buf, starts)
+    tt.pause_time("kernel")
+
+    # strptime takes fields the row layout does not (one digit months, no
+    # fraction), only rows both parse are compared value for value
+    legacy_errors = timestamps == tp.NAT
+    both = np.logical_not(legacy_errors | k_errors)
+    same = np.array_equal(timestamps[both], k_timestamps[both])
+
+    print("{0} rows, {1} malformed timestamps".format(len(rows),
+                                                     np.sum(k_errors)))
+    print("  identical timestamps: {0}".format(same))
+    print("  rows only strptime parses: {0}".format(
+        np.sum(k_errors & ~legacy_errors)))
+    print("  rows only the kernel parses: {0}".format(
+        np.sum(legacy_errors & ~k_errors)))
+
+    base_time = tt.elapsed_seconds("legacy")
+    for name in ["legacy", "kernel"]:
+        seconds = tt.elapsed_seconds(name)
+        msg = "  {0:<8} seconds: {1:>8.3f}  rows / sec: {2:>12.0f}  "
+        msg += "speedup: {3:.1f}x"
+        print(msg.format(name, seconds, len(rows) / seconds,
+                         base_time / seconds))
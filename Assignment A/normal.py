@@ -10,6 +10,16 @@ comm = MPI.COMM_WORLD
 rank = comm.Get_rank()
 size = comm.Get_size()
 
+# Settings that do not change the results of a chunk, left out of the key
+# of the chunk journal
+JOURNAL_IGNORED = ["prog_title", "prog_description", "dataloc",
+                   "exec_logloc", "result_logloc", "enable_debug",
+                   "prefetch_depth", "journal", "journal_dir",
+                   "price_cache_mb", "price_cache_dir"]
+
+# Price quantiles reported, estimated with a quantile sketch
+QUANTILES = [0.001, 0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99, 0.999]
+
 
 if __name__ == "__main__":
     # Set working directory to script's directory
@@ -19,6 +29,14 @@ if __name__ == "__main__":
     sys.path.append("/".join([os.getcwd(), "..", "lib"]))
 
     import chunkers as chk
+    import tickcache as tc
+    import tickparse as tp
+    import noisemask as nm
+    import mpi_utils
+    import accumulators as acc
+    import arraycache as ac
+    import sketches as sk
+    import journal as jn
     import ResultLogger as rl
     import utils
     import logging
@@ -35,8 +53,9 @@ if __name__ == "__main__":
     nchunk = cfg['chunk_size']
     row_delim = cfg['col_delimiter']
     enable_debug = cfg['enable_debug']
-    noiseloc = cfg['noisefileloc']
+    noisemaskloc = cfg['noisemaskloc']
     delimiter = cfg['col_delimiter']
+    use_tick_cache = cfg['tick_cache']
 
     # Create execution logger
     # ---------------------------------------------------------------------
@@ -83,14 +102,38 @@ if __name__ == "__main__":
         result_log = rl.ResultLogger(cfg['result_logloc'].format("normal"),
                                      cfg['prog_title'])
 
-        nrows = chk.get_nrows(dataloc)
+        # Plan row ranges of the tick cache (converting the file on its first
+        # use), or newline aligned byte ranges of the text file for every
+        # rank, only the file size and a few boundary seeks are needed (no row
+        # count). The line counts of text ranges come from the sparse line
+        # index of the file (built on its first use), which reads at most one
+        # index step of rows per range boundary rather than the range
+        if use_tick_cache:
+            tick_cache = tc.get_tick_cache(dataloc, delimiter=delimiter)
+            worker_ranges = tick_cache.plan_row_ranges(size, nchunk)
+            worker_nrows = [[i[1] - i[0] for i in a_worker]
+                            for a_worker in worker_ranges]
+
+        else:
+            line_index = chk.get_line_index(dataloc)
+            worker_ranges = chk.plan_worker_ranges(dataloc, size, nchunk)
+            worker_nrows = list()
+
+            for a_worker in worker_ranges:
+                range_bounds = [line_index.row_at(i[0]) for i in a_worker]
+                range_bounds.append(line_index.row_at(a_worker[-1][1]))
+                worker_nrows.append(np.diff(range_bounds).tolist())
+
+            del line_index
 
         result_log.init_section("Program Information", level=0)
         kvs = list()
         kvs.append(("MPI size", size))
         kvs.append(("Chunk size", cfg['chunk_size']))
         kvs.append(("File name", ntpath.basename(dataloc)))
-        kvs.append(("Row count", nrows))
+        kvs.append(("File size (bytes)", os.stat(dataloc).st_size))
+        kvs.append(("Tick cache", use_tick_cache))
+        kvs.append(("Ranges per rank", len(worker_ranges[0])))
         result_log.add_section_kvs(kvs)
         result_log.exec_section()
 
@@ -100,135 +143,302 @@ if __name__ == "__main__":
         else:
             lg.info("MPI size {0}, working in parallel".format(size))
 
-        s_index = 0
-        nchunk = cfg['chunk_size']
-        nrows_left = nrows
-        nworkers = size
-        scrub_results = list()
-        worker_row_indices = list()
-        row_indices = list()
-        for i in range(nworkers):
-            worker_row_indices.insert(i, [])
+        tt.new_time(tag='compute_stats')
 
-        while nrows_left != 0:
-            row_indices.append(utils.size_sequencer(nchunk, nworkers, s_index))
+    else:
+        worker_ranges = None
+        worker_nrows = None
 
-            nrows_left -= nchunk
-            s_index += nchunk
+    # Rank 0 has built the tick cache, if any, and counted the rows of every
+    # range before scattering, so no other rank needs the line index
+    ranges = comm.scatter(worker_ranges, root=0)
+    range_nrows = comm.scatter(worker_nrows, root=0)
 
-            if nchunk > nrows_left:
-                nchunk = nrows_left
+    if use_tick_cache:
+        tick_cache = tc.get_tick_cache(dataloc, build=False)
 
-        row_indices = [item for sublist in row_indices for item in sublist]
-        row_indices = utils.even_split(row_indices, size)
+    # Global first row (indexed from 1) of each range: per-range line counts
+    # shifted by an exclusive prefix sum over the lower ranks
+    row_base = comm.exscan(sum(range_nrows))
+    if row_base is None:
+        row_base = 0
 
-        for ipair, wp in zip(row_indices, worker_row_indices):
-            wp.extend(ipair)
+    range_first_rows = np.cumsum([row_base + 1] + range_nrows[:-1]).tolist()
+    nrows = comm.allreduce(sum(range_nrows))
 
-        tt.new_time(tag='compute_mean')
+    # Noise rows found by scrub.py as one packed bitmap (bit i is row i + 1),
+    # loaded once per node into memory its ranks share. A rank unpacks only
+    # the rows of the range it reads, so its memory does not grow with the
+    # file or the noise
+    noise_bits, node_comm, noise_win = mpi_utils.node_shared_array(
+        comm, ((nrows + 7) // 8,), np.uint8)
 
-    else:
-        worker_row_indices = None
+    if node_comm.Get_rank() == 0:
+        noise_mask = nm.NoiseMask.load(noisemaskloc)
 
-    row_indices = comm.scatter(worker_row_indices, root=0)
+        if noise_mask.nrows != nrows:
+            msg = "Noise mask {0} has {1} rows, the file has {2}"
+            raise Exception(msg.format(noisemaskloc, noise_mask.nrows, nrows))
 
-    # Create row reader object
-    rowreader = chk.Rowread(dataloc, row_indices[0][0])
+        noise_bits[:] = noise_mask.packed()
+        del noise_mask
 
-    # Read in noise indices from scrub.py
-    with open(noiseloc, "r") as f:
-        noise_index = f.readlines()
-        noise_index = set(int(i) for i in noise_index)
+    node_comm.Barrier()
 
-    price_mean = dict()
-    price_mean['nrows'] = 0
-    for i_interval in row_indices:
-        rowreader.set_startrow(i_interval[0] + 1)
-        rows = rowreader.read(i_interval[1] - i_interval[0] + 1)
+    def read_rows(task):
+        if use_tick_cache:
+            return tick_cache.read(task[0][0], task[0][1])
 
-        indexed_rows = [a_row for a_row in enumerate(rows, i_interval[0] + 1)]
-        indexed_rows = [i for i in indexed_rows if i[0] not in noise_index]
+        data = chk.read_byte_range(dataloc, task[0][0], task[0][1],
+                                   split=False)
+        data = np.frombuffer(data, dtype=np.uint8)
 
-        prices = (i[1].split(delimiter)[1] for i in indexed_rows)
-        prices = np.fromiter(prices, dtype=np.float64)
+        return data, chk.line_starts(data)
 
-        price_mean["total_price"] = np.sum(prices)
-        price_mean["nprices"] = np.int64(prices.size)
-        price_mean['nrows'] += np.int64(len(rows))
+    def signal_prices(rows, first_row):
+        # Prices of the valid rows of a range that are not noise
+        if use_tick_cache:
+            valid, prices = rows['valid'], rows['price']
 
-    partial_means = comm.gather(price_mean, root=0)
+        else:
+            valid, prices, _ = tp.parse_ticks(rows[0], rows[1], delimiter)
+
+        signal = nm.unpack_rows(noise_bits, first_row - 1, valid.size)
+        signal = np.logical_and(np.logical_not(signal), valid)
+
+        return prices[signal]
+
+    # Journal of the ranges this rank has finished in each pass, a run
+    # restarted with the same input, noise mask and settings skips them
+    journal = None
+    if cfg['journal']:
+        settings = dict((k, v) for k, v in cfg.items()
+                        if k not in JOURNAL_IGNORED)
+        settings['mpi_size'] = size
+        journal = jn.ChunkJournal(cfg['journal_dir'], "normal", rank,
+                                  jn.journal_key([dataloc, noisemaskloc],
+                                                 settings))
+
+    def finished(step):
+        # Entries of the ranges of a pass finished by an earlier run
+        if journal is None:
+            return list()
+
+        entries = journal.load(step)[0]
+        if len(entries) > 0:
+            msg = "rank-{0} resumed {1} after {2} ranges from the journal"
+            lg.info(msg.format(rank, step, len(entries)))
+
+        return entries
+
+    # Range k + 1 is read in a background thread while range k is parsed
+    range_tasks = list(zip(ranges, range_first_rows, range_nrows))
+    prefetch_depth = cfg['prefetch_depth']
+
+    def price_sketch(prices=()):
+        # Quantile sketch of prices, a few KB however many prices go in
+        return sk.KLLSketch(cfg['sketch_k']).add(prices)
+
+    moment_passes = cfg['moment_passes']
+    if moment_passes == 1:
+        # One pass: the moments and quantile sketch of every range are merged
+        # pairwise into those of the rank, and the ranks' into those of the
+        # file in one reduction
+        def range_record(prices=()):
+            return acc.Record([("moments", acc.Moments.from_values(prices)),
+                               ("sketch", price_sketch(prices))])
+
+        partials = finished("moments")
+
+        prefetcher = chk.Prefetcher(read_rows, range_tasks[len(partials):],
+                                    prefetch_depth)
+        with prefetcher:
+            for index, (task, rows) in enumerate(prefetcher, len(partials)):
+                first_row = task[1]
+                prices = signal_prices(rows, first_row)
+
+                partials.append(range_record(prices))
+
+                if journal is not None:
+                    journal.save("moments", index, partials[-1])
+
+                msg = "rank-{0} Start row: {1}, End row: {2}"
+                msg = msg.format(rank, first_row, first_row + task[2] - 1)
+                lg.debug(msg)
+
+                msg = "rank-{0} nprices: {1}".format(rank, prices.size)
+                lg.debug(msg)
+
+        rank_totals = acc.tree_merge([range_record()] + partials)
+        moments = rank_totals['moments']
+        read_wait = prefetcher.total_wait()
+
+        msg = "rank-{0} waited {1} seconds for reads".format(rank, read_wait)
+        lg.info(msg)
 
-    if rank == 0:
-        tt.pause_time(tag='compute_mean')
-        price_mean = utils.gather_dict(partial_means)
+        msg = "rank-{0} n: {1}, mean: {2}, M2: {3}, M3: {4}, M4: {5}"
+        msg = msg.format(rank, moments.n, moments.mean, moments.m2,
+                         moments.m3, moments.m4)
+        lg.info(msg)
 
-        price_mean = price_mean['total_price'] / price_mean['nprices']
+        totals = acc.Record([("ranges", rank_totals),
+                             ("read_wait", acc.Sum(read_wait))])
+        totals = mpi_utils.reduce_accumulator(comm, totals, root=0)
+
+        if rank == 0:
+            moments = totals['ranges']['moments']
+            quantile_sketch = totals['ranges']['sketch']
+            price_mean = moments.mean
+
+            # Central moment sums of the file are the sums of deviations
+            # from its mean of the two pass computation
+            jarque_bera_stats = dict()
+            jarque_bera_stats['n'] = moments.n
+            jarque_bera_stats['stdev_num'] = moments.m2
+            jarque_bera_stats['skew_num'] = moments.m3
+            jarque_bera_stats['kurt_num'] = moments.m4
+            jarque_bera_stats['read_wait'] = totals['read_wait'].value
+
+    elif moment_passes == 2:
+        # Two passes: the mean of the file first, then the sums of powers of
+        # the deviations from it
+        def mean_record(prices=(), nrows=0):
+            return acc.Record([("total_price", acc.Sum().add(prices)),
+                               ("nprices", acc.Count().add(prices)),
+                               ("nrows", acc.Count(nrows)),
+                               ("sketch", price_sketch(prices))])
+
+        def deviations_record(n=0, stdev_num=0.0, skew_num=0.0,
+                              kurt_num=0.0):
+            return acc.Record([("n", acc.Count(n)),
+                               ("stdev_num", acc.Sum(stdev_num)),
+                               ("skew_num", acc.Sum(skew_num)),
+                               ("kurt_num", acc.Sum(kurt_num))])
+
+        # Prices of pass one kept for pass two within a memory budget per
+        # rank, spilled to disk past it (or dropped, and read again, with no
+        # spill directory)
+        price_cache = ac.ArrayCache(cfg['price_cache_mb'] * 2 ** 20,
+                                    cfg['price_cache_dir'])
+
+        def cached_prices(task):
+            prices = price_cache.get(task[1])
+            if prices is None:
+                prices = signal_prices(read_rows(task), task[1])
+
+            return prices
+
+        partial_means = finished("mean")
+
+        with chk.Prefetcher(read_rows, range_tasks[len(partial_means):],
+                            prefetch_depth) as prefetcher:
+            for index, (task, rows) in enumerate(prefetcher,
+                                                 len(partial_means)):
+                first_row = task[1]
+                prices = signal_prices(rows, first_row)
+
+                partial_means.append(mean_record(prices, task[2]))
+                price_cache.put(first_row, prices)
+
+                if journal is not None:
+                    journal.save("mean", index, partial_means[-1])
+
+        read_wait = prefetcher.total_wait()
+
+        # Every rank needs the mean, merged in one all-reduction
+        mean_totals = acc.tree_merge([mean_record()] + partial_means)
+        mean_totals = mpi_utils.allreduce_accumulator(comm, mean_totals)
+        price_mean = mean_totals['total_price'].value
+        price_mean /= mean_totals['nprices'].value
+        quantile_sketch = mean_totals['sketch']
+
+        # Entries are the sums of a range, None for a range without prices
+        entries = finished("deviations")
+        test_stats = [i for i in entries if i is not None]
+
+        msg = "rank-{0} price cache: {1} ranges, {2} bytes in memory, "
+        msg += "{3} bytes spilled, {4} ranges dropped"
+        msg = msg.format(rank, len(price_cache), price_cache.nbytes_memory,
+                         price_cache.nbytes_spilled, price_cache.ndropped)
+        lg.info(msg)
 
-        packets = [{"mean": price_mean, "i": i} for i in worker_row_indices]
+        # Only the ranges not in the cache are read again
+        prefetcher = chk.Prefetcher(cached_prices,
+                                    range_tasks[len(entries):],
+                                    prefetch_depth)
+        with prefetcher:
+            for index, (task, prices) in enumerate(prefetcher, len(entries)):
+                first_row = task[1]
 
-        tt.new_time(tag="compute_deviations")
-    else:
-        packets = None
+                if prices.size == 0:
+                    if journal is not None:
+                        journal.save("deviations", index, None)
+
+                    continue
+
+                deviation = prices - price_mean
+                pstats = deviations_record(
+                    prices.size, np.sum(np.power(deviation, 2)),
+                    np.sum(np.power(deviation, 3)),
+                    np.sum(np.power(deviation, 4)))
 
-    packet = comm.scatter(packets, root=0)
+                test_stats.append(pstats)
 
-    rowreader.reset(row_indices[0][0] + 1)
-    test_stats = list()
-    for i_interval in packet['i']:
-        rowreader.set_startrow(i_interval[0] + 1)
-        rows = rowreader.read(i_interval[1] - i_interval[0] + 1)
+                if journal is not None:
+                    journal.save("deviations", index, pstats)
 
-        indexed_rows = [a_row for a_row in enumerate(rows, i_interval[0] + 1)]
-        indexed_rows = [i for i in indexed_rows if i[0] not in noise_index]
+                msg = "rank-{0} Start row: {1}, End row: {2}"
+                msg = msg.format(rank, first_row, first_row + task[2] - 1)
+                lg.debug(msg)
 
-        prices = (i[1].split(delimiter)[1] for i in indexed_rows)
-        prices = np.fromiter(prices, dtype=np.float64)
+                msg = "rank-{0} nprices: {1}".format(rank, prices.size)
+                lg.debug(msg)
 
-        deviation = prices - packet['mean']
-        pstats = dict()
-        pstats['n'] = 0
-        pstats['stdev_num'] = np.sum(np.power(deviation, 2))
-        pstats['skew_num'] = np.sum(np.power(deviation, 3))
-        pstats['kurt_num'] = np.sum(np.power(deviation, 4))
-        pstats['n'] += np.int64(prices.size)
+                msg = "rank-{0} First price: {1}, dev: {2}"
+                msg = msg.format(rank, prices[0], deviation[0])
+                lg.debug(msg)
 
-        test_stats.append(pstats)
+                msg = "rank-{0} Last price: {1}, dev: {2}"
+                msg = msg.format(rank, prices[-1], deviation[-1])
+                lg.debug(msg)
 
-        msg = "rank-{0} Start row: {1}, End row: {2}"
-        msg = msg.format(rank, i_interval[0] + 1, i_interval[1] + 1)
-        lg.debug(msg)
+        read_wait += prefetcher.total_wait()
+        price_cache.close()
 
-        msg = "rank-{0} nprices: {1}".format(rank, prices.size)
-        lg.debug(msg)
+        test_stats = acc.tree_merge([deviations_record()] + test_stats)
 
-        msg = "rank-{0} First price: {1}, dev: {2}".format(rank, prices[0],
-                                                           deviation[0])
-        lg.debug(msg)
+        msg = "rank-{0} waited {1} seconds for reads".format(rank, read_wait)
+        lg.info(msg)
+
+        msg = "rank-{0} stdev numerator: {1}"
+        lg.info(msg.format(rank, test_stats['stdev_num'].value))
 
-        msg = "rank-{0} Last price: {1}, dev: {2}".format(rank, prices[-1],
-                                                          deviation[-1])
-        lg.debug(msg)
+        msg = "rank-{0} skew numerator: {1}"
+        lg.info(msg.format(rank, test_stats['skew_num'].value))
 
-    test_stats = utils.gather_dict(test_stats)
+        msg = "rank-{0} kurt numerator: {1}"
+        lg.info(msg.format(rank, test_stats['kurt_num'].value))
 
-    msg = "rank-{0} stdev numerator: {1}".format(rank, test_stats['stdev_num'])
-    lg.info(msg)
+        totals = acc.Record([("deviations", test_stats),
+                             ("read_wait", acc.Sum(read_wait))])
+        totals = mpi_utils.reduce_accumulator(comm, totals, root=0)
 
-    msg = "rank-{0} skew numerator: {1}".format(rank, test_stats['skew_num'])
-    lg.info(msg)
+        if rank == 0:
+            jarque_bera_stats = dict((name, totals['deviations'][name].value)
+                                     for name in totals['deviations'].names)
+            jarque_bera_stats['read_wait'] = totals['read_wait'].value
 
-    msg = "rank-{0} kurt numerator: {1}".format(rank, test_stats['kurt_num'])
-    lg.info(msg)
+    else:
+        raise Exception("moment_passes must be 1 or 2, not " +
+                        str(moment_passes))
 
-    partial_stats = comm.gather(test_stats, root=0)
+    # Every range is read, the noise mask is no longer needed
+    noise_win.Free()
+    del noise_bits
 
     if rank == 0:
-        tt.pause_time(tag='compute_deviations')
+        tt.pause_time(tag='compute_stats')
 
-        jarque_bera_stats = {
-            "stdev_num": 0, "skew_num": 0, "kurt_num": 0, "n": 0
-        }
-        jarque_bera_stats = utils.gather_dict(partial_stats)
         final_stdev = jarque_bera_stats['stdev_num']
         final_stdev /= (jarque_bera_stats['n'] - 1)
         final_stdev = np.sqrt(final_stdev)
@@ -269,8 +479,7 @@ if __name__ == "__main__":
         analysis_output.append(("Normal program elapsed time",
                                 tt.elapsed_pretty()))
 
-        stat_compute_time = (tt.elapsed_seconds(tag='compute_mean') +
-                             tt.elapsed_seconds(tag='compute_deviations'))
+        stat_compute_time = tt.elapsed_seconds(tag='compute_stats')
 
         analysis_output.append(
             ("Test statistic compute time",
@@ -278,11 +487,19 @@ if __name__ == "__main__":
         )
         # result_log.init_section("Analysis Output", level=0)
 
-        velocity = jarque_bera_stats['n'] * 2
+        velocity = jarque_bera_stats['n'] * moment_passes
         velocity /= stat_compute_time
         velocity = str(round(velocity, 4))
         analysis_output.append(("Velocity (stat compute / sec)", velocity))
 
+        analysis_output.append(
+            ("Read wait time (all ranks)",
+             utils.pretty_time_string(seconds=jarque_bera_stats['read_wait'],
+                                      ndig_secs=4))
+        )
+        analysis_output.append(("Passes over the prices",
+                                str(moment_passes)))
+        analysis_output.append(("Row count", str(nrows)))
         analysis_output.append(("# of prices", str(jarque_bera_stats['n'])))
         analysis_output.append(("Mean (price)", str(round(price_mean, 4))))
         analysis_output.append(("STDEV (price)", str(round(final_stdev, 4))))
@@ -290,6 +507,18 @@ if __name__ == "__main__":
         analysis_output.append(("Kurtosis (price)", str(round(final_kurt, 4))))
         analysis_output.append(("Jarque-Bera test statistic",
                                 str(round(jb_chisq, 4))))
+
+        # Quantiles estimated from the merged sketch of all ranks
+        for q, estimate in zip(QUANTILES,
+                               quantile_sketch.quantile(QUANTILES)):
+            analysis_output.append(("Price quantile {0:g}%".format(q * 100),
+                                    str(round(estimate, 4))))
+
+        analysis_output.append(
+            ("Quantile rank error (95%)",
+             str(round(quantile_sketch.rank_error(), 6))))
+        analysis_output.append(("Quantile sketch size (bytes)",
+                                str(quantile_sketch.pack().nbytes)))
         analysis_output.append(("Null hypothesis", "Price is normal"))
         analysis_output.append(("Compared to", "Chi-square, 2 dof"))
         analysis_output.append(("significance 95% (JB Stat <= 5.99)",
@@ -299,3 +528,8 @@ if __name__ == "__main__":
 
         result_log.add_section_kvs(analysis_output)
         result_log.exec_section()
+
+    # The run is complete, its journals are no longer needed
+    comm.barrier()
+    if journal is not None:
+        journal.clear()
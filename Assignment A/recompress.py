@@ -0,0 +1,74 @@
+import os
+import sys
+import gzip
+import bz2
+
+
+if __name__ == "__main__":
+    # Usage: python recompress.py <source> [codec] [block size in MB]
+    #
+    # Recompresses a tick file (plain, .gz or .bz2) into the seekable block
+    # compressed layout read by chunkers: independently compressed blocks of
+    # whole lines plus a block offset index next to the output. codec is one
+    # of gzip (default), bz2 or zstd (needs the zstandard package)
+    wdir = os.path.dirname(os.path.realpath(__file__))
+    os.chdir(wdir)
+
+    sys.path.append("/".join([os.getcwd(), "..", "lib"]))
+
+    import blockzip
+    import Timetrack
+
+    tt = Timetrack.Timetrack()
+
+    try:
+        source = sys.argv[1]
+
+    except IndexError:
+        raise Exception("No source file was provided")
+
+    try:
+        codec = sys.argv[2]
+
+    except IndexError:
+        codec = "gzip"
+
+    try:
+        block_size = int(float(sys.argv[3]) * 2 ** 20)
+
+    except IndexError:
+        block_size = blockzip.BLOCK_SIZE
+
+    source_codec = blockzip.codec_of(source)
+
+    if source_codec == "gzip":
+        source_open = gzip.open
+
+    elif source_codec == "bz2":
+        source_open = bz2.BZ2File
+
+    elif source_codec is None:
+        source_open = open
+
+    else:
+        raise Exception("Cannot read {0} sources".format(source_codec))
+
+    if source_codec is None:
+        dest = source
+
+    else:
+        dest = source[:-len(blockzip.CODEC_EXTENSIONS[source_codec])]
+
+    dest += blockzip.CODEC_EXTENSIONS[codec]
+
+    index = blockzip.compress_file(source, dest, codec=codec,
+                                   block_size=block_size,
+                                   source_open=source_open)
+    tt.pause_time()
+
+    print("Wrote {0}".format(dest))
+    print("  Blocks            : {0}".format(index.nblocks))
+    print("  Rows              : {0}".format(index.nrows))
+    print("  Uncompressed bytes: {0}".format(index.usize))
+    print("  Compressed bytes  : {0}".format(index.size))
+    print("  Elapsed           : {0}".format(tt.elapsed_pretty()))
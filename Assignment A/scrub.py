@@ -3,101 +3,68 @@ import os
 import json
 import datetime as dt
 from mpi4py import MPI
-import re
 import ntpath
 import numpy as np
 import psutil
 
 
-def worker(rows, noisefile, row_index, rank, execlogger, noiserow_check,
-           delimiter=","):
-    start_row = row_index[0]
-    nrows_read = row_index[1] - row_index[0] + 1
-    nrows_parsed = len(rows)
+# Settings that do not change the results of a chunk, left out of the key
+# of the chunk journal
+JOURNAL_IGNORED = ["prog_title", "prog_description", "dataloc",
+                   "exec_logloc", "result_logloc", "enable_debug",
+                   "prefetch_depth", "journal", "journal_dir", "noisefileloc",
+                   "signalfileloc", "noisemaskloc", "cleanfileloc"]
 
-    msg = "rank-{0} start index: {1}, nrows: {2}"
-    msg = msg.format(rank, start_row, nrows_read)
-    execlogger.debug(msg)
-
-    row_indices = xrange(start_row + 1, start_row + nrows_read + 1)
-    indexed_rows = [(a_row, i) for a_row, i in zip(rows, row_indices)]
-
-    noise_i = set(a_row[1] for a_row in indexed_rows
-                  if noiserow_check.match(a_row[0]) is None)
 
-    regex_noise = len(noise_i)
-    msg = "rank-{0} found {1} noise rows with regex"
-    msg = msg.format(rank, regex_noise)
-    execlogger.debug(msg)
-
-    indexed_rows.sort(key=lambda x: x[0])
+def scrub_record(nrows=0, n_noise=0, noiseio_elapsed=0.0, read_wait=0.0):
+    """Scrub results of a chunk or a rank, merged over chunks and ranks
 
-    noise_i.update((indexed_rows[i][1] for i in range(1, len(indexed_rows))
-                    if (indexed_rows[i][0] == indexed_rows[i - 1][0]) is True))
+    Returns (accumulators.Record):
+        Rows parsed, noise rows, noise IO seconds and read wait seconds
+    """
+    return acc.Record([("nrows", acc.Count(nrows)),
+                       ("n_noise", acc.Count(n_noise)),
+                       ("noiseio_elapsed", acc.Sum(noiseio_elapsed)),
+                       ("read_wait", acc.Sum(read_wait))])
 
-    dup_noise = len(noise_i) - regex_noise
-    msg = "rank-{0} found {1} noise rows as duplicates"
-    msg = msg.format(rank, dup_noise)
-    execlogger.debug(msg)
 
-    indexed_rows = [i for i in indexed_rows if i[1] not in noise_i]
+def worker(chunk, pipeline, rank, execlogger):
+    """Scrub a chunk of rows with the noise rules of the pipeline
 
-    indices = np.array([i[1] for i in indexed_rows], dtype=np.int64)
+    Args:
+        chunk (noiserules.TickChunk): Rows of the chunk
+        pipeline (noiserules.RulePipeline): Rules of the rank, in order
+        rank (int): MPI rank
+        execlogger (logging.Logger): Execution logger
 
-    numeric_data = [i[0].split(delimiter)[1:] for i in indexed_rows]
-    prices = np.array([i[0] for i in numeric_data], dtype=np.float64)
-    units_traded = np.array([i[1] for i in numeric_data], dtype=np.int64)
+    Returns (tuple):
+        Results of the chunk (see scrub_record) and the reason code of every
+        row (numpy.ndarray(uint8))
+    """
+    nrows_parsed = chunk.nrows
 
-    stdev = np.std(prices)
-    price_mean = np.mean(prices)
-    upp_stdev = 3 * stdev
-    low_stdev = -3 * stdev
-
-    prices_demeaned = prices - price_mean
-
-    noise_i.update(indices[np.logical_or(prices_demeaned < low_stdev,
-                                         prices_demeaned > upp_stdev)])
-
-    price_sigma_noise = len(noise_i) - dup_noise
-    msg = "rank-{0} found {1} noise rows as price sigma noise"
-    msg = msg.format(rank, price_sigma_noise)
+    msg = "rank-{0} local start index: {1}, nrows: {2}"
+    msg = msg.format(rank, chunk.start_row, nrows_parsed)
     execlogger.debug(msg)
 
-    noise_i.update(indices[np.logical_and(prices > 0, units_traded == 0)])
+    flagged = dict(pipeline.flagged)
+    reasons = pipeline.run(chunk)
 
-    units_sigma_noise = len(noise_i) - price_sigma_noise
-    msg = "rank-{0} found {1} noise rows as units traded noise"
-    msg = msg.format(rank, units_sigma_noise)
-    execlogger.debug(msg)
+    for name in pipeline.names:
+        msg = "rank-{0} found {1} noise rows with rule {2}"
+        msg = msg.format(rank, pipeline.flagged[name] - flagged[name], name)
+        execlogger.debug(msg)
 
+    n_noise = np.count_nonzero(reasons)
     msg = "rank-{0} detect noise finished, nrows {1} parsed, {2} detected"
-    msg = msg.format(rank, nrows_parsed, len(noise_i))
+    msg = msg.format(rank, nrows_parsed, n_noise)
     execlogger.info(msg)
 
     msg = "rank-{0} finished scrubbing in {1} seconds"
     msg = msg.format(rank, tt.elapsed_seconds(tag="scrub_time"))
     execlogger.info(msg)
 
-    if len(noise_i) > 0:
-        tt.new_time(tag="noise_piece_io")
-
-        noisefile.writelines([str(i) + "\n" for i in noise_i])
-
-        msg = "rank-{0} wrote {1} noise row indices to disk"
-        msg = msg.format(rank, len(noise_i))
-        execlogger.info(msg)
-
-        time_io = tt.elapsed_seconds(tag='noise_piece_io')
-
-    else:
-        time_io = 0
-
-    result = dict()
-    result['nrows'] = nrows_parsed
-    result['n_noise'] = len(noise_i)
-    result['noiseio_elapsed'] = time_io
-
-    return result
+    return scrub_record(nrows_parsed, n_noise), reasons
 
 
 if __name__ == "__main__":
@@ -112,6 +79,15 @@ if __name__ == "__main__":
     sys.path.append("/".join([os.getcwd(), "..", "lib"]))
 
     import chunkers as chk
+    import tickcache as tc
+    import tickparse as tp
+    import mpi_utils
+    import accumulators as acc
+    import rolling as rll
+    import sampling as sp
+    import noisemask as nm
+    import noiserules as nr
+    import journal as jn
     import ResultLogger as rl
     import utils
     import logging
@@ -121,16 +97,6 @@ if __name__ == "__main__":
     # -------------------------------------------------------------------------
     tt = Timetrack.Timetrack()
 
-    # Create noise row checker regex searcher
-    row_regex = [
-        r"^\d{8}([:]\d{2}){3}[.]\d+",
-        r"[1-9]+[0-9.]+",
-        r"[0-9.]+\r?$"]
-
-    row_regex = r"[,]".join(row_regex)
-
-    noiserow_check = re.compile(row_regex)
-
     # Load program settings
     with open("config/scrub_config.json", "r") as f:
         cfg = json.load(f)
@@ -139,8 +105,16 @@ if __name__ == "__main__":
     enable_debug = cfg['enable_debug']
     noiseloc = cfg['noisefileloc']
     signalloc = cfg['signalfileloc']
+    noisemaskloc = cfg['noisemaskloc']
+    clean_output = cfg['clean_output']
+    cleanloc = cfg['cleanfileloc']
     exec_logloc = cfg['exec_logloc']
     result_logloc = cfg['result_logloc']
+    use_tick_cache = cfg['tick_cache']
+    global_dedup = cfg['global_dedup']
+    sigma_window_kind = cfg['sigma_window_kind']
+    global_sigma_mode = cfg['global_sigma_mode']
+    noise_rules = cfg['noise_rules']
 
     # Create execution logger
     # ---------------------------------------------------------------------
@@ -186,16 +160,32 @@ if __name__ == "__main__":
         # ---------------------------------------------------------------------
         result_log = rl.ResultLogger(result_logloc, cfg['prog_title'])
 
-        tt.new_time('get_nrow')
-        nrows = chk.get_nrows(dataloc)
-        tt.pause_time('get_nrow')
+        # Plan row ranges of the tick cache (converting the file on its first
+        # use), or newline aligned byte ranges of the text file for every
+        # rank, only the file size and a few boundary seeks are needed (no row
+        # count)
+        tt.new_time('plan_ranges')
+        if use_tick_cache:
+            tick_cache = tc.get_tick_cache(dataloc, delimiter=row_delim)
+            worker_ranges = tick_cache.plan_row_ranges(size,
+                                                       cfg['chunk_size'])
+
+        else:
+            worker_ranges = chk.plan_worker_ranges(dataloc, size,
+                                                   cfg['chunk_size'])
+
+        tt.pause_time('plan_ranges')
 
         result_log.init_section("Program Information", level=0)
         kvs = list()
         kvs.append(("MPI size", size))
         kvs.append(("Chunk size", cfg['chunk_size']))
         kvs.append(("File name", ntpath.basename(dataloc)))
-        kvs.append(("Row count", nrows))
+        kvs.append(("File size (bytes)", os.stat(dataloc).st_size))
+        kvs.append(("Tick cache", use_tick_cache))
+        kvs.append(("Ranges per rank", len(worker_ranges[0])))
+        kvs.append(("Noise rules", ", ".join(noise_rules)))
+        kvs.append(("Price sigma window", sigma_window_kind))
         result_log.add_section_kvs(kvs)
         result_log.exec_section()
 
@@ -205,100 +195,512 @@ if __name__ == "__main__":
         else:
             lg.info("MPI size {0}, working in parallel".format(size))
 
-        s_index = 0
-        nchunk = cfg['chunk_size']
-        nrows_left = nrows
-        nworkers = size
-        scrub_results = list()
-        worker_row_indices = list()
-        row_indices = list()
-        for i in range(nworkers):
-            worker_row_indices.insert(i, [])
+    else:
+        worker_ranges = None
+
+    # Rank 0 has built the tick cache, if any, before sending the ranges.
+    # Every rank gets the ranges of all ranks, those of the lower ranks seed
+    # its price sigma window
+    worker_ranges = comm.bcast(worker_ranges, root=0)
+    ranges = worker_ranges[rank]
+    file_ranges = [i for a_worker in worker_ranges for i in a_worker]
+    first_range = sum(len(i) for i in worker_ranges[:rank])
+
+    if use_tick_cache:
+        tick_cache = tc.get_tick_cache(dataloc, build=False)
+
+    def read_rows(a_range):
+        if use_tick_cache:
+            return tick_cache.read(a_range[0], a_range[1])
+
+        # Raw bytes of the range and the offsets of its rows
+        data = chk.read_byte_range(dataloc, a_range[0], a_range[1],
+                                   split=False)
+        data = np.frombuffer(data, dtype=np.uint8)
+
+        return data, chk.line_starts(data)
+
+    def chunk_of(rows):
+        if use_tick_cache:
+            return nr.TickChunk(0, ticks=rows)
+
+        return nr.TickChunk(0, rows=rows, delimiter=row_delim)
+
+    def latest_time(a_range):
+        # Latest time of the valid rows of a range in epoch seconds, -inf if
+        # it has none
+        times = np.empty(0, dtype=np.int64)
+
+        if a_range[1] > a_range[0]:
+            chunk = chunk_of(read_rows(a_range))
+            times = chunk.timestamps()[chunk.columns()[0]]
+
+        if times.size == 0:
+            return -np.inf
+
+        return np.max(times) / 1e9
+
+    def seed_window(first, start_times):
+        # A rolling window of the valid prices of the ranges of the file
+        # before range first, read back from range to range until they reach
+        # past the window (or the file start), so a rank's window is the one
+        # a single rank would have there. The clock of a time window starts
+        # at the latest time before the first range read
+        nranges = 1
+
+        while True:
+            start = max(first - nranges, 0)
+
+            window = rll.RollingStats(cfg['sigma_window'], sigma_window_kind,
+                                      cfg['sigma_min_periods'])
+            window.start_clock(start_times[start])
+
+            nvalid = 0
+            for a_range in file_ranges[start:first]:
+                if a_range[1] > a_range[0]:
+                    nvalid += nr.window_stats(
+                        window, chunk_of(read_rows(a_range)))[0].size
+
+            # Prices left out of the window mean it reaches back no further
+            if start == 0 or nvalid > window.values.size:
+                return window
+
+            nranges *= 2
+
+    # Window state of the price sigma rule, carried from chunk to chunk of
+    # this rank and seeded with the rows before its first range ("chunk"
+    # uses the statistics of each whole chunk instead, "global" those of the
+    # whole file, applied after the last chunk to the clean prices buffered
+    # meanwhile)
+    price_window = None
+    price_buffer = None
+    reservoir = None
+    if "price_sigma" not in noise_rules:
+        sigma_window_kind = "off"
+
+    if sigma_window_kind == "global":
+        price_buffer = list()
+
+        if global_sigma_mode == "approximate":
+            reservoir = sp.Reservoir(cfg['reservoir_size'],
+                                     cfg['sample_seed'] + rank)
+
+        elif global_sigma_mode != "exact":
+            raise Exception("Unknown global_sigma_mode: " +
+                            str(global_sigma_mode))
+
+    elif sigma_window_kind not in ["chunk", "off"]:
+        # Latest time before every range of the file, where the clock of a
+        # time window is at its start (times that go back are taken as the
+        # latest seen). It costs one more read of the ranges of this rank
+        start_times = np.full(len(file_ranges) + 1, -np.inf)
+        if sigma_window_kind == "time":
+            latest = comm.allgather([latest_time(i) for i in ranges])
+            latest = np.concatenate([[-np.inf]] + latest)
+            start_times = np.maximum.accumulate(latest)
+
+        price_window = seed_window(first_range, start_times)
+
+    # Journal of the chunks this rank has finished, a run restarted with the
+    # same input and settings resumes after the last of them
+    journal = None
+    entries, state = list(), None
+    if cfg['journal']:
+        settings = dict((k, v) for k, v in cfg.items()
+                        if k not in JOURNAL_IGNORED)
+        settings['mpi_size'] = size
+        journal = jn.ChunkJournal(cfg['journal_dir'], "scrub", rank,
+                                  jn.journal_key([dataloc], settings))
+        entries, state = journal.load("scrub")
+
+    if state is not None:
+        price_window, reservoir = state['rolling'], state['reservoir']
+
+    pipeline = nr.RulePipeline(noise_rules, rolling=price_window,
+                               price_buffer=price_buffer,
+                               reservoir=reservoir)
+    global_dedup = global_dedup and "duplicate" in pipeline
+
+    if state is not None:
+        pipeline.set_stats(state['stats'])
+
+    work_result = list()
+    reason_pieces = list()
+    key_pieces = list()
+    key_row_pieces = list()
+    clean_ranges = list()
+    row_length_pieces = list()
+    nrows_local = 0
+    tt.new_time(tag="scrub_time")
+
+    def add_chunk(a_range, rows, first_row, result, reasons):
+        # Keep the results of a scrubbed chunk, with the row fingerprints,
+        # byte range and row lengths taken from its rows. These are not
+        # journaled, a resumed run reads the chunk again for them
+        work_result.append(result)
+        reason_pieces.append(reasons)
+
+        # Row fingerprints for the duplicate search across chunks and ranks,
+        # invalid rows are noise already
+        if global_dedup:
+            row_numbers = np.arange(first_row, first_row + reasons.size)
+
+            if use_tick_cache:
+                key_pieces.append(tc.tick_fingerprints(rows[rows['valid']]))
+                key_row_pieces.append(row_numbers[rows['valid']])
+
+            else:
+                key_pieces.append(tp.row_fingerprints(rows[0], rows[1]))
+                key_row_pieces.append(row_numbers)
+
+        # Byte range and row lengths of the range, to copy its clean rows to
+        # the clean file once all noise is known
+        if clean_output:
+            if use_tick_cache:
+                byte_range = tick_cache.byte_range(a_range[0], a_range[1])
+                row_ends = np.append(rows['offset'][1:], byte_range[1])
+                row_lengths = row_ends - rows['offset']
+
+            else:
+                byte_range = a_range
+                row_lengths = np.diff(np.append(rows[1], rows[0].size))
+
+            clean_ranges.append(byte_range)
+            row_length_pieces.append(row_lengths.astype(np.int32))
+
+        return reasons.size
+
+    def journal_entry(result, reasons):
+        # A finished chunk as its results and noise rows, None for an empty
+        # range
+        if result is None:
+            return None
+
+        noise_rows = np.flatnonzero(reasons).astype(np.int32)
+
+        return {'result': result, 'nrows': reasons.size,
+                'noise_rows': noise_rows, 'noise_codes': reasons[noise_rows]}
+
+    def entry_reasons(entry):
+        # Reason code of every row of a journaled chunk
+        reasons = np.zeros(entry['nrows'], dtype=np.uint8)
+        reasons[entry['noise_rows']] = entry['noise_codes']
+
+        return reasons
+
+    # Chunks finished by an earlier run are read again only if their rows
+    # are needed: fingerprints, row lengths or the prices buffered for the
+    # global price sigma rule
+    reread = global_dedup or clean_output or price_buffer is not None
+
+    def read_resumed(a_range):
+        if reread:
+            return read_rows(a_range)
+
+        return None
+
+    with chk.Prefetcher(read_resumed, ranges[:len(entries)],
+                        cfg['prefetch_depth']) as resumed_rows:
+        for index, (a_range, rows) in enumerate(resumed_rows):
+            entry = entries[index]
+            if entry is None:
+                continue
+
+            reasons = entry_reasons(entry)
+
+            # The clean prices the price sigma rule saw: valid rows flagged
+            # by no earlier rule
+            if price_buffer is not None:
+                if use_tick_cache:
+                    chunk = nr.TickChunk(nrows_local, ticks=rows)
+
+                else:
+                    chunk = nr.TickChunk(nrows_local, rows=rows,
+                                         delimiter=row_delim)
+
+                seen = np.isin(reasons, (nm.SIGNAL,) +
+                               pipeline.codes_after("price_sigma"))
+                seen = chunk.valid_rows(np.flatnonzero(seen))
+                price_buffer.append((seen + nrows_local,
+                                     chunk.columns()[1][seen]))
+                del chunk
+
+            nrows_local += add_chunk(a_range, rows, nrows_local,
+                                     entry['result'], reasons)
+
+    if len(entries) > 0:
+        msg = "rank-{0} resumed after {1} chunks ({2} rows) from the journal"
+        msg = msg.format(rank, len(entries), nrows_local)
+        lg.info(msg)
+
+    # Chunk k + 1 is read in a background thread while chunk k is scrubbed
+    prefetcher = chk.Prefetcher(read_rows, ranges[len(entries):],
+                                cfg['prefetch_depth'])
+    with prefetcher:
+        for index, (a_range, rows) in enumerate(prefetcher, len(entries)):
+            msg = "rank-{0} waited {1} seconds for read"
+            msg = msg.format(rank, round(prefetcher.wait_times[-1], 4))
+            lg.debug(msg)
+
+            if use_tick_cache:
+                nrows_read = rows.size
+
+            else:
+                nrows_read = rows[1].size
+
+            result, reasons = None, None
+            if nrows_read > 0:
+                msg = "rank-{0} read {1} rows, memory used: {2} GB"
+                msg = msg.format(rank, nrows_read,
+                                 round(psutil.virtual_memory()[3] * 1e-9), 2)
+                lg.info(msg)
+
+                # Rank-local, 0 indexed first row of this range
+                if use_tick_cache:
+                    chunk = nr.TickChunk(nrows_local, ticks=rows)
+
+                else:
+                    chunk = nr.TickChunk(nrows_local, rows=rows,
+                                         delimiter=row_delim)
+
+                result, reasons = worker(chunk, pipeline, rank, lg)
+                del chunk
+
+                nrows_local += add_chunk(a_range, rows, nrows_local, result,
+                                         reasons)
+
+            if journal is not None:
+                journal.save("scrub", index, journal_entry(result, reasons),
+                             state={'rolling': price_window,
+                                    'reservoir': reservoir,
+                                    'stats': pipeline.stats()})
 
-        while nrows_left != 0:
-            row_indices.append(utils.size_sequencer(nchunk, nworkers, s_index))
+            msg = "rank-{0} finished execution in {1} seconds"
+            msg = msg.format(rank,
+                             round(tt.elapsed_seconds(tag="scrub_time"), 4))
+            lg.info(msg)
 
-            nrows_left -= nchunk
-            s_index += nchunk
+    tt.pause_time(tag='scrub_time')
+
+    # Global row numbers: shift rank-local indices by the rows of lower ranks
+    row_base = comm.exscan(nrows_local)
+    if row_base is None:
+        row_base = 0
+
+    # Reason code of every row of this rank, indexed by rank-local row
+    reasons = np.concatenate([np.empty(0, dtype=np.uint8)] + reason_pieces)
+    del reason_pieces
+
+    # Rows repeating an earlier row anywhere in the file, whichever chunk or
+    # rank it was read in (repeats within a chunk were found by the workers)
+    n_chunk_noise = np.count_nonzero(reasons)
+    if global_dedup:
+        tt.new_time(tag='global_dedup')
+        keys = np.concatenate([np.empty((0, 2), dtype=np.uint64)] +
+                              key_pieces)
+        key_rows = np.concatenate([np.empty(0, dtype=np.int64)] +
+                                  key_row_pieces)
+
+        global_dups = mpi_utils.shuffle_duplicates(comm, keys,
+                                                   key_rows + row_base)
+        global_dups = nm.flag(reasons, global_dups - row_base, nm.DUPLICATE,
+                              pipeline.codes_after("duplicate"))
+
+        n_global_dups = comm.reduce(global_dups, root=0)
+        tt.pause_time(tag='global_dedup')
+
+        msg = "rank-{0} found {1} noise rows as duplicates across chunks"
+        msg = msg.format(rank, global_dups)
+        lg.debug(msg)
+
+    # Price sigma rule against the statistics of the whole file, exact (one
+    # more pass over the buffered prices) or estimated from a merge of the
+    # reservoir samples of all ranks
+    if sigma_window_kind == "global":
+        tt.new_time(tag='global_sigma')
+        buffered_rows = np.concatenate([np.empty(0, dtype=np.int64)] +
+                                       [i[0] for i in price_buffer])
+        buffered_prices = np.concatenate([np.empty(0, dtype=np.float64)] +
+                                         [i[1] for i in price_buffer])
+        del price_buffer
+
+        # Leave out the duplicates across chunks, rows flagged by rules
+        # applied after this one are kept
+        later_codes = pipeline.codes_after("price_sigma")
+        not_dup = np.isin(reasons[buffered_rows], (nm.SIGNAL,) + later_codes)
+        buffered_rows = buffered_rows[not_dup]
+        buffered_prices = buffered_prices[not_dup]
+
+        # Count, mean and squared deviations of all ranks in one reduction,
+        # the exact statistics (also those the estimates are checked
+        # against)
+        price_moments = mpi_utils.allreduce_accumulator(
+            comm, acc.Moments.from_values(buffered_prices))
+        exact_mean = price_moments.mean
+        exact_stdev = price_moments.stdev(ddof=0)
+
+        if global_sigma_mode == "exact":
+            price_mean, price_stdev = exact_mean, exact_stdev
+            estimates = None
 
-            if nchunk > nrows_left:
-                nchunk = nrows_left
+        else:
+            samples = comm.allgather((reservoir.sample, reservoir.nseen))
+            sample = sp.merge_reservoirs([i[0] for i in samples],
+                                         [i[1] for i in samples],
+                                         cfg['reservoir_size'],
+                                         cfg['sample_seed'])
+            estimates = sp.sample_estimates(sample,
+                                            sum(i[1] for i in samples))
+            price_mean = estimates['mean']
+            price_stdev = estimates['stdev']
+
+        price_sigma = nr.outside_sigma(buffered_prices, price_mean,
+                                       price_stdev)
+        sigma_rows = buffered_rows[price_sigma]
+
+        # Rows the estimated thresholds flag differently from the exact ones
+        if estimates is not None:
+            flips = price_sigma != nr.outside_sigma(buffered_prices,
+                                                    exact_mean, exact_stdev)
+            n_sigma_flips = comm.reduce(int(np.count_nonzero(flips)),
+                                        root=0)
+
+        # Rows of later rules move to the price sigma rule
+        nm.flag(reasons, sigma_rows, nm.PRICE_SIGMA, later_codes)
+
+        n_sigma_rows = comm.reduce(sigma_rows.size, root=0)
+        tt.pause_time(tag='global_sigma')
+
+        msg = "rank-{0} found {1} noise rows as global price sigma noise"
+        msg = msg.format(rank, sigma_rows.size)
+        lg.debug(msg)
+
+    # Copy the clean rows to one file, every rank writes its own part at an
+    # offset given by the sizes of the parts of the lower ranks
+    if clean_output:
+        tt.new_time(tag='clean_write')
+        row_lengths = np.concatenate([np.empty(0, dtype=np.int32)] +
+                                     row_length_pieces)
+        range_bounds = np.cumsum([0] + [i.size for i in row_length_pieces])
+        clean_rows = reasons == nm.SIGNAL
+        clean_bytes = int(np.sum(row_lengths[clean_rows], dtype=np.int64))
+
+        def read_range_bytes(task):
+            data = chk.read_byte_range(dataloc, task[0][0], task[0][1],
+                                       split=False)
+
+            return np.frombuffer(data, dtype=np.uint8)
+
+        def clean_pieces(prefetcher):
+            for task, data in prefetcher:
+                first, last = task[1]
+                keep = np.repeat(clean_rows[first:last],
+                                 row_lengths[first:last])
+
+                yield data[keep]
+
+        clean_tasks = list(zip(clean_ranges,
+                               zip(range_bounds[:-1], range_bounds[1:])))
+        with chk.Prefetcher(read_range_bytes, clean_tasks,
+                            cfg['prefetch_depth']) as clean_prefetcher:
+            clean_size = mpi_utils.write_ordered(
+                comm, cleanloc, clean_pieces(clean_prefetcher), clean_bytes,
+                len(clean_tasks))
+
+        tt.pause_time(tag='clean_write')
+
+        msg = "rank-{0} wrote {1} bytes of clean rows"
+        msg = msg.format(rank, clean_bytes)
+        lg.info(msg)
+
+    # Noise rows of this rank as sorted global row numbers (indexed from 1),
+    # and their reason codes
+    tt.new_time(tag="noise_piece_io")
+    noise_rows = np.flatnonzero(reasons)
+    noise_codes = reasons[noise_rows]
+    noise_rows += row_base + 1
+
+    # Rank 0 gathers the noise rows of all ranks in memory, they are spilled
+    # to cache/ only if rank 0 is short of memory for them
+    n_noise_rows = comm.reduce(noise_rows.size, root=0)
+    spill = None
+    if rank == 0:
+        noise_bytes = n_noise_rows * (noise_rows.itemsize + 1)
+        spill = 2 * noise_bytes > psutil.virtual_memory().available
 
-        row_indices = [item for sublist in row_indices for item in sublist]
-        row_indices = utils.even_split(row_indices, size)
+    spill = comm.bcast(spill, root=0)
 
-        for ipair, wp in zip(row_indices, worker_row_indices):
-            wp.extend(ipair)
+    if spill:
+        nfilename = "noise-rank" + str(rank) + "-"
+        nfilename += dt.datetime.strftime(dt.datetime.utcnow(),
+                                          format="%Y%m%dT%H%M%S")
+        nfilename = "cache/" + nfilename + ".npz"
 
-    else:
-        worker_row_indices = None
-
-    row_indices = comm.scatter(worker_row_indices, root=0)
-
-    # Create row reader object
-    rowreader = chk.Rowread(dataloc, row_indices[0][0])
-    # Create base filename for file pieces
-    nfilename = "noise-rank" + str(rank) + "-"
-    nfilename += dt.datetime.strftime(dt.datetime.utcnow(),
-                                      format="%Y%m%dT%H%M%S")
-    nfilename = "cache/" + nfilename + ".txt"
-
-    with open(nfilename, "w") as nfile:
-        work_result = list()
-        tt.new_time(tag="scrub_time")
-        for index_interval in row_indices:
-            rowreader.set_startrow(index_interval[0] + 1)
-            rows = rowreader.read(index_interval[1] -
-                                  index_interval[0] + 1)
-
-            msg = "rank-{0} read {1} rows, memory used: {2} GB"
-            msg = msg.format(rank, len(rows),
-                             round(psutil.virtual_memory()[3] * 1e-9), 2)
-            lg.info(msg)
+        with open(nfilename, "wb") as nfile:
+            np.savez(nfile, rows=noise_rows, codes=noise_codes)
 
-            r = worker(rows, nfile, index_interval, rank, lg,
-                       noiserow_check, row_delim)
-            work_result.append(r)
+        noise_pieces = comm.gather(nfilename, root=0)
 
-            msg = "rank-{0} finished execution in {1} seconds"
-            msg = msg.format(rank, round(tt.elapsed_seconds(tag="scrub_time"),
-                                         4))
-            lg.info(msg)
+        msg = "rank-{0} spilled {1} noise row indices to disk"
+        msg = msg.format(rank, noise_rows.size)
+        lg.info(msg)
 
-        tt.pause_time(tag='scrub_time')
-
-    scrub_results = comm.gather(work_result, root=0)
+    else:
+        noise_pieces = [(mpi_utils.gatherv_rows(comm, noise_rows),
+                         mpi_utils.gatherv_rows(comm, noise_codes))]
+
+    tt.pause_time(tag="noise_piece_io")
+    n_global_noise = np.count_nonzero(reasons) - n_chunk_noise
+    work_result.append(scrub_record(
+        n_noise=n_global_noise,
+        noiseio_elapsed=tt.elapsed_seconds(tag='noise_piece_io'),
+        read_wait=prefetcher.total_wait()))
+
+    # Results of the chunks merged pairwise, then over ranks in one reduction
+    r = mpi_utils.reduce_accumulator(comm, acc.tree_merge(work_result),
+                                     root=0)
+
+    rule_fields = list()
+    for name, stats in sorted(pipeline.stats().items()):
+        rule_fields.append((name, acc.Record([
+            ("examined", acc.Count(stats['examined'])),
+            ("flagged", acc.Count(stats['flagged'])),
+            ("seconds", acc.Sum(stats['seconds']))])))
+
+    rule_stats = mpi_utils.reduce_accumulator(comm, acc.Record(rule_fields),
+                                              root=0)
 
     if rank == 0:
-        scrub_results = [item for sublist in scrub_results for item in sublist]
-        r = utils.gather_dict(scrub_results)
+        r = dict((name, r[name].value) for name in r.names)
 
-        # Combine noise files
+        # Set the noise rows of the ranks, in rank order, in one bitmap per
+        # rule while writing them to noise.txt
         tt.new_time(tag='noise_agg')
-        if os.path.exists(noiseloc) is True:
-            os.remove(noiseloc)
+        noise_mask = nm.NoiseMask.from_rows(np.empty(0, dtype=np.int64),
+                                            np.empty(0, dtype=np.uint8),
+                                            r['nrows'])
 
-        cachefiles = os.listdir("cache")
-        noisefiles = [i for i in cachefiles if i.startswith("noise")]
-        for a_file in noisefiles:
-            with open("cache/" + a_file, "r") as cachenoisefile:
-                with open(noiseloc, "a") as noisefile:
-                    noisefile.writelines(cachenoisefile.readlines())
+        def noise_row_pieces():
+            for a_piece in noise_pieces:
+                if spill:
+                    with np.load(a_piece) as saved:
+                        spilled = (saved['rows'], saved['codes'])
 
-            os.remove("cache/" + a_file)
+                    os.remove(a_piece)
+                    a_piece = spilled
 
-        tt.pause_time(tag='noise_agg')
+                noise_mask.add_rows(a_piece[0], a_piece[1])
 
-        tt.new_time(tag='signal_write')
-        with open(noiseloc, 'r') as noisefile:
-            noise_indices = noisefile.readlines()
-            noise_indices = set(noise_indices)
+                yield a_piece[0]
+
+        nm.write_rows(noiseloc, noise_row_pieces())
+        noise_mask.save(noisemaskloc)
+        rule_counts = noise_mask.counts()
 
-        with open(signalloc, "w") as signalfile:
-            for i in xrange(nrows):
-                if i not in noise_indices:
-                    signalfile.write(str(i) + "\n")
+        tt.pause_time(tag='noise_agg')
 
+        tt.new_time(tag='signal_write')
+        nm.write_rows(signalloc, noise_mask.iter_signal())
         tt.pause_time(tag='signal_write')
 
         tt.pause_time()
@@ -312,12 +714,14 @@ if __name__ == "__main__":
                     tt.elapsed_pretty(ndig_secs=4)))
 
         scrubbing_time = tt.elapsed_seconds(tag='scrub_time')
-        scrubbing_time -= r['noiseio_elapsed']
         kvs.append(("Row scrubbing elapsed time",
                     utils.pretty_time_string(seconds=scrubbing_time,
                                              ndig_secs=4)))
-        kvs.append(("Row counting elapsed time",
-                    tt.elapsed_pretty('get_nrow')))
+        kvs.append(("Work planning elapsed time",
+                    tt.elapsed_pretty('plan_ranges', ndig_secs=4)))
+        kvs.append(("Read wait time (all ranks)",
+                    utils.pretty_time_string(seconds=r['read_wait'],
+                                             ndig_secs=4)))
 
         noiseio_time = tt.elapsed_seconds(tag='noise_agg')
         noiseio_time += r['noiseio_elapsed']
@@ -329,9 +733,68 @@ if __name__ == "__main__":
         kvs.append(("Row count", r['nrows']))
         kvs.append(("Total # noise rows", r['n_noise']))
 
+        for name in nm.RULES:
+            kvs.append(("# noise rows ({0})".format(name), rule_counts[name]))
+
+        # Chunk by chunk work of every rule, summed over ranks, in the order
+        # the rules were applied
+        for name in pipeline.names:
+            stats = rule_stats[name]
+            msg = "{0} examined, {1} flagged, {2} seconds"
+            kvs.append(("Rule {0}".format(name),
+                        msg.format(stats['examined'].value,
+                                   stats['flagged'].value,
+                                   round(stats['seconds'].value, 4))))
+
+        if global_dedup:
+            kvs.append(("Duplicates across chunks", n_global_dups))
+            kvs.append(("Duplicate search elapsed time",
+                        tt.elapsed_pretty(tag='global_dedup', ndig_secs=4)))
+
+        if sigma_window_kind == "global":
+            kvs.append(("Global sigma mode", global_sigma_mode))
+            kvs.append(("Global price mean", round(price_mean, 6)))
+            kvs.append(("Global price stdev", round(price_stdev, 6)))
+
+            if estimates is not None:
+                kvs.append(("Price sample size", estimates['n']))
+                kvs.append(("Mean error bound (95%)",
+                            round(estimates['mean_error'], 6)))
+                kvs.append(("Stdev error bound (95%)",
+                            round(estimates['stdev_error'], 6)))
+                kvs.append(("Threshold error bound (95%)",
+                            round(estimates['mean_error'] +
+                                  3 * estimates['stdev_error'], 6)))
+                kvs.append(("Sample kurtosis",
+                            round(estimates['kurtosis'], 6)))
+                kvs.append(("Exact price mean", round(exact_mean, 6)))
+                kvs.append(("Exact price stdev", round(exact_stdev, 6)))
+                kvs.append(("Rows flagged unlike exact thresholds",
+                            n_sigma_flips))
+
+                for q, estimate, lower, upper in estimates['quantiles']:
+                    msg = "{0:.6f} [{1:.6f}, {2:.6f}]"
+                    kvs.append(("Price quantile {0:g}% (95% interval)".format(
+                                q * 100), msg.format(estimate, lower, upper)))
+
+            kvs.append(("Global price sigma noise", n_sigma_rows))
+            kvs.append(("Global sigma elapsed time",
+                        tt.elapsed_pretty(tag='global_sigma', ndig_secs=4)))
+
+        if clean_output:
+            kvs.append(("Clean file", cleanloc))
+            kvs.append(("Clean file size (bytes)", clean_size))
+            kvs.append(("Clean file write elapsed time",
+                        tt.elapsed_pretty(tag='clean_write', ndig_secs=4)))
+
         velocity = r['nrows'] / tt.elapsed_seconds(tag='scrub_time')
         velocity = round(velocity, 4)
         kvs.append(("Velocity (rows parsed / sec)", velocity))
 
         result_log.add_section_kvs(kvs)
         result_log.exec_section()
+
+    # The run is complete, its journals are no longer needed
+    comm.barrier()
+    if journal is not None:
+        journal.clear()
@@ -0,0 +1,312 @@
+import numpy as np
+import math_utils as mu
+
+
+class Accumulator(object):
+    """A mergeable summary of a set of values
+
+    Summaries of disjoint sets merge into the summary of their union, so
+    partial results of chunks and ranks combine in any grouping: pairwise
+    inside a rank (see tree_merge) or across ranks in one MPI reduction (see
+    mpi_utils.reduce_accumulator). The state packs into a fixed number of
+    float64 slots, the buffer sent by MPI. Counts are exact below 2 ** 53
+
+    Subclasses set size and implement empty, pack, unpack, merge and add
+    """
+    size = 0
+
+    def empty(self):
+        """ An accumulator of the same kind and shape, of no values """
+        raise NotImplementedError
+
+    def pack(self):
+        """ The state as numpy.ndarray(float64) of size elements """
+        raise NotImplementedError
+
+    def unpack(self, buf):
+        """ Set the state from a buffer written by pack, returns self """
+        raise NotImplementedError
+
+    def merge(self, other):
+        """ Add the values of another accumulator of the same kind and
+        shape, in place, returns self """
+        raise NotImplementedError
+
+    def add(self, values):
+        """ Add an array of values, in place, returns self """
+        raise NotImplementedError
+
+    def copy(self):
+        """ An independent accumulator of the same values """
+        return self.empty().merge(self)
+
+
+class Sum(Accumulator):
+    """Sum of values"""
+    size = 1
+
+    def __init__(self, value=0.0):
+        self.value = np.float64(value)
+
+    def empty(self):
+        return Sum()
+
+    def pack(self):
+        return np.array([self.value], dtype=np.float64)
+
+    def unpack(self, buf):
+        self.value = np.float64(buf[0])
+
+        return self
+
+    def merge(self, other):
+        self.value += other.value
+
+        return self
+
+    def add(self, values):
+        self.value += np.sum(values, dtype=np.float64)
+
+        return self
+
+
+class Count(Accumulator):
+    """Number of values, or of rows, items and so on given to the
+    constructor"""
+    size = 1
+
+    def __init__(self, value=0):
+        self.value = int(value)
+
+    def empty(self):
+        return Count()
+
+    def pack(self):
+        return np.array([self.value], dtype=np.float64)
+
+    def unpack(self, buf):
+        self.value = int(buf[0])
+
+        return self
+
+    def merge(self, other):
+        self.value += other.value
+
+        return self
+
+    def add(self, values):
+        self.value += np.size(values)
+
+        return self
+
+
+class MinMax(Accumulator):
+    """Smallest and largest value, +inf and -inf of no values"""
+    size = 2
+
+    def __init__(self, low=np.inf, high=-np.inf):
+        self.min = np.float64(low)
+        self.max = np.float64(high)
+
+    def empty(self):
+        return MinMax()
+
+    def pack(self):
+        return np.array([self.min, self.max], dtype=np.float64)
+
+    def unpack(self, buf):
+        self.min, self.max = np.float64(buf[0]), np.float64(buf[1])
+
+        return self
+
+    def merge(self, other):
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+        return self
+
+    def add(self, values):
+        values = np.asarray(values, dtype=np.float64)
+
+        if values.size > 0:
+            self.min = min(self.min, np.min(values))
+            self.max = max(self.max, np.max(values))
+
+        return self
+
+
+class Moments(mu.Moments, Accumulator):
+    """Count, mean and central moment sums, see math_utils.Moments"""
+    size = 5
+
+    def empty(self):
+        return Moments()
+
+    def pack(self):
+        return np.array([self.n, self.mean, self.m2, self.m3, self.m4],
+                        dtype=np.float64)
+
+    def unpack(self, buf):
+        self.n = int(buf[0])
+        self.mean, self.m2, self.m3, self.m4 = [np.float64(i)
+                                                for i in buf[1:5]]
+
+        return self
+
+    def add(self, values):
+        return self.merge(Moments.from_values(values))
+
+
+class Histogram(Accumulator):
+    """Counts of values in fixed bins
+
+    Bins are those of numpy.histogram for the bin edges, every bin but the
+    last is half open. Values below the first edge or above the last one
+    (and NaN) are counted apart, so no value is lost. Histograms merge only
+    with histograms of the same edges
+    """
+
+    def __init__(self, edges):
+        """ Histogram constructor
+
+        Args
+        ------
+        edges : numpy.ndarray(float64)
+            Increasing bin edges, one more than the number of bins
+        """
+        self.edges = np.asarray(edges, dtype=np.float64)
+        self.counts = np.zeros(self.edges.size - 1, dtype=np.int64)
+        self.below = 0
+        self.above = 0
+
+    @property
+    def size(self):
+        return self.counts.size + 2
+
+    def empty(self):
+        return Histogram(self.edges)
+
+    def pack(self):
+        return np.concatenate([self.counts, [self.below, self.above]]).astype(
+            np.float64)
+
+    def unpack(self, buf):
+        buf = np.asarray(buf)
+        self.counts = buf[:self.counts.size].astype(np.int64)
+        self.below, self.above = int(buf[-2]), int(buf[-1])
+
+        return self
+
+    def merge(self, other):
+        if not np.array_equal(self.edges, other.edges):
+            raise ValueError("Histograms of different bin edges")
+
+        self.counts += other.counts
+        self.below += other.below
+        self.above += other.above
+
+        return self
+
+    def add(self, values):
+        values = np.asarray(values, dtype=np.float64)
+
+        below = values < self.edges[0]
+        inside = np.logical_and(values >= self.edges[0],
+                                values <= self.edges[-1])
+
+        self.counts += np.histogram(values[inside], self.edges)[0]
+        self.below += int(np.count_nonzero(below))
+        self.above += values.size - int(np.count_nonzero(inside | below))
+
+        return self
+
+
+class Record(Accumulator):
+    """Named accumulators reduced together, packed one after the other
+
+    Records of the same names (in the same order) and accumulator kinds
+    merge field by field. A field can be a Record itself
+    """
+
+    def __init__(self, fields):
+        """ Record constructor
+
+        Args
+        ------
+        fields : list
+            (name, Accumulator) pairs, in packing order
+        """
+        self.fields = list(fields)
+        self._index = dict((name, i) for i, (name, _) in
+                           enumerate(self.fields))
+
+    def __getitem__(self, name):
+        return self.fields[self._index[name]][1]
+
+    def __contains__(self, name):
+        return name in self._index
+
+    @property
+    def names(self):
+        return [name for name, _ in self.fields]
+
+    @property
+    def size(self):
+        return sum(field.size for _, field in self.fields)
+
+    def empty(self):
+        return Record((name, field.empty()) for name, field in self.fields)
+
+    def pack(self):
+        return np.concatenate([np.empty(0, dtype=np.float64)] +
+                              [field.pack() for _, field in self.fields])
+
+    def unpack(self, buf):
+        offset = 0
+        for _, field in self.fields:
+            field.unpack(buf[offset:(offset + field.size)])
+            offset += field.size
+
+        return self
+
+    def merge(self, other):
+        if self.names != other.names:
+            raise ValueError("Records of different fields")
+
+        for (_, field), (_, other_field) in zip(self.fields, other.fields):
+            field.merge(other_field)
+
+        return self
+
+    def add(self, values):
+        raise TypeError("Values are added to the fields of a Record")
+
+
+def tree_merge(accumulators):
+    """ Merge accumulators pairwise, level by level
+
+    Every value goes through about log2(n) merges, against n for merging the
+    accumulators one after the other, which keeps the rounding error of sums
+    and moments of many chunks low
+
+    Args:
+        accumulators (list): Accumulators of the same kind and shape, left
+            unchanged
+
+    Returns (Accumulator):
+        A new accumulator of the values of all of them
+    """
+    level = [i.copy() for i in accumulators]
+    if len(level) == 0:
+        raise ValueError("No accumulators to merge")
+
+    while len(level) > 1:
+        merged = [level[i].merge(level[i + 1])
+                  for i in range(0, len(level) - 1, 2)]
+
+        if len(level) % 2 == 1:
+            merged.append(level[-1])
+
+        level = merged
+
+    return level[0]
@@ -0,0 +1,125 @@
+import os
+import tempfile
+import numpy as np
+
+
+class ArrayCache(object):
+    """Arrays kept between passes over a file, within a memory budget
+
+    Arrays are kept in memory while their total size fits the budget. Those
+    that do not fit are written to a temporary numpy.memmap in the spill
+    directory, read back from the page cache or disk when asked for, or
+    dropped if there is no spill directory. A dropped array is not in the
+    cache and has to be computed again
+
+    Objects of this class should be used with the with statement, or closed
+    with close(), so spill files are removed
+    """
+
+    def __init__(self, budget, spill_dir=None):
+        """ ArrayCache constructor
+
+        Args
+        ------
+        budget : int
+            Bytes of arrays kept in memory
+
+        spill_dir : str
+            Directory of the spill files, None to drop the arrays over the
+            budget
+        """
+        self.budget = int(budget)
+        self.spill_dir = spill_dir
+        self.arrays = dict()
+        self.spill_paths = list()
+        self.nbytes_memory = 0
+        self.nbytes_spilled = 0
+        self.ndropped = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __contains__(self, key):
+        return key in self.arrays
+
+    def __len__(self):
+        return len(self.arrays)
+
+    def _spill(self, array):
+        fd, path = tempfile.mkstemp(suffix=".dat", prefix="arraycache-",
+                                    dir=self.spill_dir)
+        os.close(fd)
+        self.spill_paths.append(path)
+
+        spilled = np.memmap(path, dtype=array.dtype, mode="w+",
+                            shape=array.shape)
+        spilled[...] = array
+        spilled.flush()
+
+        return spilled
+
+    def put(self, key, array):
+        """ Keep an array, replacing the array of the same key
+
+        Args
+        ------
+        key : hashable
+            Key of the array
+
+        array : numpy.ndarray
+            Array to keep, not copied if it stays in memory
+
+        Returns
+        ---------
+          str, where the array is kept: "memory", "disk" or None if dropped
+        """
+        self.discard(key)
+
+        if self.nbytes_memory + array.nbytes <= self.budget:
+            self.arrays[key] = array
+            self.nbytes_memory += array.nbytes
+
+            return "memory"
+
+        if self.spill_dir is None:
+            self.ndropped += 1
+
+            return None
+
+        self.arrays[key] = self._spill(array)
+        self.nbytes_spilled += array.nbytes
+
+        return "disk"
+
+    def get(self, key):
+        """ The array of a key, a numpy.memmap if it was spilled, None if it
+        is not in the cache """
+        return self.arrays.get(key)
+
+    def discard(self, key):
+        """ Forget the array of a key, if any """
+        array = self.arrays.pop(key, None)
+
+        if array is None:
+            return
+
+        if isinstance(array, np.memmap):
+            self.nbytes_spilled -= array.nbytes
+
+        else:
+            self.nbytes_memory -= array.nbytes
+
+    def close(self):
+        """ Empty the cache and remove its spill files """
+        self.arrays = dict()
+        self.nbytes_memory = 0
+        self.nbytes_spilled = 0
+
+        for path in self.spill_paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+        self.spill_paths = list()
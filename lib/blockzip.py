@@ -0,0 +1,504 @@
+import bz2
+import os
+import zlib
+import numpy as np
+
+try:
+    import zstandard
+
+except ImportError:
+    # zstd blocks are optional
+    zstandard = None
+
+
+BLOCK_INDEX_SUFFIX = ".bzidx.npz"
+BLOCK_SIZE = 2 ** 22
+CODECS = ["gzip", "bz2", "zstd"]
+CODEC_EXTENSIONS = {"gzip": ".gz", "bz2": ".bz2", "zstd": ".zst"}
+
+# Codecs whose blocks BlockIndex.scan can find again
+SCANNED_CODECS = ["gzip", "bz2"]
+
+
+def _require_zstd():
+    if zstandard is None:
+        raise ImportError("zstd blocks need the zstandard package")
+
+
+def compress_block(data, codec="gzip", level=6):
+    """Compress one block into a self contained gzip member, bz2 stream or
+    zstd frame
+
+    Concatenated blocks are still a valid file for the codec's command line
+    tool (zcat, bzcat, zstdcat)
+    """
+    if codec == "gzip":
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+        return compressor.compress(data) + compressor.flush()
+
+    elif codec == "bz2":
+        return bz2.compress(data, level)
+
+    elif codec == "zstd":
+        _require_zstd()
+
+        return zstandard.ZstdCompressor(level=level).compress(data)
+
+    raise ValueError("Unknown codec: {0}".format(codec))
+
+
+def decompress_block(data, codec="gzip"):
+    """Decompress one block written by compress_block"""
+    if codec == "gzip":
+        return zlib.decompress(data, 31)
+
+    elif codec == "bz2":
+        return bz2.decompress(data)
+
+    elif codec == "zstd":
+        _require_zstd()
+
+        return zstandard.ZstdDecompressor().decompress(data)
+
+    raise ValueError("Unknown codec: {0}".format(codec))
+
+
+def _decompressor(codec):
+    if codec == "gzip":
+        return zlib.decompressobj(31)
+
+    elif codec == "bz2":
+        return bz2.BZ2Decompressor()
+
+    raise ValueError("Scanning blocks is not supported for {0}".format(codec))
+
+
+class BlockIndex(object):
+    """Block offset index of a block compressed text file
+
+    A block compressed file is a series of independently compressed blocks,
+    each holding whole lines, in the style of BGZF. For every block the index
+    stores its compressed offset, its uncompressed offset and the line number
+    (indexed from 1) of its first line. Each array has one extra trailing
+    element holding the totals, so block i spans coffsets[i]:coffsets[i + 1]
+
+    The index is kept next to the compressed file (file + BLOCK_INDEX_SUFFIX)
+    and records the compressed file's size and modification time
+    """
+
+    def __init__(self, file, codec, coffsets, uoffsets, rows, size, mtime):
+        self.filename = file
+        self.codec = codec
+        self.coffsets = np.asarray(coffsets, dtype=np.int64)
+        self.uoffsets = np.asarray(uoffsets, dtype=np.int64)
+        self.rows = np.asarray(rows, dtype=np.int64)
+        self.size = int(size)
+        self.mtime = float(mtime)
+
+    @property
+    def nblocks(self):
+        return self.coffsets.size - 1
+
+    @property
+    def nrows(self):
+        return int(self.rows[-1]) - 1
+
+    @property
+    def usize(self):
+        """Uncompressed size of the file"""
+        return int(self.uoffsets[-1])
+
+    @staticmethod
+    def sidecar_path(file):
+        return file + BLOCK_INDEX_SUFFIX
+
+    @classmethod
+    def load(cls, file):
+        """ Load the block index of a compressed file
+
+        Returns
+        ---------
+          A BlockIndex object, or None if there is no readable index
+        """
+        try:
+            with np.load(cls.sidecar_path(file)) as sidecar:
+                meta = sidecar['meta']
+                result = cls(file, CODECS[int(meta[2])], sidecar['coffsets'],
+                             sidecar['uoffsets'], sidecar['rows'], meta[0],
+                             meta[1])
+
+        except (IOError, OSError, KeyError, ValueError, IndexError):
+            result = None
+
+        return result
+
+    @classmethod
+    def scan(cls, file, codec):
+        """ Rebuild the index of a block compressed file by decompressing it
+        once, block by block (gzip and bz2 only)
+        """
+        fstat = os.stat(file)
+        coffsets = [0]
+        uoffsets = [0]
+        rows = [1]
+
+        position = 0
+        nbytes = 0
+        nnewlines = 0
+        last_byte = b"\n"
+
+        def close_block():
+            coffsets.append(position)
+            uoffsets.append(uoffsets[-1] + nbytes)
+            rows.append(rows[-1] + nnewlines + (last_byte != b"\n"))
+
+        with open(file, "rb") as f:
+            pending = b""
+            decompressor = _decompressor(codec)
+
+            while True:
+                data = pending or f.read(BLOCK_SIZE)
+                pending = b""
+
+                if not data:
+                    break
+
+                try:
+                    out = decompressor.decompress(data)
+                    unused = decompressor.unused_data
+
+                except EOFError:
+                    # Python 2 bz2 raises once its stream has ended
+                    out = b""
+                    unused = data
+
+                nbytes += len(out)
+                nnewlines += out.count(b"\n")
+                position += len(data) - len(unused)
+
+                if out:
+                    last_byte = out[-1:]
+
+                if unused or getattr(decompressor, "eof", False):
+                    close_block()
+
+                    pending = unused
+                    decompressor = _decompressor(codec)
+                    nbytes = 0
+                    nnewlines = 0
+                    last_byte = b"\n"
+
+        if position > coffsets[-1]:
+            close_block()
+
+        return cls(file, codec, coffsets, uoffsets, rows, fstat.st_size,
+                   fstat.st_mtime)
+
+    def save(self):
+        """ Write the index next to the compressed file
+
+        Returns
+        ---------
+          True if the index was written, False otherwise
+        """
+        path = self.sidecar_path(self.filename)
+        tmp_path = "{0}.{1}.tmp".format(path, os.getpid())
+        meta = np.array([self.size, self.mtime, CODECS.index(self.codec)],
+                        dtype=np.float64)
+
+        try:
+            with open(tmp_path, "wb") as f:
+                np.savez(f, coffsets=self.coffsets, uoffsets=self.uoffsets,
+                         rows=self.rows, meta=meta)
+
+            os.rename(tmp_path, path)
+
+        except (IOError, OSError):
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+            return False
+
+        return True
+
+    def is_stale(self):
+        try:
+            fstat = os.stat(self.filename)
+
+        except OSError:
+            return True
+
+        return fstat.st_size != self.size or fstat.st_mtime != self.mtime
+
+    def block_of(self, uoffset):
+        """Block number holding an uncompressed offset"""
+        i = int(np.searchsorted(self.uoffsets, uoffset, side="right")) - 1
+
+        return min(max(i, 0), max(self.nblocks - 1, 0))
+
+    def next_block_start(self, uoffset):
+        """Uncompressed offset of the first block starting at or after
+        uoffset"""
+        i = int(np.searchsorted(self.uoffsets, uoffset, side="left"))
+
+        return int(self.uoffsets[min(i, self.nblocks)])
+
+
+def codec_of(file):
+    """Codec of a compressed file, from its extension (None if unknown)"""
+    for codec, extension in CODEC_EXTENSIONS.items():
+        if file.endswith(extension):
+            return codec
+
+    return None
+
+
+def get_block_index(file):
+    """ Block index of a block compressed file
+
+    A stale index is rebuilt by scanning the file for gzip and bz2 blocks.
+    zstd blocks cannot be scanned, a stale index of a zstd file raises
+    ValueError and the file has to be written again with recompress.py
+
+    Returns
+    ---------
+      A BlockIndex object, or None if the file is not block compressed
+    """
+    index = BlockIndex.load(file)
+
+    if index is None:
+        return None
+
+    if index.is_stale():
+        if index.codec not in SCANNED_CODECS:
+            msg = "{0} changed since its block index was written and {1} "
+            msg += "blocks cannot be scanned, re-run recompress.py on the "
+            msg += "text file"
+            raise ValueError(msg.format(file, index.codec))
+
+        index = BlockIndex.scan(file, index.codec)
+        index.save()
+
+    return index
+
+
+def is_blocked(file):
+    """Whether a file is block compressed (has a block index)"""
+    return os.path.exists(BlockIndex.sidecar_path(file))
+
+
+class BlockFile(object):
+    """Read-only file object over the uncompressed content of a block
+    compressed file
+
+    seek() and tell() use uncompressed offsets. Seeking only decompresses the
+    block holding the target offset, so readers can start anywhere in the
+    file without decompressing what comes before it
+    """
+
+    def __init__(self, file, index=None):
+        """ BlockFile constructor
+
+        Args
+        ------
+        file : str
+            Path to directory and filename of the block compressed file
+
+        index : BlockIndex
+            Index of the file, loaded with get_block_index if not provided
+        """
+        if index is None:
+            index = get_block_index(file)
+
+        if index is None:
+            raise IOError("{0} has no block index".format(file))
+
+        self.name = file
+        self.index = index
+        self.file = open(file, "rb")
+        self.block_id = -1
+        self.block = b""
+        self.block_pos = 0
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        a_line = self.readline()
+
+        if not a_line:
+            raise StopIteration
+
+        return a_line
+
+    next = __next__
+
+    def __load_block__(self, block_id):
+        if block_id != self.block_id:
+            start = int(self.index.coffsets[block_id])
+            end = int(self.index.coffsets[block_id + 1])
+
+            self.file.seek(start)
+            self.block = decompress_block(self.file.read(end - start),
+                                          self.index.codec)
+            self.block_id = block_id
+
+    def __at_end__(self):
+        return self.block_pos >= len(self.block) and \
+            self.block_id >= self.index.nblocks - 1
+
+    def __next_block__(self):
+        if self.block_pos >= len(self.block) and \
+                self.block_id < self.index.nblocks - 1:
+            self.__load_block__(self.block_id + 1)
+            self.block_pos = 0
+
+    def close(self):
+        if not self.closed:
+            self.file.close()
+            self.block = b""
+            self.closed = True
+
+    def tell(self):
+        if self.block_id < 0:
+            return 0
+
+        return int(self.index.uoffsets[self.block_id]) + self.block_pos
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self.tell()
+
+        elif whence == 2:
+            offset += self.index.usize
+
+        offset = min(max(offset, 0), self.index.usize)
+
+        if self.index.nblocks == 0:
+            return
+
+        block_id = self.index.block_of(offset)
+        self.__load_block__(block_id)
+        self.block_pos = offset - int(self.index.uoffsets[block_id])
+
+    def read(self, size=-1):
+        if self.block_id < 0:
+            self.seek(0)
+
+        if size is None or size < 0:
+            size = self.index.usize - self.tell()
+
+        pieces = list()
+        while size > 0 and not self.__at_end__():
+            self.__next_block__()
+
+            piece = self.block[self.block_pos:(self.block_pos + size)]
+            self.block_pos += len(piece)
+            size -= len(piece)
+            pieces.append(piece)
+
+        return b"".join(pieces)
+
+    def readline(self):
+        if self.block_id < 0:
+            self.seek(0)
+
+        pieces = list()
+        while not self.__at_end__():
+            self.__next_block__()
+
+            end = self.block.find(b"\n", self.block_pos)
+
+            if end >= 0:
+                pieces.append(self.block[self.block_pos:(end + 1)])
+                self.block_pos = end + 1
+                break
+
+            pieces.append(self.block[self.block_pos:])
+            self.block_pos = len(self.block)
+
+        return b"".join(pieces)
+
+    def readlines(self):
+        result = list()
+        for a_line in self:
+            result.append(a_line)
+
+        return result
+
+
+def compress_file(source, dest, codec="gzip", block_size=BLOCK_SIZE,
+                  level=6, source_open=open):
+    """ Recompress a text file into a block compressed file with its index
+
+    Blocks hold whole lines and about block_size uncompressed bytes each.
+    The output is written to a temporary file and renamed into place
+
+    Args
+    ------
+    source : str
+        Path to the text file to recompress
+
+    dest : str
+        Path of the block compressed file. The index is written next to it
+
+    codec : str
+        One of "gzip", "bz2" or "zstd" (needs the zstandard package)
+
+    block_size : int
+        Approximate number of uncompressed bytes per block
+
+    level : int
+        Compression level passed to the codec
+
+    source_open : callable
+        Opens the source for reading in binary mode, e.g. gzip.open for an
+        already compressed source
+
+    Returns
+    ---------
+      The BlockIndex of the new file
+    """
+    if codec not in CODECS:
+        raise ValueError("Unknown codec: {0}".format(codec))
+
+    coffsets = [0]
+    uoffsets = [0]
+    rows = [1]
+    tmp_dest = "{0}.{1}.tmp".format(dest, os.getpid())
+
+    with source_open(source, "rb") as src, open(tmp_dest, "wb") as dst:
+        while True:
+            block = src.read(block_size)
+
+            if not block:
+                break
+
+            # Extend the block to the end of its last line
+            if not block.endswith(b"\n"):
+                block += src.readline()
+
+            compressed = compress_block(block, codec, level)
+            dst.write(compressed)
+
+            nrows = block.count(b"\n") + (not block.endswith(b"\n"))
+            coffsets.append(coffsets[-1] + len(compressed))
+            uoffsets.append(uoffsets[-1] + len(block))
+            rows.append(rows[-1] + nrows)
+
+    os.rename(tmp_dest, dest)
+
+    fstat = os.stat(dest)
+    index = BlockIndex(dest, codec, coffsets, uoffsets, rows, fstat.st_size,
+                       fstat.st_mtime)
+    index.save()
+
+    return index
@@ -1,7 +1,141 @@
+import io
 import itertools as it
+import math
+import mmap
+import multiprocessing as mp
+import os
+import sys
+import threading
+import time
+from collections import deque
+import numpy as np
+import blockzip
 
+try:
+    import Queue as queue
 
-def simple_idchunker(iterable, chunk_size=1000):
+except ImportError:
+    # Python 3
+    import queue
+
+try:
+    from numpy.lib.stride_tricks import sliding_window_view
+
+except ImportError:
+    # numpy < 1.20
+    sliding_window_view = None
+
+try:
+    lazy_range = xrange
+
+except NameError:
+    # Python 3
+    lazy_range = range
+
+
+INDEX_SUFFIX = ".lidx.npz"
+INDEX_STEP = 10000
+INDEX_BLOCK_SIZE = 2 ** 24
+COUNT_BLOCK_SIZE = 2 ** 26
+SAMPLE_SIZE = 2 ** 20
+SCAN_BLOCK_SIZE = 2 ** 24
+
+
+def open_rows(file, read_mode="rb"):
+    """Open a text file for reading rows
+
+    Block compressed files (see blockzip) are opened as a blockzip.BlockFile,
+    which reads and seeks in uncompressed offsets. Other files are opened with
+    open()
+
+    Args:
+        file (str):
+            Path to directory and filename to open
+
+        read_mode (str):
+            The file mode used for plain files
+
+    Returns (file):
+        A file object
+    """
+    if blockzip.is_blocked(file):
+        return blockzip.BlockFile(file)
+
+    return open(file, read_mode)
+
+
+def data_size(file):
+    """Size of a text file in bytes, uncompressed for block compressed files
+    """
+    block_index = blockzip.get_block_index(file)
+
+    if block_index is not None:
+        return block_index.usize
+
+    return os.stat(file).st_size
+
+
+class Chunk(object):
+    """Compact chunk of consecutive elements and their index values
+
+    A Chunk holds the payload (a list or numpy array) with the id of its first
+    element and its length, instead of one {"chunk": ..., "id": ...} dict per
+    element. Ids are produced lazily by the ids property
+
+    Iterating a Chunk or indexing it returns payload elements. items() pairs
+    them with their ids, like the dicts simple_chunker returns by default
+    """
+
+    __slots__ = ("payload", "start_id", "length")
+
+    def __init__(self, payload, start_id=0):
+        """ Chunk constructor
+
+        Args
+        ------
+        payload : list or numpy.ndarray
+            The elements of the chunk
+
+        start_id : int
+            Index value of the first element
+        """
+        self.payload = payload
+        self.start_id = start_id
+        self.length = len(payload)
+
+    @property
+    def ids(self):
+        """Index values of the elements
+
+        A numpy int64 arange if the payload is a numpy array, otherwise a
+        lazy range
+        """
+        end_id = self.start_id + self.length
+
+        if isinstance(self.payload, np.ndarray):
+            return np.arange(self.start_id, end_id, dtype=np.int64)
+
+        return lazy_range(self.start_id, end_id)
+
+    def items(self):
+        """Iterable of (id, element) pairs"""
+        return zip(self.ids, self.payload)
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        return iter(self.payload)
+
+    def __getitem__(self, i):
+        return self.payload[i]
+
+    def __repr__(self):
+        return "Chunk(start_id={0}, length={1})".format(self.start_id,
+                                                        self.length)
+
+
+def simple_idchunker(iterable, chunk_size=1000, compact=False):
     """Evenly chunked indices with generator
 
     Creates a generator that returns index values mapped to iterable. Each call
@@ -17,10 +151,41 @@ def simple_idchunker(iterable, chunk_size=1000):
         chunk_size (int):
             The size of each returned collection
 
-    Returns (list(int)):
+        compact (bool):
+            Whether to return lazy ranges of index values instead of lists.
+            The length of sized iterables (lists, arrays) is used directly,
+            without iterating over them
+
+    Returns (list(int) or range):
         The generator returns a list of index values of chunk size or less.
         Each call returns the next set of unique index values
     """
+    if compact:
+        try:
+            nelements = len(iterable)
+
+        except TypeError:
+            nelements = None
+
+        if nelements is not None:
+            for start in lazy_range(0, nelements, chunk_size):
+                yield lazy_range(start, min(start + chunk_size, nelements))
+
+            return
+
+        chunking_iter = iter(iterable)
+        current_index = 0
+
+        while True:
+            nread = sum(1 for _ in it.islice(chunking_iter, chunk_size))
+
+            if nread == 0:
+                return
+
+            yield lazy_range(current_index, current_index + nread)
+
+            current_index += nread
+
     current_index = 0
     result_indices = list()
 
@@ -37,13 +202,576 @@ def simple_idchunker(iterable, chunk_size=1000):
         yield result_indices
 
 
-def get_nrows(file, read_mode="rb"):
-    counter = 0
-    with open(file, read_mode) as f:
-        for a_line in f:
-            counter += 1
+def _count_block(task):
+    """Count newlines in one byte block of a file, see count_lines"""
+    file, start, end = task
+
+    with open(file, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            block = np.frombuffer(mapped, dtype=np.uint8, count=end - start,
+                                  offset=start)
+            newlines = np.flatnonzero(block == 10)
+
+            count = newlines.size
+            if count > 0:
+                first_line = start + int(newlines[0]) + 1
+
+            else:
+                first_line = -1
+
+            last_byte = int(block[-1])
+
+            # The mmap cannot close while numpy still exports its buffer
+            del block, newlines
+
+        finally:
+            mapped.close()
+
+    return count, first_line, last_byte
+
+
+def count_lines(file, nprocs=None, block_size=COUNT_BLOCK_SIZE,
+                return_offsets=False):
+    """Count lines of a file by counting newlines in blocks across processes
+
+    The file is memory mapped and split into blocks of block_size bytes. Each
+    block is scanned with numpy in a process pool, so no Python object is
+    created per line. A final line without a trailing newline is counted
+
+    Args:
+        file (str):
+            Path to directory and filename to count lines of
+
+        nprocs (int):
+            Number of processes counting blocks. None uses every CPU, 1 counts
+            in the calling process without a pool (e.g. inside an MPI rank)
+
+        block_size (int):
+            Number of bytes per block
+
+        return_offsets (bool):
+            Whether to also return the block newline offsets, see Returns
+
+    Returns (int or tuple):
+        The number of lines. If return_offsets is True, a tuple (nrows, rows,
+        offsets) where offsets (numpy int64) holds, per block, the byte offset
+        of the first line that starts after the block's first newline and rows
+        holds its line number (indexed from 1). Blocks without a newline are
+        left out. Line boundaries at these offsets are known without any
+        further scan of the file
+
+        Block compressed files are not scanned, their counts and block start
+        offsets (uncompressed) come from the block index
+    """
+    block_index = blockzip.get_block_index(file)
+
+    if block_index is not None:
+        # Block compressed files know their row counts, blocks start lines
+        if return_offsets:
+            return (block_index.nrows, block_index.rows[:-1],
+                    block_index.uoffsets[:-1])
+
+        return block_index.nrows
+
+    size = os.stat(file).st_size
+
+    if size == 0:
+        empty = np.zeros(0, dtype=np.int64)
+
+        return (0, empty, empty) if return_offsets else 0
+
+    tasks = [(file, start, min(start + block_size, size))
+             for start in range(0, size, block_size)]
+
+    if nprocs is None:
+        nprocs = mp.cpu_count()
+
+    nprocs = min(nprocs, len(tasks))
+
+    if nprocs > 1:
+        pool = mp.Pool(nprocs)
+
+        try:
+            counts = pool.map(_count_block, tasks, chunksize=1)
+
+        finally:
+            pool.close()
+            pool.join()
+
+    else:
+        counts = [_count_block(a_task) for a_task in tasks]
+
+    block_counts = np.array([i[0] for i in counts], dtype=np.int64)
+    first_lines = np.array([i[1] for i in counts], dtype=np.int64)
+
+    nrows = int(np.sum(block_counts))
+    if counts[-1][2] != 10:
+        nrows += 1
+
+    if not return_offsets:
+        return nrows
+
+    # Line after a block's first newline is preceded by every newline in the
+    # earlier blocks plus that one
+    rows = np.cumsum(block_counts) - block_counts + 2
+    has_newline = block_counts > 0
+
+    return nrows, rows[has_newline], first_lines[has_newline]
+
+
+def get_nrows(file, read_mode="rb", nprocs=None):
+    """Count the number of rows (lines) in a text file
+
+    Args:
+        file (str):
+            Path to directory and filename to count rows of
+
+        read_mode (str):
+            Kept for backwards compatibility, files are always read as bytes
+
+        nprocs (int):
+            Number of processes counting, see count_lines
+
+    Returns (int):
+        The number of rows in the file
+    """
+    return count_lines(file, nprocs=nprocs)
+
+
+def count_range_lines(file, start, end):
+    """Count the lines in a newline aligned byte range of a file
+
+    Args:
+        file (str):
+            Path to directory and filename
+
+        start, end (int):
+            Byte range [start, end), as returned by plan_byte_ranges
+
+    Returns (int):
+        The number of lines in the range. A final line without a trailing
+        newline is counted
+    """
+    if end <= start:
+        return 0
+
+    if blockzip.is_blocked(file):
+        data = read_byte_range(file, start, end, split=False)
+        count = data.count(b"\n")
+        last_byte = ord(data[-1:])
+
+    else:
+        count, _, last_byte = _count_block((file, start, end))
+
+    if last_byte != 10:
+        count += 1
+
+    return count
+
+
+def estimate_row_bytes(file, sample_size=SAMPLE_SIZE):
+    """Estimate the average row (line) length from the head of a file
+
+    Args:
+        file (str):
+            Path to directory and filename
+
+        sample_size (int):
+            Number of bytes read from the start of the file
+
+    Returns (float):
+        Average number of bytes per row in the sample
+    """
+    with open_rows(file) as f:
+        sample = f.read(sample_size)
+
+    nrows = max(sample.count(b"\n"), 1)
+
+    return max(len(sample), 1) / float(nrows)
+
+
+def _next_line_start(f, position):
+    """Byte offset of the first line starting at or after position"""
+    if position <= 0:
+        return 0
+
+    f.seek(position - 1)
+    f.readline()
+
+    return f.tell()
+
+
+def plan_byte_ranges(file, nranges):
+    """Split a file into newline aligned byte ranges of roughly equal size
+
+    Only the file size and one seek per boundary are needed, the file is not
+    scanned. Each boundary is moved forward to the start of the next line, so
+    every row belongs to exactly one range. Ranges may be empty when the file
+    has fewer rows than ranges
+
+    For block compressed files, offsets are uncompressed and boundaries are
+    moved to the next block start, so each range decompresses its own blocks
+
+    Args:
+        file (str):
+            Path to directory and filename to split
+
+        nranges (int):
+            Number of ranges to split the file into
+
+    Returns (list(tuple(int))):
+        A list of nranges (start, end) byte offsets, with end exclusive. The
+        ranges are contiguous and in file order
+    """
+    block_index = blockzip.get_block_index(file)
+    bounds = [0]
+
+    if block_index is not None:
+        size = block_index.usize
+
+        for i in range(1, nranges):
+            boundary = block_index.next_block_start((size * i) // nranges)
+            bounds.append(max(boundary, bounds[-1]))
+
+    else:
+        size = os.stat(file).st_size
+
+        with open(file, "rb") as f:
+            for i in range(1, nranges):
+                boundary = _next_line_start(f, (size * i) // nranges)
+                bounds.append(min(max(boundary, bounds[-1]), size))
+
+    bounds.append(size)
+
+    return [(bounds[i], bounds[i + 1]) for i in range(nranges)]
+
+
+def plan_worker_ranges(file, nworkers, chunk_rows):
+    """Plan contiguous byte ranges for each worker, without counting rows
+
+    The file is split into nworkers * k newline aligned ranges, where k is
+    the smallest number of ranges per worker such that a range holds about
+    chunk_rows rows or fewer (estimated from the head of the file). Worker i
+    gets the i-th run of k consecutive ranges, so rows keep file order across
+    workers and a worker's global row numbers are recovered with an exclusive
+    prefix sum of the row counts of lower workers
+
+    Args:
+        file (str):
+            Path to directory and filename to split
+
+        nworkers (int):
+            Number of workers (e.g. MPI size)
+
+        chunk_rows (int):
+            Approximate maximum number of rows per range
+
+    Returns (list(list(tuple(int)))):
+        For each worker, a list of (start, end) byte offsets
+    """
+    size = data_size(file)
+    chunk_bytes = max(chunk_rows * estimate_row_bytes(file), 1)
+
+    nper_worker = int(math.ceil(size / (chunk_bytes * nworkers)))
+    nper_worker = max(nper_worker, 1)
+
+    byte_ranges = plan_byte_ranges(file, nworkers * nper_worker)
+
+    return [byte_ranges[(i * nper_worker):((i + 1) * nper_worker)]
+            for i in range(nworkers)]
+
+
+def read_byte_range(file, start, end, split=True):
+    """Read the rows within a newline aligned byte range of a file
+
+    Args:
+        file (str):
+            Path to directory and filename to read from. Block compressed
+            files are decompressed, with start and end uncompressed offsets
+
+        start, end (int):
+            Byte range [start, end), as returned by plan_byte_ranges
+
+        split (bool):
+            Whether to split the range into rows
+
+    Returns (list(bytes) or bytes):
+        Each element corresponds to one row, including its trailing newline.
+        Rows are split on newlines only, the same as iterating the file. With
+        split=False the bytes of the range are returned as they are
+    """
+    with open_rows(file) as f:
+        f.seek(start)
+        data = f.read(end - start)
+
+    if not split:
+        return data
+
+    return io.BytesIO(data).readlines()
+
+
+class LineIndex(object):
+    """Sparse line number to byte offset index of a text file
+
+    The index stores the byte offset of every step-th line of a file, so that
+    reaching any line is a seek to the closest preceding anchor plus a forward
+    scan of at most step lines. Anchors are kept as two numpy int64 arrays,
+    rows (line numbers, indexed from 1) and offsets (byte positions)
+
+    The index is persisted next to the file as a sidecar (file + INDEX_SUFFIX)
+    and reused by later runs. The sidecar records the size and modification
+    time of the file it was built from, and is rebuilt when either changes
+    """
+
+    def __init__(self, file, rows, offsets, nrows, size, mtime, step):
+        """ LineIndex constructor
+
+        Objects are normally created with LineIndex.build, LineIndex.load or
+        get_line_index rather than directly
+
+        Args
+        ------
+        file : str
+            Path to directory and filename that is indexed
+
+        rows, offsets : numpy.ndarray(int64)
+            Line numbers of the anchors and their byte offsets in the file
+
+        nrows : int
+            Total number of lines in the file
+
+        size, mtime : int, float
+            File size and modification time the index was built against
+
+        step : int
+            Number of lines between consecutive anchors
+        """
+        self.filename = file
+        self.rows = np.asarray(rows, dtype=np.int64)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.nrows = int(nrows)
+        self.size = int(size)
+        self.mtime = float(mtime)
+        self.step = int(step)
+
+    @staticmethod
+    def sidecar_path(file):
+        return file + INDEX_SUFFIX
+
+    @classmethod
+    def build(cls, file, step=INDEX_STEP, block_size=INDEX_BLOCK_SIZE):
+        """ Scan a file once and index every step-th line
+
+        The file is read in blocks of block_size bytes and newlines are located
+        with numpy, so no Python object is created per line
+
+        Args
+        ------
+        file : str
+            Path to directory and filename to index
+
+        step : int
+            Number of lines between consecutive anchors
+
+        block_size : int
+            Number of bytes read from the file at a time
+
+        Returns
+        ---------
+          A LineIndex object. Nothing is written to disk, see save()
+        """
+        fstat = os.stat(file)
+
+        rows = [np.array([1], dtype=np.int64)]
+        offsets = [np.array([0], dtype=np.int64)]
+        nnewlines = 0
+        position = 0
+        last_byte = None
+
+        with open(file, "rb") as f:
+            while True:
+                block = f.read(block_size)
+
+                if not block:
+                    break
+
+                block_arr = np.frombuffer(block, dtype=np.uint8)
+                newlines = np.flatnonzero(block_arr == 10)
+
+                # The line after the j-th newline (1-indexed) is line j + 1,
+                # anchors sit after newlines whose ordinal is a multiple of
+                # step
+                first = (step - nnewlines - 1) % step
+                anchor_nl = newlines[first::step]
+
+                if anchor_nl.size > 0:
+                    anchor_ord = nnewlines + first + 1
+                    anchor_ord += step * np.arange(anchor_nl.size,
+                                                   dtype=np.int64)
+                    rows.append(anchor_ord + 1)
+                    offsets.append(position + anchor_nl.astype(np.int64) + 1)
+
+                nnewlines += newlines.size
+                position += len(block)
+                last_byte = block_arr[-1]
+
+        nrows = nnewlines
+        if last_byte is not None and last_byte != 10:
+            nrows += 1
+
+        return cls(file, np.concatenate(rows), np.concatenate(offsets), nrows,
+                   fstat.st_size, fstat.st_mtime, step)
+
+    @classmethod
+    def load(cls, file):
+        """ Load the sidecar index of a file
+
+        Args
+        ------
+        file : str
+            Path to directory and filename that is indexed (not the sidecar)
+
+        Returns
+        ---------
+          A LineIndex object, or None if there is no readable sidecar
+        """
+        try:
+            with np.load(cls.sidecar_path(file)) as sidecar:
+                meta = sidecar['meta']
+                result = cls(file, sidecar['rows'], sidecar['offsets'],
+                             meta[0], meta[1], meta[2], meta[3])
+
+        except (IOError, OSError, KeyError, ValueError):
+            result = None
+
+        return result
+
+    def save(self):
+        """ Write the index to its sidecar file
+
+        The sidecar is written to a temporary file first and renamed into
+        place, so concurrent ranks building the same index never leave a
+        partial file behind. If the directory is not writable the index is
+        simply not persisted
+
+        Returns
+        ---------
+          True if the sidecar was written, False otherwise
+        """
+        path = self.sidecar_path(self.filename)
+        tmp_path = "{0}.{1}.tmp".format(path, os.getpid())
+        meta = np.array([self.nrows, self.size, self.mtime, self.step],
+                        dtype=np.float64)
+
+        try:
+            with open(tmp_path, "wb") as f:
+                np.savez(f, rows=self.rows, offsets=self.offsets, meta=meta)
+
+            os.rename(tmp_path, path)
+
+        except (IOError, OSError):
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+            return False
+
+        return True
+
+    def is_stale(self):
+        """ Check the index against the current state of the file
+
+        Returns
+        ---------
+          True if the file size or modification time no longer match those
+          the index was built against
+        """
+        try:
+            fstat = os.stat(self.filename)
+
+        except OSError:
+            return True
+
+        return fstat.st_size != self.size or fstat.st_mtime != self.mtime
+
+    def locate(self, row):
+        """ Find the closest anchor at or before a line number
+
+        Args
+        ------
+        row : int
+            Line number, indexed from 1
+
+        Returns
+        ---------
+          A tuple (anchor_row, offset). Seeking to offset positions the file
+          at the start of line anchor_row, which is <= row
+        """
+        i = int(np.searchsorted(self.rows, row, side="right")) - 1
+        i = max(i, 0)
+
+        return int(self.rows[i]), int(self.offsets[i])
+
+    def row_at(self, offset):
+        """ Line number of the line starting at a byte offset
+
+        Only the lines between the closest preceding anchor and offset are
+        read, at most step lines (or one block of a block compressed file)
+
+        Args
+        ------
+        offset : int
+            Byte offset of a line start, e.g. a boundary of plan_byte_ranges.
+            The end of the file gives the number of lines plus one
+
+        Returns
+        ---------
+          int, the line number, indexed from 1
+        """
+        i = int(np.searchsorted(self.offsets, offset, side="right")) - 1
+        i = max(i, 0)
+
+        return int(self.rows[i]) + count_range_lines(
+            self.filename, int(self.offsets[i]), offset)
+
+
+def get_line_index(file, step=INDEX_STEP, save=True):
+    """ Load the sidecar line index of a file, building it when needed
+
+    Args
+    ------
+    file : str
+        Path to directory and filename to index
+
+    step : int
+        Number of lines between anchors, used only if the index is (re)built
+
+    save : bool
+        Whether a (re)built index is written to the sidecar file
+
+    Returns
+    ---------
+      A LineIndex object that is up to date with the file. For block
+      compressed files, the anchors are the block starts from the block index
+      (uncompressed offsets) and nothing is saved
+    """
+    block_index = blockzip.get_block_index(file)
+
+    if block_index is not None:
+        return LineIndex(file, block_index.rows[:-1],
+                         block_index.uoffsets[:-1], block_index.nrows,
+                         block_index.size, block_index.mtime, 0)
+
+    index = LineIndex.load(file)
+
+    if index is None or index.is_stale():
+        index = LineIndex.build(file, step=step)
+
+        if save:
+            index.save()
 
-    return counter
+    return index
 
 
 class Rowread(object):
@@ -53,14 +781,20 @@ class Rowread(object):
     that the class can seek for specific lines (row) to start reading from, as
     well as read n number of lines from that point
 
+    Seeking uses a sparse LineIndex (see get_line_index), persisted as a
+    sidecar next to the file. Reaching a row is a seek to the closest indexed
+    line followed by a short forward scan, so the cost does not depend on
+    where the row is in the file. With use_index=False rows are reached by
+    scanning forward from the current position instead
+
     Objects of this class keeps the file open. It is strongly recommended that
     objects of this class is used with the with statement to ensure the file
-    is closed appropriately. The with statement is not yet implemented however
-
-    TODO implement with statement context manager
+    is closed appropriately. Otherwise the file is opened on the first read
+    and stays open until the object is garbage collected
     """
 
-    def __init__(self, file, start_row, read_mode="rb"):
+    def __init__(self, file, start_row, read_mode="rb", use_index=True,
+                 index_step=INDEX_STEP):
         """ Rowread constructor
 
         Create an object of class Rowread, opening a file with initial start
@@ -79,19 +813,29 @@ class Rowread(object):
             The file mode to open the file in. This is the same as open() in
             Python. This value is pass directly to it
 
+        use_index : bool
+            Whether to seek rows through the sidecar line index
+
+        index_step : int
+            Number of lines between anchors if the line index is built
+
         Returns
         ---------
           A Rowread object that is connected to the provided file. The file is
-          not initially open. To read, you must use the with statement
+          not initially open, it is opened by the with statement or the first
+          read
         """
         self.filename = file
         self.file = None
         self.start_row = start_row
         self.current_row = 1
         self.read_mode = read_mode
+        self.use_index = use_index
+        self.index_step = index_step
+        self.index = None
 
     def __enter__(self):
-        self.file = open(self.filename, self.read_mode)
+        self.__open__()
 
         return self
 
@@ -105,12 +849,46 @@ class Rowread(object):
 
     def __open__(self):
         if self.file is None:
-            self.file = open(self.filename, self.read_mode)
+            self.file = open_rows(self.filename, self.read_mode)
+            self.current_row = 1
+
+    def get_index(self):
+        """ Get the line index of the file, loading or building it once
+
+        Returns
+        ---------
+          A LineIndex object, or None if this reader does not use an index
+        """
+        if self.use_index and self.index is None:
+            self.index = get_line_index(self.filename, step=self.index_step)
+
+        return self.index
+
+    def __seek_row__(self, row):
+        index = self.get_index()
+
+        if index is not None:
+            anchor_row, offset = index.locate(row)
+
+            # Only seek when the anchor is closer than the current position
+            if row < self.current_row or anchor_row > self.current_row:
+                self.file.seek(offset)
+                self.current_row = anchor_row
+
+        elif row < self.current_row:
+            raise Exception("Start row is lower than current row")
+
+        while self.current_row < row:
+            if not self.file.readline():
+                break
+
+            self.current_row += 1
 
     def reset(self, start_row):
         """ Reset reading to a new start row/line number
 
-        This method effectively close and re-opens the file, setting the start
+        With a line index this is a seek to the new start row. Without one,
+        this method effectively close and re-opens the file, setting the start
         row to the user provided parameter
 
         Args
@@ -119,27 +897,24 @@ class Rowread(object):
             Line number to start reading from. Line numbers are indexed
             starting from 1
         """
-        if self.file is None:
-            raise Exception("File not open. Use with statement")
+        if self.get_index() is None:
+            self.__close__()
 
-        self.__close__()
         self.__open__()
-        self.current_row = 1
 
         self.set_startrow(start_row)
 
     def set_startrow(self, start_row):
         """ Sets the file reading start row
 
-        User can set the start row before reading. However, if the current row
-        is greater than the provided start row, this method will raise an
-        Exception
-
-        Essentially, you cannot start at a row the reader has already past
-        e.g. The file is current at row 1000, the user cannot go to rows < 1000
+        With a line index the reader seeks to the closest indexed line and
+        scans forward to start_row, in either direction
 
-        If you do want to go backwards, you must use the reset(...) method to
-        set a new start row
+        Without a line index, if the current row is greater than the provided
+        start row, this method will raise an Exception. Essentially, you cannot
+        start at a row the reader has already past e.g. The file is current at
+        row 1000, the user cannot go to rows < 1000. If you do want to go
+        backwards, you must use the reset(...) method to set a new start row
 
         Args
         ------
@@ -147,11 +922,13 @@ class Rowread(object):
             Line number to start reading from. Line numbers are indexed
             starting from 1
         """
-        if start_row < self.current_row:
+        if self.get_index() is None and start_row < self.current_row:
             raise Exception("Start row is lower than current row")
 
-        else:
-            self.start_row = start_row
+        self.start_row = start_row
+
+        if self.file is not None:
+            self.__seek_row__(start_row)
 
     def read(self, nrows):
         """ Retrieve data from text file
@@ -167,22 +944,22 @@ class Rowread(object):
         --------
         Each string corresponds to one row in the text file
         """
-        if self.file is None:
-            raise Exception("Text file is not open. Please use with statement")
-
-        while self.current_row < self.start_row:
-            next(self.file)
-            self.current_row += 1
+        self.__open__()
+        self.__seek_row__(self.start_row)
 
         result = list()
         rrows = 0
-        for a_row in self.file:
+        while rrows < nrows:
+            a_row = self.file.readline()
+
+            if not a_row:
+                break
+
             result.append(a_row)
             self.current_row += 1
             rrows += 1
 
-            if rrows >= nrows:
-                break
+        self.start_row = self.current_row
 
         if len(result) == 0:
             result = None
@@ -190,29 +967,431 @@ class Rowread(object):
         return result
 
 
+def line_starts(buf, block_size=SCAN_BLOCK_SIZE):
+    """Offsets of the start of every line within a byte buffer
 
-def row_reader(file, start_n, nrows, read_mode="rb"):
-    counter = 0
-    rows_read = 0
+    Args:
+        buf (numpy.ndarray(uint8)):
+            Buffer of whole lines, e.g. as returned by Mmapread.read_range
+
+        block_size (int):
+            Number of bytes compared at a time, bounding temporary memory
 
-    with open(file, read_mode) as f:
-        for a_line in f:
-            counter += 1
+    Returns (numpy.ndarray(int64)):
+        One offset per line, the first is always 0. A final line without a
+        trailing newline is included
+    """
+    pieces = [np.zeros(1, dtype=np.int64)]
 
-            if counter >= start_n:
-                rows_read += 1
+    for start in range(0, buf.size, block_size):
+        block = buf[start:(start + block_size)]
+        pieces.append(np.flatnonzero(block == 10).astype(np.int64) +
+                      (start + 1))
 
-                if rows_read <= nrows:
-                    yield a_line
+    starts = np.concatenate(pieces)
 
-                else:
-                    break
+    # The offset after a trailing newline does not start a line
+    if starts[-1] >= buf.size:
+        starts = starts[:-1]
+
+    return starts
+
+
+def line_ends(buf, starts):
+    """Offsets one past the end of every line (including its newline)
+
+    Args:
+        buf (numpy.ndarray(uint8)):
+            Buffer of whole lines
+
+        starts (numpy.ndarray(int64)):
+            Line starts of buf, see line_starts
+
+    Returns (numpy.ndarray(int64)):
+        One offset per line, so line i is buf[starts[i]:ends[i]]
+    """
+    ends = np.empty_like(starts)
+    ends[:-1] = starts[1:]
+
+    if ends.size > 0:
+        ends[-1] = buf.size
+
+    return ends
+
+
+class Mmapread(object):
+    """Memory mapped reader that returns row buffers instead of row lists
+
+    Reads return a zero-copy numpy uint8 view of a range of whole rows,
+    together with a numpy int64 array of line start offsets within that view.
+    No Python object is created per row, so parsers can work on the raw
+    buffer directly (use numpy.ndarray.data for a memoryview)
+
+    Like Rowread, rows can be read by line number (through the sidecar
+    LineIndex) or by newline aligned byte range (see plan_byte_ranges)
+
+    Returned views point into the memory map. They must not be used after the
+    reader is closed
+
+    Block compressed files cannot be mapped. For them read_range decompresses
+    the range into a new buffer, and reads by line number are not supported
+    """
+
+    def __init__(self, file, start_row=1, use_index=True,
+                 index_step=INDEX_STEP):
+        """ Mmapread constructor
+
+        Args
+        ------
+        file : str
+            Path to directory and filename to read from
+
+        start_row : int
+            Line number to start reading from. Line numbers are indexed
+            starting from 1
+
+        use_index : bool
+            Whether to seek rows through the sidecar line index. Without it,
+            rows are reached by scanning newlines from the start of the file
+
+        index_step : int
+            Number of lines between anchors if the line index is built
+
+        Returns
+        ---------
+          A Mmapread object. The file is mapped by the with statement or the
+          first read
+        """
+        self.filename = file
+        self.file = None
+        self.map = None
+        self.buffer = None
+        self.start_row = start_row
+        self.current_row = 1
+        self.position = 0
+        self.use_index = use_index
+        self.index_step = index_step
+        self.index = None
+
+    def __enter__(self):
+        self.__open__()
+
+        return self
+
+    def __exit__(self, *args):
+        self.__close__()
+
+    def __open__(self):
+        if self.file is None:
+            self.file = open(self.filename, "rb")
+
+            if blockzip.is_blocked(self.filename):
+                self.buffer = None
+
+            elif os.fstat(self.file.fileno()).st_size > 0:
+                self.map = mmap.mmap(self.file.fileno(), 0,
+                                     access=mmap.ACCESS_READ)
+                self.buffer = np.frombuffer(self.map, dtype=np.uint8)
+
+            else:
+                self.buffer = np.zeros(0, dtype=np.uint8)
+
+            self.current_row = 1
+            self.position = 0
+
+    def __close__(self):
+        if self.file is not None:
+            self.buffer = None
+
+            if self.map is not None:
+                try:
+                    self.map.close()
+
+                except BufferError:
+                    # Views handed out are still alive, the map is released
+                    # once they are garbage collected
+                    pass
+
+                self.map = None
+
+            self.file.close()
+            self.file = None
+
+    def get_index(self):
+        """ Get the line index of the file, loading or building it once
+
+        Returns
+        ---------
+          A LineIndex object, or None if this reader does not use an index
+        """
+        if self.use_index and self.index is None:
+            self.index = get_line_index(self.filename, step=self.index_step)
+
+        return self.index
+
+    def __skip_lines__(self, position, nlines):
+        """Byte offset after skipping nlines whole lines from position"""
+        size = self.buffer.size
+
+        while nlines > 0 and position < size:
+            block = self.buffer[position:(position + SCAN_BLOCK_SIZE)]
+            newlines = np.flatnonzero(block == 10)
+
+            if newlines.size >= nlines:
+                return position + int(newlines[nlines - 1]) + 1
+
+            nlines -= newlines.size
+            position += block.size
+
+        return min(position, size)
+
+    def set_startrow(self, start_row):
+        """ Sets the row the next read starts from
+
+        Args
+        ------
+        start_row : int
+            Line number to start reading from. Line numbers are indexed
+            starting from 1
+        """
+        self.start_row = start_row
+
+    def read_range(self, start, end):
+        """ Retrieve the rows in a newline aligned byte range
+
+        Args
+        ------
+        start, end : int
+            Byte range [start, end), as returned by plan_byte_ranges
+
+        Return : tuple(numpy.ndarray(uint8), numpy.ndarray(int64))
+        --------
+        A zero-copy view of the bytes of the range, and the offset of every
+        line start within that view
+        """
+        self.__open__()
+
+        if self.buffer is None:
+            buf = read_byte_range(self.filename, start, end, split=False)
+            buf = np.frombuffer(buf, dtype=np.uint8)
+
+        else:
+            buf = self.buffer[start:end]
+
+        return buf, line_starts(buf)
+
+    def read(self, nrows):
+        """ Retrieve nrows rows starting from the start row
+
+        Return : tuple(numpy.ndarray(uint8), numpy.ndarray(int64))
+        --------
+        A zero-copy view of the bytes of the rows, and the offset of every
+        line start within that view. None if there is nothing left to read
+        """
+        self.__open__()
+
+        if self.buffer is None:
+            raise Exception("Block compressed files are read with read_range")
+
+        if self.start_row != self.current_row:
+            index = self.get_index()
+
+            if index is not None:
+                anchor_row, offset = index.locate(self.start_row)
 
             else:
-                pass
+                anchor_row, offset = 1, 0
+
+            if self.current_row < self.start_row and \
+                    anchor_row <= self.current_row:
+                anchor_row, offset = self.current_row, self.position
+
+            self.position = self.__skip_lines__(offset,
+                                                self.start_row - anchor_row)
+            self.current_row = self.start_row
+
+        end = self.__skip_lines__(self.position, nrows)
+        buf, starts = self.read_range(self.position, end)
+
+        self.position = end
+        self.current_row += starts.size
+        self.start_row = self.current_row
+
+        if starts.size == 0 or buf.size == 0:
+            return None
+
+        return buf, starts
+
+
+class Prefetcher(object):
+    """Read chunks ahead in a background thread
+
+    A Prefetcher iterates over a list of read tasks (e.g. byte ranges or row
+    intervals) and calls read_fn for each one in a background thread, while
+    the caller processes the previous chunk. File reads release the GIL, so
+    reading overlaps with computing
+
+    At most depth chunks wait in the queue, plus the one being read, so the
+    memory held is capped at depth + 2 chunks including the one in use. With
+    depth=0 chunks are read synchronously in the calling thread
+
+    The time the caller spent waiting on each chunk is recorded in
+    wait_times. Near zero waits mean the reads are hidden behind compute
+
+    The reading thread queues tagged items: ("chunk", (task, chunk)),
+    ("error", exc_info) for an exception raised by read_fn, and ("done",
+    None) once every task is read
+
+    Objects of this class should be used with the with statement, or closed
+    with close(), so the reading thread stops if iteration ends early
+    """
+
+    def __init__(self, read_fn, tasks, depth=1):
+        """ Prefetcher constructor
+
+        Args
+        ------
+        read_fn : callable
+            Called as read_fn(task), returns the chunk for a task
+
+        tasks : iterable
+            Read tasks in the order chunks are wanted
+
+        depth : int
+            Maximum number of chunks read ahead and waiting to be processed
+        """
+        self.read_fn = read_fn
+        self.tasks = tasks
+        self.depth = depth
+        self.wait_times = list()
+        self.queue = None
+        self.thread = None
+        self.stop_event = threading.Event()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __fill__(self):
+        try:
+            for a_task in self.tasks:
+                chunk = self.read_fn(a_task)
+
+                while not self.stop_event.is_set():
+                    try:
+                        self.queue.put(("chunk", (a_task, chunk)),
+                                       timeout=0.1)
+                        break
+
+                    except queue.Full:
+                        pass
+
+                if self.stop_event.is_set():
+                    return
+
+        except Exception:
+            self.queue.put(("error", sys.exc_info()))
+            return
+
+        self.queue.put(("done", None))
 
+    def __iter__(self):
+        if self.depth <= 0:
+            for a_task in self.tasks:
+                wait_start = time.time()
+                chunk = self.read_fn(a_task)
+                self.wait_times.append(time.time() - wait_start)
 
-def simple_chunker(iterable, chunk_size=1000):
+                yield a_task, chunk
+
+            return
+
+        self.queue = queue.Queue(maxsize=self.depth)
+        self.thread = threading.Thread(target=self.__fill__)
+        self.thread.daemon = True
+        self.thread.start()
+
+        while True:
+            wait_start = time.time()
+            kind, item = self.queue.get()
+            wait_time = time.time() - wait_start
+
+            if kind == "done":
+                break
+
+            if kind == "error":
+                # An exception raised in the reading thread
+                exc_type, exc_value, exc_tb = item
+                raise exc_value
+
+            self.wait_times.append(wait_time)
+
+            yield item
+
+        self.thread.join()
+
+    def close(self):
+        """ Stop the reading thread and release queued chunks"""
+        self.stop_event.set()
+
+        if self.thread is not None:
+            while self.thread.is_alive():
+                try:
+                    self.queue.get(timeout=0.1)
+
+                except queue.Empty:
+                    pass
+
+            self.thread.join()
+            self.thread = None
+
+    def total_wait(self):
+        """Total seconds the caller waited on chunks"""
+        return sum(self.wait_times)
+
+
+def row_reader(file, start_n, nrows, read_mode="rb", use_index=True):
+    """Generator of nrows lines of a text file, starting at line start_n
+
+    Args:
+        file (str):
+            Path to directory and filename to read from
+
+        start_n (int):
+            Line number to start reading from, indexed from 1
+
+        nrows (int):
+            Number of lines to yield
+
+        read_mode (str):
+            The file mode to open the file in
+
+        use_index (bool):
+            Whether to seek to start_n through the sidecar line index instead
+            of scanning from the beginning of the file
+
+    Returns (str):
+        The generator returns one line of the file per call
+    """
+    with Rowread(file, start_n, read_mode, use_index=use_index) as reader:
+        reader.set_startrow(start_n)
+        rows_read = 0
+
+        while rows_read < nrows:
+            a_line = reader.file.readline()
+
+            if not a_line:
+                break
+
+            reader.current_row += 1
+            rows_read += 1
+
+            yield a_line
+
+
+def simple_chunker(iterable, chunk_size=1000, compact=False):
     """Evenly chunked iterator with generator
 
     Creates a generator that returns elements within the supplied iterator of
@@ -226,10 +1405,34 @@ def simple_chunker(iterable, chunk_size=1000):
         chunk_size (int):
             The size of each returned collection
 
-    Returns (list(iterable)):
-        The generator returns a list of elements retrieved from iterable of
-        length chunk_size or less
+        compact (bool):
+            Whether to return Chunk objects instead of lists of dicts. numpy
+            arrays are then chunked as slices (views) of the array
+
+    Returns (list(dict) or Chunk):
+        The generator returns a list of {"chunk": element, "id": index} dicts,
+        or a Chunk if compact is True, of length chunk_size or less
     """
+    if compact:
+        if isinstance(iterable, np.ndarray):
+            for start in lazy_range(0, iterable.shape[0], chunk_size):
+                yield Chunk(iterable[start:(start + chunk_size)], start)
+
+            return
+
+        chunking_iter = iter(iterable)
+        current_index = 0
+
+        while True:
+            payload = list(it.islice(chunking_iter, chunk_size))
+
+            if len(payload) == 0:
+                return
+
+            yield Chunk(payload, current_index)
+
+            current_index += len(payload)
+
     size_counter = 0
     current_index = 0
     result_yield = list()
@@ -250,13 +1453,60 @@ def simple_chunker(iterable, chunk_size=1000):
         yield result_yield
 
 
-def sliding_chunker(iterable, chunk_size=1000, inc=2):
+def array_windows(array, chunk_size, inc=1):
+    """Sliding windows over the first axis of a numpy array, without copies
+
+    Args:
+        array (numpy.ndarray):
+            Array to take windows of
+
+        chunk_size (int):
+            Length of each window
+
+        inc (int):
+            Sliding window increment size
+
+    Returns (numpy.ndarray):
+        A read-only view where element k is array[(k * inc):(k * inc +
+        chunk_size)]. Only full windows are included
+    """
+    array = np.asarray(array)
+    nwindows = array.shape[0] - chunk_size + 1
+
+    if nwindows <= 0:
+        return np.empty((0, chunk_size) + array.shape[1:], dtype=array.dtype)
+
+    if sliding_window_view is not None:
+        windows = sliding_window_view(array, chunk_size, axis=0)
+        windows = np.moveaxis(windows, -1, 1)
+
+    else:
+        windows = np.lib.stride_tricks.as_strided(
+            array, shape=(nwindows, chunk_size) + array.shape[1:],
+            strides=(array.strides[0],) + array.strides, writeable=False)
+
+    return windows[::inc]
+
+
+def sliding_chunker(iterable, chunk_size=1000, inc=2, reuse=False):
     """Sliding window chunked iterator with generator
 
     Creates a generator that returns elements within the supplied iterator of
     of length chunk_size. Each subsequent call will shift the window forward by
     inc while maintaining length chunk_size
 
+    Generic iterables are windowed with a deque of maximum length chunk_size.
+    By default every window is returned as a new list, a copy of chunk_size
+    elements per step, so a full pass still costs O(n * chunk_size / inc),
+    quadratic in the window size like the list rebuilding it replaced. With
+    reuse set the deque itself is returned on every call and updated in
+    place, so a step costs only O(inc), and a window must be copied (e.g.
+    list(w)) to keep it past the next call
+
+    numpy arrays are windowed with strided views (see array_windows), so no
+    element is copied at all. Callers with large windows, such as rolling
+    tick statistics, should pass numpy arrays or set reuse
+
     Args:
         iterable (iterable):
             An object that is iterable, such as iterators, generators, etc.
@@ -267,26 +1517,35 @@ def sliding_chunker(iterable, chunk_size=1000, inc=2):
         inc (int):
             Sliding window increment size
 
-    Returns (list(iterable)):
-        The generator returns a list of elements retrieved from iterable of
-        length chunk_size or less, shifted by inc forward (except first call)
+        reuse (bool):
+            Return the same deque, updated in place, for every window of a
+            generic iterable
+
+    Returns (list, collections.deque or numpy.ndarray):
+        The generator returns the elements retrieved from iterable of length
+        chunk_size, shifted by inc forward (except first call)
     """
+    if isinstance(iterable, np.ndarray):
+        for a_window in array_windows(iterable, chunk_size, inc):
+            yield a_window
+
+        return
+
     chunking_iter = iter(iterable)
-    element_block = list(it.islice(chunking_iter, chunk_size))
+    element_block = deque(it.islice(chunking_iter, chunk_size),
+                          maxlen=chunk_size)
+
+    if len(element_block) != chunk_size:
+        return
 
-    if len(element_block) == chunk_size:
-        yield element_block
+    yield element_block if reuse else list(element_block)
 
     counting_index = 0
-    inc_elements = list()
     for an_element in chunking_iter:
-        inc_elements += [an_element]
+        element_block.append(an_element)
         counting_index += 1
 
-        if (counting_index % inc) is 0:
-            element_block = element_block[inc:] + inc_elements
-
-            yield element_block
+        if counting_index == inc:
+            yield element_block if reuse else list(element_block)
 
             counting_index = 0
-            inc_elements = list()
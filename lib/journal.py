@@ -0,0 +1,150 @@
+import hashlib
+import json
+import os
+import pickle
+import shutil
+
+
+def journal_key(files, settings):
+    """ Digest of the inputs and settings a run depends on
+
+    A journal written under another key belongs to another run and is
+    discarded, so any change to an input file (size or modification time)
+    or to a setting starts the run over
+
+    Args:
+        files (list): Paths to directories and filenames of the input files
+        settings (dict): Settings that change the results, JSON serializable
+
+    Returns (str):
+        A hex digest
+    """
+    identity = list()
+    for a_file in files:
+        fstat = os.stat(a_file)
+        identity.append([os.path.abspath(a_file), fstat.st_size,
+                         repr(fstat.st_mtime)])
+
+    text = json.dumps([identity, settings], sort_keys=True)
+
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+class ChunkJournal(object):
+    """Record of the chunks a rank has finished, for resuming a killed run
+
+    Every finished chunk is kept as one pickled entry in a directory of its
+    own per program and rank, written to a temporary file and renamed so an
+    entry is either whole or missing. Entries belong to a step (a pass over
+    the chunks) and are numbered by chunk position within the step
+
+    State carried from chunk to chunk (such as rolling windows) is saved
+    with each entry and only the latest copy is kept. On resume, the chunks
+    up to the one whose state was saved last are the finished ones
+    """
+
+    def __init__(self, directory, program, rank, key):
+        """ ChunkJournal constructor, discards entries written under another
+        key
+
+        Args
+        ------
+        directory : str
+            Directory the journals are kept in
+
+        program : str
+            Name of the program writing the journal
+
+        rank : int
+            MPI rank writing the journal
+
+        key : str
+            Key of the run, see journal_key
+        """
+        self.path = os.path.join(directory, "journal-{0}-rank{1}".format(
+            program, rank))
+        self.key = key
+
+        key_path = os.path.join(self.path, "key")
+        try:
+            with open(key_path, "r") as f:
+                stale = f.read() != key
+
+        except (IOError, OSError):
+            stale = True
+
+        if stale:
+            self.clear()
+            os.makedirs(self.path)
+            self._write(key_path, key.encode("utf-8"))
+
+    def _write(self, path, data):
+        tmp_path = "{0}.{1}.tmp".format(path, os.getpid())
+
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+
+        os.rename(tmp_path, path)
+
+    def _entry_path(self, step, index):
+        return os.path.join(self.path, "{0}-{1:06d}.pkl".format(step, index))
+
+    def save(self, step, index, entry, state=None):
+        """ Record a finished chunk
+
+        Args
+        ------
+        step : str
+            Name of the pass over the chunks
+
+        index : int
+            Position of the chunk in the pass
+
+        entry : object
+            Results of the chunk, anything that pickles
+
+        state : object
+            State carried to the next chunk, or None
+        """
+        self._write(self._entry_path(step, index),
+                    pickle.dumps(entry, protocol=2))
+
+        if state is not None:
+            self._write(os.path.join(self.path, step + "-state.pkl"),
+                        pickle.dumps((index, state), protocol=2))
+
+    def load(self, step):
+        """ Finished chunks of a step
+
+        Returns
+        ---------
+          A tuple: the entries of the chunks finished in a row from the first
+          one, and the latest state saved (None if there is none). With a
+          state, only the chunks up to the one it was saved with count
+        """
+        try:
+            with open(os.path.join(self.path, step + "-state.pkl"), "rb") as f:
+                last, state = pickle.load(f)
+
+        except (IOError, OSError):
+            last, state = None, None
+
+        entries = list()
+        while last is None or len(entries) <= last:
+            try:
+                with open(self._entry_path(step, len(entries)), "rb") as f:
+                    entries.append(pickle.load(f))
+
+            except (IOError, OSError):
+                break
+
+        if last is not None and len(entries) <= last:
+            # The state is ahead of the entries, start the step over
+            return list(), None
+
+        return entries, state
+
+    def clear(self):
+        """ Remove the journal """
+        if os.path.exists(self.path):
+            shutil.rmtree(self.path)
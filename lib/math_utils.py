@@ -45,3 +45,108 @@ def jarque_bera(collection):
     }
 
     return result
+
+
+class Moments(object):
+    """Count, mean and central moment sums of a set of values, mergeable
+
+    Holds n, the mean and M2, M3 and M4, the sums of the 2nd to 4th powers
+    of the deviations from the mean. Sets of values are added chunk by chunk
+    and partial results of disjoint sets are combined with the pairwise
+    update formulas of Chan et al. and Pebay, in any order, giving the
+    moments of the union without a second pass over the values
+    """
+
+    def __init__(self, n=0, mean=0.0, m2=0.0, m3=0.0, m4=0.0):
+        """ Moments constructor, the empty set by default
+
+        Args
+        ------
+        n : int
+            Number of values
+
+        mean : float
+            Mean of the values
+
+        m2, m3, m4 : float
+            Sums of the 2nd, 3rd and 4th powers of the deviations from the
+            mean
+        """
+        self.n = int(n)
+        self.mean = np.float64(mean)
+        self.m2 = np.float64(m2)
+        self.m3 = np.float64(m3)
+        self.m4 = np.float64(m4)
+
+    @classmethod
+    def from_values(cls, values):
+        """ Moments of an array of values, two passes over the array
+
+        Returns
+        ---------
+          A Moments object
+        """
+        values = np.asarray(values, dtype=np.float64)
+
+        if values.size == 0:
+            return cls()
+
+        the_mean = np.mean(values)
+        deviation = values - the_mean
+        squares = deviation * deviation
+
+        return cls(values.size, the_mean, np.sum(squares),
+                   np.sum(squares * deviation), np.sum(squares * squares))
+
+    def add(self, values):
+        """ Add an array of values, updating the moments in place """
+        self.merge(Moments.from_values(values))
+
+    def merge(self, other):
+        """ Add the values of another Moments object, updating in place
+
+        Returns
+        ---------
+          self, so merges can be chained or used as a reduction
+        """
+        if other.n == 0:
+            return self
+
+        if self.n == 0:
+            self.n, self.mean = other.n, other.mean
+            self.m2, self.m3, self.m4 = other.m2, other.m3, other.m4
+
+            return self
+
+        na, nb = np.float64(self.n), np.float64(other.n)
+        n = na + nb
+        delta = other.mean - self.mean
+        delta_n = delta / n
+
+        m4 = (self.m4 + other.m4 +
+              delta * delta_n ** 3 * na * nb * (na * na - na * nb + nb * nb) +
+              6 * delta_n ** 2 * (na * na * other.m2 + nb * nb * self.m2) +
+              4 * delta_n * (na * other.m3 - nb * self.m3))
+        m3 = (self.m3 + other.m3 +
+              delta * delta_n ** 2 * na * nb * (na - nb) +
+              3 * delta_n * (na * other.m2 - nb * self.m2))
+        m2 = self.m2 + other.m2 + delta * delta_n * na * nb
+
+        self.n += other.n
+        self.mean = self.mean + delta_n * nb
+        self.m2, self.m3, self.m4 = m2, m3, m4
+
+        return self
+
+    def stdev(self, ddof=1):
+        """ Standard deviation, with ddof delta degrees of freedom """
+        return np.sqrt(self.m2 / (self.n - ddof))
+
+    def skewness(self, ddof=1):
+        """ Skewness, M3 / n over the cube of stdev(ddof) """
+        return self.m3 / self.n / np.power(self.stdev(ddof), 3)
+
+    def kurtosis(self, ddof=1):
+        """ Kurtosis (not excess), M4 / n over the 4th power of stdev(ddof) """
+        return self.m4 / self.n / np.power(self.stdev(ddof), 4)
+
@@ -0,0 +1,295 @@
+import numpy as np
+from mpi4py import MPI
+
+
+# Largest element count or displacement of a v-collective (a C int)
+_MAX_ELEMENTS = 2 ** 31 - 1
+
+
+def _counts_displs(counts, row_items):
+    # Element counts and displacements of a v-collective from row counts
+    counts = np.asarray(counts, dtype=np.int64) * row_items
+    displs = np.concatenate([[0], np.cumsum(counts)[:-1]]).astype(np.int64)
+
+    if counts.size > 0 and max(counts.max(), displs.max()) > _MAX_ELEMENTS:
+        msg = "A v-collective of {0} elements exceeds the MPI count limit "
+        msg += "({1}) of a rank"
+        raise OverflowError(msg.format(int(counts.sum()), _MAX_ELEMENTS))
+
+    return counts.astype(np.int32), displs.astype(np.int32)
+
+
+def alltoallv_rows(comm, sendbuf, dest):
+    """ Send every row of an array to a chosen rank
+
+    A collective call: every rank of comm sends its rows and receives the
+    rows addressed to it, in one Alltoall of the counts and one Alltoallv of
+    the data. Rows keep their relative order per source rank
+
+    Args:
+        comm (mpi4py.MPI.Comm): Communicator
+        sendbuf (numpy.ndarray): Rows to send, 1 or 2 dimensional
+        dest (numpy.ndarray(int)): Destination rank of every row
+
+    Returns (tuple):
+        The received rows (same dtype and row shape as sendbuf) and the source
+        rank of every received row, ordered by source rank
+    """
+    size = comm.Get_size()
+    row_items = int(np.prod(sendbuf.shape[1:]))
+
+    order = np.argsort(dest, kind="mergesort")
+    sendbuf = np.ascontiguousarray(sendbuf[order])
+
+    send_counts = np.bincount(dest, minlength=size).astype(np.int64)
+    recv_counts = np.empty(size, dtype=np.int64)
+    comm.Alltoall(send_counts, recv_counts)
+
+    recvbuf = np.empty((int(recv_counts.sum()),) + sendbuf.shape[1:],
+                       dtype=sendbuf.dtype)
+
+    comm.Alltoallv([sendbuf, _counts_displs(send_counts, row_items)],
+                   [recvbuf, _counts_displs(recv_counts, row_items)])
+
+    return recvbuf, np.repeat(np.arange(size), recv_counts)
+
+
+def gatherv_rows(comm, sendbuf, root=0):
+    """ Gather the rows of an array from every rank onto one rank
+
+    A collective call: one gather of the row counts and one Gatherv of the
+    data, received straight into a single array
+
+    Args:
+        comm (mpi4py.MPI.Comm): Communicator
+        sendbuf (numpy.ndarray): Rows to send, 1 or 2 dimensional, with the
+            same dtype and row shape on every rank
+        root (int): Rank receiving the rows
+
+    Returns (numpy.ndarray):
+        On root, the rows of all ranks in rank order, None on other ranks
+    """
+    row_items = int(np.prod(sendbuf.shape[1:]))
+    sendbuf = np.ascontiguousarray(sendbuf)
+
+    counts = comm.gather(sendbuf.shape[0], root=root)
+
+    if comm.Get_rank() != root:
+        comm.Gatherv(sendbuf, None, root=root)
+
+        return None
+
+    recvbuf = np.empty((sum(counts),) + sendbuf.shape[1:],
+                       dtype=sendbuf.dtype)
+    comm.Gatherv(sendbuf, [recvbuf, _counts_displs(counts, row_items)],
+                 root=root)
+
+    return recvbuf
+
+
+def write_ordered(comm, path, pieces, nbytes, npieces):
+    """ Write the pieces of every rank to one file, in rank order
+
+    A collective call. Each rank writes at the offset given by an exclusive
+    scan of nbytes, so the file holds the pieces of rank 0, then those of
+    rank 1 and so on, and every rank writes its own part. Pieces are written
+    with Write_at_all, one round per piece; ranks with fewer pieces join the
+    remaining rounds with empty writes
+
+    Args:
+        comm (mpi4py.MPI.Comm): Communicator
+        path (str): Path to directory and filename of the file, replaced if
+            it exists
+        pieces (iterable): numpy.ndarray(uint8) pieces of this rank, in order
+        nbytes (int): Total size of the pieces of this rank
+        npieces (int): Number of pieces of this rank
+
+    Returns (int):
+        Size of the file
+    """
+    offset = comm.exscan(nbytes)
+    if offset is None:
+        offset = 0
+
+    total = comm.allreduce(nbytes)
+    nrounds = comm.allreduce(npieces, op=MPI.MAX)
+
+    fh = MPI.File.Open(comm, path, MPI.MODE_WRONLY | MPI.MODE_CREATE)
+    try:
+        fh.Set_size(total)
+        pieces = iter(pieces)
+
+        for _ in range(nrounds):
+            a_piece = next(pieces, None)
+            if a_piece is None:
+                a_piece = np.empty(0, dtype=np.uint8)
+
+            fh.Write_at_all(offset, a_piece)
+            offset += a_piece.size
+
+    finally:
+        fh.Close()
+
+    return total
+
+
+def shuffle_duplicates(comm, keys, indices):
+    """ Find rows repeated anywhere across the ranks of a communicator
+
+    Every row is sent to an owner rank chosen by its key, so all copies of a
+    row meet on one rank whatever rank and chunk they were read in. Owners
+    flag all but the copy with the lowest index, and send the flagged indices
+    back to the ranks holding those rows. Each rank sends and sorts only
+    about its own number of rows
+
+    Args:
+        comm (mpi4py.MPI.Comm): Communicator
+        keys (numpy.ndarray(uint64)): n x 2 row fingerprints, equal rows must
+            have equal keys, e.g. from tickparse.row_fingerprints. The second
+            column chooses the owner rank
+        indices (numpy.ndarray(int64)): Global row number of every row
+
+    Returns (numpy.ndarray(int64)):
+        Sorted row numbers, among this rank's indices, of rows repeating a
+        row with a lower index
+    """
+    size = comm.Get_size()
+
+    records = np.empty((indices.size, 3), dtype=np.uint64)
+    records[:, 0:2] = keys
+    records[:, 2] = indices.astype(np.int64).view(np.uint64)
+
+    owner = (keys[:, 1] % np.uint64(size)).astype(np.int64)
+    received, sources = alltoallv_rows(comm, records, owner)
+
+    # Sort by key then row number, later copies of a key are duplicates
+    order = np.lexsort((received[:, 2], received[:, 1], received[:, 0]))
+    received = received[order]
+    sources = sources[order]
+
+    repeated = np.logical_and(received[1:, 0] == received[:-1, 0],
+                              received[1:, 1] == received[:-1, 1])
+    flagged = received[1:, 2][repeated].view(np.int64)
+
+    returned, _ = alltoallv_rows(comm, flagged, sources[1:][repeated])
+
+    return np.sort(returned)
+
+
+def node_shared_array(comm, shape, dtype):
+    """ Allocate an array in memory shared by the ranks of a node
+
+    A collective call. The ranks of comm are split by node and the first
+    rank of every node allocates the array in an MPI shared memory window,
+    which the other ranks of the node map instead of allocating their own.
+    The array is not initialized: the first rank of the node communicator
+    fills it, then all ranks of the node call its Barrier before reading
+
+    Args:
+        comm (mpi4py.MPI.Comm): Communicator
+        shape (tuple): Shape of the array, the same on every rank
+        dtype (numpy.dtype): Type of the elements
+
+    Returns (tuple):
+        The array, the node communicator and the window (mpi4py.MPI.Win).
+        Free the window once the array is no longer used
+    """
+    node_comm = comm.Split_type(MPI.COMM_TYPE_SHARED)
+    dtype = np.dtype(dtype)
+
+    nbytes = 0
+    if node_comm.Get_rank() == 0:
+        # At least one byte, so even an empty array has an address
+        nbytes = max(int(np.prod(shape)) * dtype.itemsize, 1)
+
+    win = MPI.Win.Allocate_shared(nbytes, dtype.itemsize, comm=node_comm)
+    buf, _ = win.Shared_query(0)
+
+    array = np.ndarray(shape, dtype=dtype, buffer=buf)
+
+    return array, node_comm, win
+
+
+def _accumulator_op(template):
+    # MPI operator merging packed accumulators shaped like template, and
+    # the datatype of one packed accumulator. Reductions send one element of
+    # that contiguous datatype, so MPI never hands the operator a piece of a
+    # packed accumulator (it may split a buffer of basic elements). Not
+    # commutative: the result keeps rank order, so merges are rounded the
+    # same way from run to run
+    datatype = MPI.DOUBLE.Create_contiguous(template.size).Commit()
+
+    def merge(inbuf, inoutbuf, datatype):
+        incoming = np.frombuffer(inbuf, dtype=np.float64)
+        inout = np.frombuffer(inoutbuf, dtype=np.float64)
+
+        for i in range(0, inout.size, template.size):
+            item = slice(i, i + template.size)
+            merged = template.empty().unpack(incoming[item])
+            merged.merge(template.empty().unpack(inout[item]))
+            inout[item] = merged.pack()
+
+    return MPI.Op.Create(merge, commute=False), datatype
+
+
+def reduce_accumulator(comm, accumulator, root=0):
+    """ Merge an accumulator of every rank onto one rank
+
+    A collective call: the packed state of every rank (accumulator.pack) is
+    reduced with Reduce and an MPI operator merging the accumulators, so
+    partial results combine in about log2(size) steps of packed float64
+    numbers. Accumulators must have the same kind and shape on every rank
+
+    Args:
+        comm (mpi4py.MPI.Comm): Communicator
+        accumulator (accumulators.Accumulator): Partial result of this rank,
+            left unchanged
+        root (int): Rank receiving the result
+
+    Returns (accumulators.Accumulator):
+        On root, a new accumulator of the values of all ranks, None on other
+        ranks
+    """
+    sendbuf = accumulator.pack()
+    recvbuf = np.empty_like(sendbuf)
+
+    op, datatype = _accumulator_op(accumulator)
+    try:
+        comm.Reduce([sendbuf, 1, datatype], [recvbuf, 1, datatype], op=op,
+                    root=root)
+
+    finally:
+        op.Free()
+        datatype.Free()
+
+    if comm.Get_rank() != root:
+        return None
+
+    return accumulator.empty().unpack(recvbuf)
+
+
+def allreduce_accumulator(comm, accumulator):
+    """ Merge an accumulator of every rank, on every rank
+
+    As reduce_accumulator, with Allreduce
+
+    Args:
+        comm (mpi4py.MPI.Comm): Communicator
+        accumulator (accumulators.Accumulator): Partial result of this rank,
+            left unchanged
+
+    Returns (accumulators.Accumulator):
+        A new accumulator of the values of all ranks
+    """
+    sendbuf = accumulator.pack()
+    recvbuf = np.empty_like(sendbuf)
+
+    op, datatype = _accumulator_op(accumulator)
+    try:
+        comm.Allreduce([sendbuf, 1, datatype], [recvbuf, 1, datatype], op=op)
+
+    finally:
+        op.Free()
+        datatype.Free()
+
+    return accumulator.empty().unpack(recvbuf)
@@ -0,0 +1,266 @@
+import numpy as np
+
+
+# Noise rules, the reason code of a rule is its position in RULES plus one,
+# 0 marks signal rows. The order rules are applied in is set by the rule
+# pipeline, see noiserules
+RULES = ["regex", "duplicate", "price_sigma", "units"]
+SIGNAL = 0
+REGEX, DUPLICATE, PRICE_SIGMA, UNITS = 1, 2, 3, 4
+
+# Signal row numbers are produced this many rows at a time
+ITER_ROWS = 2 ** 20
+
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.int64)
+
+
+def flag(reasons, positions, code, replace=()):
+    """ Give rows not flagged yet a reason code
+
+    Rows keep the code of the first rule that flagged them
+
+    Args:
+        reasons (numpy.ndarray(uint8)): Reason code of every row, updated
+        positions (numpy.ndarray(int)): Positions in reasons of the rows
+            flagged by the rule, or a boolean mask
+        code (int): Reason code of the rule
+        replace (tuple): Codes of rules applied after this one, rows they
+            flagged take code instead (for rules applied out of order)
+
+    Returns (int):
+        Number of rows given code
+    """
+    if positions.dtype == np.bool_:
+        positions = np.flatnonzero(positions)
+
+    positions = positions[np.isin(reasons[positions], (SIGNAL,) +
+                                  tuple(replace))]
+    reasons[positions] = code
+
+    return positions.size
+
+
+def write_rows(path, rows, mode="w", block_rows=ITER_ROWS):
+    """ Write row numbers to a text file, one decimal number per line
+
+    Args:
+        path (str): Path to directory and filename of the text file
+        rows (iterable): numpy arrays of row numbers, written in order
+        mode (str): Mode the file is opened with
+        block_rows (int): Rows converted to text at a time
+
+    Returns (int):
+        Number of rows written
+    """
+    if isinstance(rows, np.ndarray):
+        rows = [rows]
+
+    nwritten = 0
+    with open(path, mode) as f:
+        for a_piece in rows:
+            for i in range(0, a_piece.size, block_rows):
+                block = a_piece[i:(i + block_rows)].tolist()
+                f.write("\n".join(map(str, block)) + "\n")
+
+            nwritten += a_piece.size
+
+    return nwritten
+
+
+def unpack_rows(packed, start, nrows):
+    """ Bits of some consecutive rows of a packed bitmap
+
+    Only the bytes holding those rows are unpacked, so a range of rows costs
+    memory in proportion to its own length
+
+    Args:
+        packed (numpy.ndarray(uint8)): Bitmap, numpy.packbits order
+        start (int): Position (indexed from 0) of the first row
+        nrows (int): Number of rows
+
+    Returns (numpy.ndarray(bool)):
+        One element per row
+    """
+    first_byte = start // 8
+    bits = np.unpackbits(packed[first_byte:((start + nrows + 7) // 8)])
+    offset = start - first_byte * 8
+
+    return bits[offset:(offset + nrows)].view(np.bool_)
+
+
+class NoiseMask(object):
+    """Noise rows of a tick file, one packed bitmap per rule
+
+    Bit i of the bitmap of a rule (numpy.packbits order) is set when row
+    i + 1 of the file was flagged by that rule. A row is flagged by at most
+    one rule, the first applied that caught it, so the reason a row was
+    rejected can be read back. A bitmap takes nrows / 8 bytes
+
+    Masks are saved as uncompressed .npz files, so loading one costs little
+    more than reading nrows / 8 bytes per rule
+    """
+
+    def __init__(self, bitmaps, nrows):
+        """ NoiseMask constructor
+
+        Args
+        ------
+        bitmaps : dict
+            Rule name to packed bitmap (numpy.ndarray(uint8)), see RULES
+
+        nrows : int
+            Number of rows of the file
+        """
+        self.bitmaps = bitmaps
+        self.nrows = int(nrows)
+
+    @classmethod
+    def from_reasons(cls, reasons):
+        """ Build a mask from the reason code of every row
+
+        Args
+        ------
+        reasons : numpy.ndarray(uint8)
+            Reason code of row i + 1 at position i
+
+        Returns
+        ---------
+          A NoiseMask object
+        """
+        bitmaps = dict()
+        for code, name in enumerate(RULES, 1):
+            bitmaps[name] = np.packbits(reasons == code)
+
+        return cls(bitmaps, reasons.size)
+
+    @classmethod
+    def from_rows(cls, rows, codes, nrows):
+        """ Build a mask from the noise rows of a file and their reason codes
+
+        Args
+        ------
+        rows : numpy.ndarray(int64)
+            Row numbers (indexed from 1) of noise rows
+
+        codes : numpy.ndarray(uint8)
+            Reason code of every row of rows
+
+        nrows : int
+            Number of rows of the file
+
+        Returns
+        ---------
+          A NoiseMask object
+        """
+        nbytes = (int(nrows) + 7) // 8
+        bitmaps = dict((name, np.zeros(nbytes, dtype=np.uint8))
+                       for name in RULES)
+
+        result = cls(bitmaps, nrows)
+        result.add_rows(rows, codes)
+
+        return result
+
+    def add_rows(self, rows, codes):
+        """ Set the bits of noise rows, only ever adding noise
+
+        The bitmaps are updated in place, a row takes no more memory than its
+        row number and code
+
+        Args
+        ------
+        rows : numpy.ndarray(int64)
+            Row numbers (indexed from 1) of noise rows
+
+        codes : numpy.ndarray(uint8)
+            Reason code of every row of rows
+        """
+        for code, name in enumerate(RULES, 1):
+            positions = np.sort(rows[codes == code] - 1)
+
+            if positions.size == 0:
+                continue
+
+            bits = np.right_shift(0x80, positions % 8).astype(np.uint8)
+            byte_index, first = np.unique(positions // 8, return_index=True)
+            self.bitmaps[name][byte_index] |= np.bitwise_or.reduceat(bits,
+                                                                     first)
+
+    @classmethod
+    def load(cls, path):
+        """ Read a mask saved with save
+
+        Returns
+        ---------
+          A NoiseMask object
+        """
+        with np.load(path) as saved:
+            bitmaps = dict((name, saved["rule_" + name]) for name in RULES)
+            nrows = saved["nrows"][0]
+
+        return cls(bitmaps, nrows)
+
+    def save(self, path):
+        """ Write the mask to an .npz file """
+        arrays = dict(("rule_" + name, bitmap)
+                      for name, bitmap in self.bitmaps.items())
+        arrays["nrows"] = np.array([self.nrows], dtype=np.int64)
+
+        with open(path, "wb") as f:
+            np.savez(f, **arrays)
+
+    def rule_mask(self, name):
+        """ Rows flagged by one rule, a boolean array with one element per
+        row """
+        return np.unpackbits(self.bitmaps[name])[:self.nrows].view(np.bool_)
+
+    def packed(self):
+        """ Noise rows of all rules, one packed bitmap """
+        result = np.zeros((self.nrows + 7) // 8, dtype=np.uint8)
+        for bitmap in self.bitmaps.values():
+            result |= bitmap
+
+        return result
+
+    def mask(self):
+        """ Noise rows, a boolean array with one element per row """
+        return np.unpackbits(self.packed())[:self.nrows].view(np.bool_)
+
+    def reasons(self):
+        """ Reason code of every row, 0 for signal rows """
+        result = np.zeros(self.nrows, dtype=np.uint8)
+        for code, name in enumerate(RULES, 1):
+            result[self.rule_mask(name)] = code
+
+        return result
+
+    def counts(self):
+        """ Number of rows flagged by every rule, a dict """
+        return dict((name, int(np.sum(_POPCOUNT[bitmap])))
+                    for name, bitmap in self.bitmaps.items())
+
+    def reason_of(self, row):
+        """ Name of the rule that flagged a row (indexed from 1), None for a
+        signal row """
+        for name in RULES:
+            byte = self.bitmaps[name][(row - 1) // 8]
+            if byte & (0x80 >> ((row - 1) % 8)):
+                return name
+
+        return None
+
+    def noise_rows(self):
+        """ Row numbers (indexed from 1) of the noise rows """
+        return np.flatnonzero(self.mask()) + 1
+
+    def iter_signal(self, block_rows=ITER_ROWS):
+        """ Iterate over the row numbers (indexed from 1) of the signal rows
+
+        Yields
+        ---------
+          numpy arrays of row numbers, block_rows rows of the file at a time
+        """
+        noise = self.mask()
+        for i in range(0, self.nrows, block_rows):
+            block = np.logical_not(noise[i:(i + block_rows)])
+            yield np.flatnonzero(block) + (i + 1)
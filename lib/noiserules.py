@@ -0,0 +1,380 @@
+import numpy as np
+import chunkers as chk
+import tickparse as tp
+import tickcache as tc
+import noisemask as nm
+import Timetrack
+
+
+# Rules applied when the configuration names none, cheapest rules can be
+# moved first, see RulePipeline
+DEFAULT_RULES = ["regex", "duplicate", "price_sigma", "units"]
+
+
+def outside_sigma(prices, price_mean, stdev):
+    """ Flag prices more than 3 standard deviations from their mean
+
+    Args:
+        prices (numpy.ndarray(float64)): Prices to check
+        price_mean, stdev (float or numpy.ndarray(float64)): Mean and
+            standard deviation, of all prices or of every price. NaN
+            thresholds flag nothing
+
+    Returns (numpy.ndarray(bool)):
+        One element per price
+    """
+    prices_demeaned = prices - price_mean
+
+    with np.errstate(invalid="ignore"):
+        return np.logical_or(prices_demeaned < -3 * stdev,
+                             prices_demeaned > 3 * stdev)
+
+
+def window_stats(rolling, chunk):
+    """ Add the valid prices of a chunk to a rolling window
+
+    The window runs over the valid prices of every row, whichever rule flags
+    it, so its state at a row does not depend on how the file was split into
+    chunks and ranks. A window is seeded with the rows before a rank's first
+    chunk the same way
+
+    Args:
+        rolling (rolling.RollingStats): Window state, updated in place
+        chunk (TickChunk): Rows of the chunk
+
+    Returns (tuple):
+        Positions of the valid rows in the chunk, and the window mean and
+        standard deviation of each (numpy.ndarray(float64))
+    """
+    valid = np.flatnonzero(chunk.columns()[0])
+    prices = chunk.columns()[1][valid]
+
+    if rolling.kind == "time":
+        price_mean, stdev = rolling.update(prices, chunk.timestamps()[valid])
+
+    else:
+        price_mean, stdev = rolling.update(prices)
+
+    return valid, price_mean, stdev
+
+
+class TickChunk(object):
+    """Rows of one chunk, as text or as tick cache rows, seen by the rules
+
+    Columns are parsed from the text on first use and kept, so a rule pays
+    for the parsing only if no rule before it did
+    """
+
+    def __init__(self, start_row, rows=None, ticks=None, delimiter=","):
+        """ TickChunk constructor
+
+        Args
+        ------
+        start_row : int
+            Rank-local row index (indexed from 0) of the first row
+
+        rows : tuple
+            Buffer of whole rows (numpy.ndarray(uint8)) and row starts, see
+            chunkers.line_starts. None for tick cache rows
+
+        ticks : numpy.ndarray(tickcache.TICK_DTYPE)
+            Tick cache rows, None for text rows
+
+        delimiter : str
+            Column delimiter of the text
+        """
+        self.start_row = start_row
+        self.ticks = ticks
+        self.delimiter = delimiter
+        self._columns = None
+        self._timestamps = None
+
+        if ticks is None:
+            self.buf, self.starts = rows
+            self.nrows = self.starts.size
+
+        else:
+            self.buf, self.starts = None, None
+            self.nrows = ticks.size
+
+    def columns(self):
+        """ Layout check, prices and units of every row, see
+        tickparse.parse_ticks """
+        if self._columns is not None:
+            return self._columns
+
+        if self.ticks is None:
+            self._columns = tp.parse_ticks(self.buf, self.starts,
+                                           self.delimiter)
+
+        else:
+            self._columns = (self.ticks['valid'], self.ticks['price'],
+                             self.ticks['units'])
+
+        return self._columns
+
+    def timestamps(self):
+        """ Epoch nanoseconds of every row, tickparse.NAT for malformed
+        timestamps """
+        if self._timestamps is not None:
+            return self._timestamps
+
+        if self.ticks is None:
+            self._timestamps = tp.parse_timestamps(self.buf, self.starts,
+                                                   self.delimiter)[0]
+
+        else:
+            self._timestamps = self.ticks['ts']
+
+        return self._timestamps
+
+    def valid_rows(self, rows):
+        """ The rows of rows whose layout is valid """
+        return rows[self.columns()[0][rows]]
+
+
+class NoiseRule(object):
+    """A noise rule, flags some of the rows it is given
+
+    Subclasses set name (one of noisemask.RULES) and implement apply.
+    Options not used by a rule are ignored, so every rule of a pipeline can
+    be built from the same options
+    """
+    name = None
+
+    def __init__(self, **options):
+        pass
+
+    @property
+    def code(self):
+        """ Reason code of the rule, see noisemask.RULES """
+        return nm.RULES.index(self.name) + 1
+
+    def apply(self, chunk, rows):
+        """ Flag rows of a chunk
+
+        Args
+        ------
+        chunk : TickChunk
+            Rows of the chunk
+
+        rows : numpy.ndarray(int64)
+            Increasing positions in the chunk of the rows to examine, the
+            rows no earlier rule flagged
+
+        Returns
+        ---------
+          numpy.ndarray(int64), the positions of the flagged rows
+        """
+        raise NotImplementedError
+
+
+class RegexRule(NoiseRule):
+    """Rows that do not match tickparse.ROW_REGEX"""
+    name = "regex"
+
+    def apply(self, chunk, rows):
+        return rows[np.logical_not(chunk.columns()[0][rows])]
+
+
+class DuplicateRule(NoiseRule):
+    """Rows repeating an earlier row of the chunk
+
+    Rows are duplicates when their text is equal byte for byte, so rows of
+    equal values written differently (prices 10.50 and 10.5) are not. Text
+    rows are compared byte for byte, tick cache rows by the fingerprint of
+    their text (see tickcache.tick_fingerprints). The first occurrence of a
+    row is kept
+    """
+    name = "duplicate"
+
+    def apply(self, chunk, rows):
+        rows = chunk.valid_rows(rows)
+
+        if chunk.ticks is None:
+            ends = chk.line_ends(chunk.buf, chunk.starts)
+            repeated = tp.duplicate_rows(chunk.buf, chunk.starts[rows],
+                                         ends=ends[rows])
+
+            return rows[repeated]
+
+        # Stable sort, so equal rows keep chunk order
+        keys = tc.tick_fingerprints(chunk.ticks[rows])
+        order = np.lexsort((keys[:, 1], keys[:, 0]))
+
+        repeated = np.ones(max(order.size - 1, 0), dtype=bool)
+        for i in range(keys.shape[1]):
+            column = keys[order, i]
+            repeated &= column[1:] == column[:-1]
+
+        return np.sort(rows[order[1:][repeated]])
+
+
+class PriceSigmaRule(NoiseRule):
+    """Prices more than 3 standard deviations from their mean
+
+    The mean and standard deviation are those of the prices examined in the
+    chunk, or with a rolling window those of the trailing window of every
+    price, see rolling.RollingStats and window_stats (the window holds the
+    valid prices of rows flagged by earlier rules too, so that it does not
+    depend on the chunks). With a price buffer nothing is flagged: the rows
+    and prices are buffered (and added to the reservoir, if any) for global
+    thresholds applied once every chunk is read
+    """
+    name = "price_sigma"
+
+    def __init__(self, rolling=None, price_buffer=None, reservoir=None,
+                 **options):
+        """ PriceSigmaRule constructor
+
+        Args
+        ------
+        rolling : rolling.RollingStats
+            Window state carried from chunk to chunk, None for the
+            statistics of each whole chunk
+
+        price_buffer : list
+            Receives (rank-local row indices, prices) of every chunk, None
+            to flag chunk by chunk
+
+        reservoir : sampling.Reservoir
+            Sample of the buffered prices, or None
+        """
+        self.rolling = rolling
+        self.price_buffer = price_buffer
+        self.reservoir = reservoir
+
+    def apply(self, chunk, rows):
+        rows = chunk.valid_rows(rows)
+        prices = chunk.columns()[1][rows]
+
+        if self.price_buffer is not None:
+            self.price_buffer.append((rows + chunk.start_row, prices))
+
+            if self.reservoir is not None:
+                self.reservoir.add(prices)
+
+            return rows[:0]
+
+        if self.rolling is None:
+            if prices.size == 0:
+                return rows
+
+            price_mean, stdev = np.mean(prices), np.std(prices)
+
+        else:
+            valid, price_mean, stdev = window_stats(self.rolling, chunk)
+
+            examined = np.searchsorted(valid, rows)
+            price_mean, stdev = price_mean[examined], stdev[examined]
+
+        return rows[outside_sigma(prices, price_mean, stdev)]
+
+
+class UnitsRule(NoiseRule):
+    """Rows with a positive price and no units traded"""
+    name = "units"
+
+    def apply(self, chunk, rows):
+        rows = chunk.valid_rows(rows)
+        _, prices, units_traded = chunk.columns()
+
+        return rows[np.logical_and(prices[rows] > 0, units_traded[rows] == 0)]
+
+
+# Rule name to rule class, the names a configuration can list
+REGISTRY = dict((a_rule.name, a_rule)
+                for a_rule in [RegexRule, DuplicateRule, PriceSigmaRule,
+                               UnitsRule])
+
+
+class RulePipeline(object):
+    """Noise rules applied in order, each to the rows still unflagged
+
+    A row is flagged by the first rule that catches it and later rules
+    never examine it, so cheap rules placed first shrink the work of costly
+    ones. Every rule records the rows it examined, the rows it flagged and
+    the time it spent (through Timetrack), summed over chunks
+    """
+
+    def __init__(self, names=None, **options):
+        """ RulePipeline constructor
+
+        Args
+        ------
+        names : list
+            Names of the rules in the order they are applied, see REGISTRY.
+            DEFAULT_RULES if None
+
+        options : dict
+            Options passed to the constructor of every rule
+        """
+        if names is None:
+            names = DEFAULT_RULES
+
+        unknown = [i for i in names if i not in REGISTRY]
+        if len(unknown) > 0:
+            raise ValueError("Unknown noise rules: {0}".format(unknown))
+
+        if len(set(names)) != len(names):
+            raise ValueError("A noise rule is listed more than once")
+
+        self.rules = [REGISTRY[i](**options) for i in names]
+        self.names = list(names)
+        self.examined = dict((i, 0) for i in names)
+        self.flagged = dict((i, 0) for i in names)
+        self.seconds = dict((i, 0.0) for i in names)
+        self.timer = Timetrack.Timetrack()
+
+    def __contains__(self, name):
+        return name in self.names
+
+    def codes_after(self, name):
+        """ Reason codes of the rules applied after rule name """
+        position = self.names.index(name)
+
+        return tuple(a_rule.code for a_rule in self.rules[(position + 1):])
+
+    def run(self, chunk):
+        """ Apply the rules to a chunk
+
+        Args
+        ------
+        chunk : TickChunk
+            Rows of the chunk
+
+        Returns
+        ---------
+          numpy.ndarray(uint8), the reason code of every row, see
+          noisemask.RULES
+        """
+        reasons = np.zeros(chunk.nrows, dtype=np.uint8)
+
+        for a_rule in self.rules:
+            rows = np.flatnonzero(reasons == nm.SIGNAL)
+            tag = "rule_" + a_rule.name
+
+            self.timer.new_time(tag)
+            flagged = a_rule.apply(chunk, rows)
+            self.timer.pause_time(tag)
+
+            self.examined[a_rule.name] += rows.size
+            self.flagged[a_rule.name] += nm.flag(reasons, flagged,
+                                                 a_rule.code)
+            self.seconds[a_rule.name] += self.timer.elapsed_seconds(tag)
+
+        return reasons
+
+    def stats(self):
+        """ Rows examined, rows flagged and seconds spent by every rule, a
+        dict of dicts keyed by rule name """
+        return dict((i, {'examined': self.examined[i],
+                         'flagged': self.flagged[i],
+                         'seconds': self.seconds[i]}) for i in self.names)
+
+    def set_stats(self, stats):
+        """ Restore counters saved with stats, when resuming a run """
+        for name in self.names:
+            self.examined[name] = stats[name]['examined']
+            self.flagged[name] = stats[name]['flagged']
+            self.seconds[name] = stats[name]['seconds']
@@ -0,0 +1,140 @@
+import numpy as np
+
+
+WINDOW_KINDS = ["ticks", "time"]
+
+
+class RollingStats(object):
+    """Trailing window mean and standard deviation of a stream of values
+
+    Values arrive in chunks through update, which returns for every value the
+    mean and (population) standard deviation of the values before it in the
+    window: the previous window values for a tick window, or the values of the
+    previous window seconds for a time window. The value itself is left out,
+    so a spike does not widen its own threshold
+
+    A chunk is processed in one vectorized pass: the window sums are
+    differences of cumulative sums of the values and their squares. The
+    values are shifted by the first value seen, which keeps the sums small
+    for prices drifting around a level. The tail of a chunk is carried into
+    the next one, so windows run across chunk boundaries as if the stream had
+    been read at once
+    """
+
+    def __init__(self, window, kind="ticks", min_periods=2):
+        """ RollingStats constructor
+
+        Args
+        ------
+        window : int or float
+            Number of values for a tick window, or seconds for a time window
+
+        kind : str
+            "ticks" or "time", see WINDOW_KINDS
+
+        min_periods : int
+            Fewest values a window needs for its statistics, values with
+            shorter windows get NaN
+        """
+        if kind not in WINDOW_KINDS:
+            raise ValueError("Unknown window kind: {0}".format(kind))
+
+        if window <= 0:
+            raise ValueError("window must be positive")
+
+        self.window = window
+        self.kind = kind
+        self.min_periods = max(int(min_periods), 1)
+        self.reference = None
+        self.values = np.empty(0, dtype=np.float64)
+        self.clock = np.empty(0, dtype=np.float64)
+        self.start_time = -np.inf
+
+    def start_clock(self, seconds):
+        """ Start the clock of a time window at a time
+
+        For a window seeded part way into a stream: seconds is the latest
+        time of the values before it (as epoch seconds), which later times
+        that go back are taken as
+
+        Args
+        ------
+        seconds : float
+            Epoch seconds, -inf for a window at the start of the stream
+        """
+        self.start_time = seconds
+
+    def update(self, values, times=None):
+        """ Window statistics of the next chunk of values
+
+        Args
+        ------
+        values : numpy.ndarray(float64)
+            The next values of the stream, NaN free
+
+        times : numpy.ndarray(int64)
+            Epoch nanoseconds of every value, needed for a time window. Times
+            that go back (or are tickparse.NAT) are taken as the latest time
+            seen so far
+
+        Returns
+        ---------
+          A tuple of two numpy.ndarray(float64): the window mean and standard
+          deviation of every value
+        """
+        values = np.asarray(values, dtype=np.float64)
+
+        if self.reference is None and values.size > 0:
+            self.reference = values[0]
+
+        nhistory = self.values.size
+        all_values = np.concatenate([self.values, values])
+        shifted = all_values - (self.reference or 0.0)
+
+        sums = np.concatenate([[0.0], np.cumsum(shifted)])
+        squares = np.concatenate([[0.0], np.cumsum(shifted * shifted)])
+
+        # Window of value j: values lo[j] to j - 1
+        hi = np.arange(nhistory, all_values.size)
+        if self.kind == "ticks":
+            lo = np.maximum(hi - int(self.window), 0)
+
+        else:
+            if times is None:
+                raise ValueError("A time window needs the times of values")
+
+            seconds = np.asarray(times, dtype=np.int64) / 1e9
+            clock = np.maximum.accumulate(np.concatenate([self.clock,
+                                                          seconds]))
+            clock = np.maximum(clock, self.start_time)
+            lo = np.searchsorted(clock, clock[hi] - self.window,
+                                 side="right")
+            lo = np.minimum(lo, hi)
+
+        count = hi - lo
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = (sums[hi] - sums[lo]) / count
+            variance = (squares[hi] - squares[lo]) / count - mean * mean
+
+        stdev = np.sqrt(np.maximum(variance, 0))
+        mean += self.reference or 0.0
+
+        short = count < self.min_periods
+        mean[short] = np.nan
+        stdev[short] = np.nan
+
+        # Carry the values later windows can still reach
+        if self.kind == "ticks":
+            keep = max(all_values.size - int(self.window), 0)
+
+        elif clock.size > 0:
+            keep = np.searchsorted(clock, clock[-1] - self.window,
+                                   side="right")
+            self.clock = clock[keep:]
+
+        else:
+            keep = 0
+
+        self.values = all_values[keep:]
+
+        return mean, stdev
@@ -0,0 +1,180 @@
+import numpy as np
+
+
+# Two sided 95% normal quantile, for the error bounds of sample estimates
+Z95 = 1.959963984540054
+
+
+class Reservoir(object):
+    """Fixed size uniform random sample of a stream of values
+
+    Reservoir sampling (algorithm R): the first size values fill the sample,
+    after which the i-th value (indexed from 0) replaces a random element of
+    the sample with probability size / (i + 1). At any time every value seen
+    is in the sample with the same probability. A chunk of values is added
+    in one vectorized step
+    """
+
+    def __init__(self, size, seed=None):
+        """ Reservoir constructor
+
+        Args
+        ------
+        size : int
+            Largest number of values kept
+
+        seed : int
+            Seed of the random generator, None for a random seed
+        """
+        self.size = int(size)
+        self.nseen = 0
+        self.sample = np.empty(0, dtype=np.float64)
+        self.random = np.random.RandomState(seed)
+
+    def add(self, values):
+        """ Add a chunk of values to the stream
+
+        Args
+        ------
+        values : numpy.ndarray(float64)
+            The next values of the stream
+        """
+        values = np.asarray(values, dtype=np.float64)
+
+        nfill = min(max(self.size - self.sample.size, 0), values.size)
+        self.sample = np.concatenate([self.sample, values[:nfill]])
+
+        rest = values[nfill:]
+        positions = np.arange(self.nseen + nfill, self.nseen + values.size)
+        self.nseen += values.size
+
+        if rest.size == 0:
+            return
+
+        slots = np.floor(self.random.random_sample(rest.size) *
+                         (positions + 1)).astype(np.int64)
+        replace = np.flatnonzero(slots < self.size)
+
+        # When a slot is drawn more than once the last value drawn wins
+        slots = slots[replace][::-1]
+        _, last = np.unique(slots, return_index=True)
+        self.sample[slots[last]] = rest[replace[::-1][last]]
+
+
+def merge_reservoirs(samples, nseen, size, seed=None):
+    """ Merge reservoir samples of disjoint streams into one
+
+    The number of values taken from each sample follows the multivariate
+    hypergeometric distribution of the stream sizes, so the result is a
+    uniform random sample of the union of the streams. Called with the same
+    arguments and seed, every rank gets the same sample
+
+    Args:
+        samples (list): numpy arrays, the sample of every stream
+        nseen (list): Number of values of every stream
+        size (int): Largest number of values in the merged sample
+        seed (int): Seed of the random generator
+
+    Returns (numpy.ndarray(float64)):
+        The merged sample
+    """
+    random = np.random.RandomState(seed)
+    remaining = sum(nseen)
+    ndraw = min(int(size), remaining)
+
+    merged = list()
+    for a_sample, n in zip(samples, nseen):
+        remaining -= n
+
+        if ndraw > 0 and n > 0:
+            if remaining > 0:
+                ntake = random.hypergeometric(n, remaining, ndraw)
+
+            else:
+                ntake = ndraw
+
+            merged.append(random.permutation(a_sample)[:ntake])
+            ndraw -= ntake
+
+    return np.concatenate([np.empty(0, dtype=np.float64)] + merged)
+
+
+def sample_estimates(sample, npopulation, quantiles=(0.00135, 0.99865),
+                     z=Z95):
+    """ Estimates of population statistics from a uniform random sample
+
+    Error bounds are half widths of approximate confidence intervals: the
+    normal interval of the mean and of the standard deviation (both with the
+    finite population correction), and order statistic intervals of
+    quantiles. The standard deviation interval uses the sample kurtosis, the
+    variance of a sample variance being about s ** 4 * (kurtosis - 1) / n,
+    so heavy tails widen it. A sample holding the whole population gives
+    exact values and zero bounds
+
+    The bounds hold only if the sample reflects the tails of the population.
+    Outliers rarer than about one in n values are likely missing from the
+    sample, and with them most of the error of the mean and standard
+    deviation, which no bound from the sample alone can show
+
+    Args:
+        sample (numpy.ndarray(float64)): Sample of the population
+        npopulation (int): Size of the population
+        quantiles (tuple): Probabilities of the quantiles to estimate, the
+            defaults are the quantiles 3 standard deviations from the mean of
+            a normal distribution
+        z (float): Normal quantile of the confidence level
+
+    Returns (dict):
+        n, mean, mean_error, stdev, stdev_error, kurtosis and quantiles, a
+        list of (probability, estimate, lower, upper) tuples
+    """
+    n = sample.size
+    sorted_sample = np.sort(sample)
+    exact = n >= npopulation
+
+    result = dict()
+    result['n'] = n
+    result['mean'] = np.mean(sample) if n > 0 else np.nan
+    result['stdev'] = np.std(sample) if n > 0 else np.nan
+    result['kurtosis'] = np.nan
+
+    if n > 0 and result['stdev'] > 0:
+        deviations = (sample - result['mean']) / result['stdev']
+        result['kurtosis'] = np.mean(deviations ** 4)
+
+    if exact:
+        result['mean_error'] = 0.0
+        result['stdev_error'] = 0.0
+
+    elif n > 1:
+        correction = np.sqrt((npopulation - n) / float(npopulation - 1))
+        result['mean_error'] = z * result['stdev'] / np.sqrt(n) * correction
+
+        # Delta method: the standard error of s is that of s ** 2 over 2s
+        spread = np.sqrt(max(result['kurtosis'] - 1, 0) / (4.0 * n))
+        result['stdev_error'] = z * result['stdev'] * spread * correction
+
+    else:
+        result['mean_error'] = np.nan
+        result['stdev_error'] = np.nan
+
+    result['quantiles'] = list()
+    for q in quantiles:
+        if n == 0:
+            result['quantiles'].append((q, np.nan, np.nan, np.nan))
+            continue
+
+        rank = q * (n - 1)
+        estimate = np.interp(rank, np.arange(n), sorted_sample)
+
+        if exact:
+            lower = upper = estimate
+
+        else:
+            spread = z * np.sqrt(n * q * (1 - q))
+            lower = sorted_sample[int(max(np.floor(rank - spread), 0))]
+            upper = sorted_sample[int(min(np.ceil(rank + spread), n - 1))]
+
+        result['quantiles'].append((q, estimate, lower, upper))
+
+    return result
@@ -0,0 +1,253 @@
+import numpy as np
+import accumulators as acc
+
+
+# Two sided 95% normal quantile, for the rank error bound
+Z95 = 1.959963984540054
+
+
+def _capacities(k, nlevels):
+    # Items a level may hold before it is compacted, k at the top level and
+    # 2/3 of the level above below it, at least 2
+    return [max(2, int(np.ceil(k * (2.0 / 3) ** (nlevels - 1 - h))))
+            for h in range(nlevels)]
+
+
+class KLLSketch(acc.Accumulator):
+    """Mergeable quantile sketch of a stream of values (Karnin, Lang and
+    Liberty)
+
+    Values are kept in levels, an item of level h standing for 2 ** h values.
+    When the sketch holds more items than its levels may, the lowest full
+    level is compacted: its items are sorted and every other one, from a
+    pseudo-random first position, moves up a level. The sketch keeps about
+    3k items whatever the number of values, and sketches of the same k
+    merge level by level into a sketch of the union
+
+    Each compaction at level h moves the rank of a query value by 0 or
+    +-2 ** h, either sign alike, so rank errors add up as independent zero
+    mean errors. Their variance is tracked, see rank_error: the normalized
+    rank error of a query (of quantile or cdf) is below
+    Z95 * sqrt(variance) / n with probability about 95%. With k = 200 that
+    is about 0.35% for millions of values, and the worst of a thousand
+    queries is near it. Streams of up to k values are kept exactly
+
+    The packed state has a fixed size for a given k and max_levels, so
+    sketches reduce over MPI as accumulators (mpi_utils.reduce_accumulator).
+    With k = 200 it is about 6 KB. A sketch holds at most 2 ** max_levels
+    times k values
+    """
+
+    def __init__(self, k=200, max_levels=48):
+        """ KLLSketch constructor
+
+        Args
+        ------
+        k : int
+            Capacity of the top level, the error falls as 1 / k and the size
+            grows as k
+
+        max_levels : int
+            Most levels the sketch may have, fixes the packed size
+        """
+        if k < 8:
+            raise ValueError("k must be at least 8")
+
+        self.k = int(k)
+        self.max_levels = int(max_levels)
+        self.n = 0
+        self.min = np.inf
+        self.max = -np.inf
+        self.error_variance = 0.0
+        self.levels = [np.empty(0, dtype=np.float64)]
+
+        self.max_items = max(sum(_capacities(self.k, i))
+                             for i in range(1, self.max_levels + 1))
+
+    @property
+    def size(self):
+        return 6 + self.max_levels + self.max_items
+
+    @property
+    def nitems(self):
+        """ Number of items kept """
+        return sum(a_level.size for a_level in self.levels)
+
+    def empty(self):
+        return KLLSketch(self.k, self.max_levels)
+
+    def pack(self):
+        # k, n, min, max, error variance, number of levels, level sizes and
+        # the items of the levels, bottom level first
+        result = np.zeros(self.size, dtype=np.float64)
+        result[0:6] = [self.k, self.n, self.min, self.max,
+                       self.error_variance, len(self.levels)]
+
+        result[6:(6 + len(self.levels))] = [i.size for i in self.levels]
+
+        items = np.concatenate(self.levels)
+        result[(6 + self.max_levels):(6 + self.max_levels + items.size)] = \
+            items
+
+        return result
+
+    def unpack(self, buf):
+        buf = np.asarray(buf, dtype=np.float64)
+
+        if int(buf[0]) != self.k:
+            raise ValueError("Sketch of k {0} unpacked into a sketch of k "
+                             "{1}".format(int(buf[0]), self.k))
+
+        self.n = int(buf[1])
+        self.min, self.max = np.float64(buf[2]), np.float64(buf[3])
+        self.error_variance = float(buf[4])
+
+        sizes = buf[6:(6 + int(buf[5]))].astype(np.int64)
+        bounds = np.cumsum(np.append(0, sizes)) + 6 + self.max_levels
+        self.levels = [buf[bounds[i]:bounds[i + 1]].copy()
+                       for i in range(sizes.size)]
+
+        return self
+
+    def _compact(self, h):
+        items = np.sort(self.levels[h])
+
+        # An odd item stays, the rest halve into the level above
+        keep = items[:(items.size % 2)]
+        items = items[(items.size % 2):]
+
+        # Deterministic given the stream, so merges over MPI are repeatable
+        coin = np.random.RandomState((self.n * 31 + h) % 2 ** 32).randint(2)
+
+        if h + 1 == len(self.levels):
+            if len(self.levels) == self.max_levels:
+                raise ValueError("Sketch is full, raise max_levels")
+
+            self.levels.append(np.empty(0, dtype=np.float64))
+
+        self.levels[h] = keep
+        self.levels[h + 1] = np.concatenate([self.levels[h + 1],
+                                             items[coin::2]])
+        self.error_variance += 4.0 ** h
+
+    def _compress(self):
+        # While the sketch holds more items than all its levels may, compact
+        # the lowest level at or over its capacity. Levels are compacted only
+        # when needed, keeping the low levels (the most exact) full
+        while True:
+            capacities = _capacities(self.k, len(self.levels))
+            if self.nitems <= sum(capacities):
+                return
+
+            h = [i for i in range(len(self.levels))
+                 if self.levels[i].size >= capacities[i]][0]
+            self._compact(h)
+
+    def add(self, values):
+        values = np.asarray(values, dtype=np.float64).ravel()
+        values = values[np.logical_not(np.isnan(values))]
+
+        if values.size == 0:
+            return self
+
+        self.n += values.size
+        self.min = min(self.min, np.min(values))
+        self.max = max(self.max, np.max(values))
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self._compress()
+
+        return self
+
+    def merge(self, other):
+        if other.k != self.k:
+            raise ValueError("Sketches of different k")
+
+        for h, a_level in enumerate(other.levels):
+            if h == len(self.levels):
+                self.levels.append(np.empty(0, dtype=np.float64))
+
+            self.levels[h] = np.concatenate([self.levels[h], a_level])
+
+        self.n += other.n
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.error_variance += other.error_variance
+        self._compress()
+
+        return self
+
+    def _weighted_items(self):
+        # Items in increasing order and the number of values up to each
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(a_level.size, 2 ** h,
+                                          dtype=np.int64)
+                                  for h, a_level in enumerate(self.levels)])
+
+        order = np.argsort(items, kind="mergesort")
+
+        return items[order], np.cumsum(weights[order])
+
+    def rank_error(self, z=Z95):
+        """ Bound on the normalized rank error of a query, z standard errors
+        (95% two sided by default), 0 while no item was compacted """
+        if self.n == 0:
+            return 0.0
+
+        return z * np.sqrt(self.error_variance) / self.n
+
+    def quantile(self, q):
+        """ Values at quantiles q (a number or array in [0, 1]), NaN for an
+        empty sketch. The true rank of the answer is within rank_error() of
+        q """
+        q = np.asarray(q, dtype=np.float64)
+
+        if self.n == 0:
+            return np.full(q.shape, np.nan)[()]
+
+        items, cum_weights = self._weighted_items()
+        total = cum_weights[-1]
+
+        position = np.searchsorted(cum_weights, q * total, side="left")
+        result = items[np.minimum(position, items.size - 1)]
+
+        # The extremes are known exactly
+        result = np.where(q <= 0, self.min, result)
+        result = np.where(q >= 1, self.max, result)
+
+        return result[()]
+
+    def cdf(self, x):
+        """ Fraction of the values at or below x (a number or array), within
+        rank_error() of the true fraction """
+        x = np.asarray(x, dtype=np.float64)
+
+        if self.n == 0:
+            return np.full(x.shape, np.nan)[()]
+
+        items, cum_weights = self._weighted_items()
+        position = np.searchsorted(items, x, side="right")
+
+        below = np.append(0, cum_weights)[position]
+
+        return (below / np.float64(cum_weights[-1]))[()]
+
+    def qq(self, ppf, npoints=99):
+        """ Points of a QQ plot against a distribution
+
+        Args
+        ------
+        ppf : callable
+            Quantile function of the distribution, called on an array of
+            probabilities, e.g. scipy.stats.norm(mean, stdev).ppf
+
+        npoints : int
+            Number of points, at probabilities (i - 0.5) / npoints
+
+        Returns
+        ---------
+          A tuple of numpy.ndarray(float64), the quantiles of the
+          distribution and those of the sketch
+        """
+        probs = (np.arange(1, npoints + 1) - 0.5) / npoints
+
+        return np.asarray(ppf(probs), dtype=np.float64), self.quantile(probs)
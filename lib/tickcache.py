@@ -0,0 +1,331 @@
+import hashlib
+import os
+import shutil
+import numpy as np
+import chunkers as chk
+import tickparse as tp
+
+
+CACHE_SUFFIX = ".tcache"
+CACHE_CHUNK_ROWS = 10 ** 6
+COLUMNS = ["ts", "price", "units", "valid", "offset", "key"]
+TICK_DTYPE = np.dtype([("ts", np.int64), ("price", np.float64),
+                       ("units", np.int64), ("valid", np.bool_),
+                       ("offset", np.int64), ("key", np.uint64, (2,))])
+
+
+def parse_buffer(data, delimiter=",", base=0):
+    """ Parse a buffer of tick rows into columns
+
+    Rows are validated and parsed with tickparse.parse_ticks. Invalid rows
+    get price NaN, units 0 and timestamp tickparse.NAT. The key of a row is
+    the fingerprint of its bytes, see tickparse.row_fingerprints
+
+    Args:
+        data (bytes): Whole rows as read in binary mode
+        delimiter (str): Column delimiter
+        base (int): Byte offset of data in the file
+
+    Returns (numpy.ndarray):
+        A structured array of TICK_DTYPE, one element per row
+    """
+    buf = np.frombuffer(data, dtype=np.uint8)
+    starts = chk.line_starts(buf)
+
+    result = np.empty(starts.size, dtype=TICK_DTYPE)
+    result['valid'], result['price'], result['units'] = tp.parse_ticks(
+        buf, starts, delimiter)
+    result['ts'] = tp.parse_timestamps(buf, starts, delimiter)[0]
+    result['ts'][np.logical_not(result['valid'])] = tp.NAT
+    result['offset'] = starts + base
+    result['key'] = tp.row_fingerprints(buf, starts)
+
+    return result
+
+
+def tick_fingerprints(ticks):
+    """ Fingerprints of the text rows of parsed ticks, kept in the cache
+
+    They are the fingerprints tickparse.row_fingerprints gives the rows of
+    the text file, so ticks are duplicates exactly when their text rows are
+    equal byte for byte (e.g. prices 10.50 and 10.5 differ), as in a run on
+    the text file
+
+    Args:
+        ticks (numpy.ndarray): A structured array of TICK_DTYPE
+
+    Returns (numpy.ndarray(uint64)):
+        An n x 2 array, one fingerprint per tick
+    """
+    return np.array(ticks['key'], dtype=np.uint64).reshape(ticks.size, 2)
+
+
+def cache_path(file, cache_dir=None):
+    """ Location of the tick cache of a file
+
+    The cache sits next to the file unless cache_dir is given, in which case
+    its name also carries a digest of the file's absolute path so files with
+    the same name in different directories do not share a cache
+    """
+    if cache_dir is None:
+        return file + CACHE_SUFFIX
+
+    digest = hashlib.md5(os.path.abspath(file).encode("utf-8")).hexdigest()
+    name = "{0}-{1}{2}".format(os.path.basename(file), digest[:12],
+                               CACHE_SUFFIX)
+
+    return os.path.join(cache_dir, name)
+
+
+class TickCache(object):
+    """Columnar binary copy of a tick file
+
+    The cache is a directory of .npy files, one per column: ts (int64 epoch
+    nanoseconds), price (float64), units (int64), valid (bool, see
+    parse_buffer), offset (int64, where the row starts in the text file,
+    uncompressed) and key (2 uint64, the fingerprint of the text row).
+    Element i of every column is row i + 1 of the text file.
+    Loaded caches are memory mapped, so reading a column slice costs no more
+    than the pages it touches
+
+    The cache records the size and modification time of the text file it
+    was converted from, and is rebuilt by get_tick_cache when either changes
+    """
+
+    def __init__(self, file, path, columns, size, mtime):
+        """ TickCache constructor
+
+        Objects are normally created with TickCache.build, TickCache.load or
+        get_tick_cache rather than directly
+
+        Args
+        ------
+        file : str
+            Path to directory and filename of the text file
+
+        path : str
+            Path to the cache directory
+
+        columns : dict
+            Column name to numpy array (or memory map), see COLUMNS
+
+        size, mtime : int, float
+            File size and modification time the cache was built against
+        """
+        self.filename = file
+        self.path = path
+        self.ts = columns['ts']
+        self.price = columns['price']
+        self.units = columns['units']
+        self.valid = columns['valid']
+        self.offset = columns['offset']
+        self.key = columns['key']
+        self.size = int(size)
+        self.mtime = float(mtime)
+
+    @property
+    def nrows(self):
+        return self.price.size
+
+    @classmethod
+    def build(cls, file, cache_dir=None, delimiter=",",
+              chunk_rows=CACHE_CHUNK_ROWS):
+        """ Convert a tick file into a cache on disk
+
+        The file is parsed once, chunk_rows rows at a time, straight into
+        memory mapped column files. The cache is written to a temporary
+        directory and renamed into place
+
+        Args
+        ------
+        file : str
+            Path to directory and filename of the text file, plain or block
+            compressed
+
+        cache_dir : str
+            Directory to keep the cache in, next to the file if None
+
+        delimiter : str
+            Column delimiter
+
+        chunk_rows : int
+            Number of rows parsed at a time
+
+        Returns
+        ---------
+          The new TickCache, memory mapped
+        """
+        fstat = os.stat(file)
+        path = cache_path(file, cache_dir)
+        tmp_path = "{0}.{1}.tmp".format(path, os.getpid())
+        nrows = chk.count_lines(file, nprocs=1)
+
+        if os.path.exists(tmp_path):
+            shutil.rmtree(tmp_path)
+
+        os.makedirs(tmp_path)
+
+        # A column of several values per row (key) is a 2-d array
+        columns = dict()
+        for name in COLUMNS:
+            columns[name] = np.lib.format.open_memmap(
+                os.path.join(tmp_path, name + ".npy"), mode="w+",
+                dtype=TICK_DTYPE[name].base,
+                shape=(nrows,) + TICK_DTYPE[name].shape)
+
+        position = 0
+        for start, end in chk.plan_worker_ranges(file, 1, chunk_rows)[0]:
+            ticks = parse_buffer(chk.read_byte_range(file, start, end,
+                                                     split=False),
+                                 delimiter, start)
+
+            for name in COLUMNS:
+                columns[name][position:(position + ticks.size)] = ticks[name]
+
+            position += ticks.size
+
+        for name in COLUMNS:
+            columns[name].flush()
+
+        del columns
+
+        meta = np.array([fstat.st_size, fstat.st_mtime], dtype=np.float64)
+        np.save(os.path.join(tmp_path, "meta.npy"), meta)
+
+        if os.path.exists(path):
+            shutil.rmtree(path)
+
+        os.rename(tmp_path, path)
+
+        return cls.load(file, cache_dir)
+
+    @classmethod
+    def load(cls, file, cache_dir=None, mmap_mode="r"):
+        """ Memory map the cache of a file
+
+        Args
+        ------
+        file : str
+            Path to directory and filename of the text file (not the cache)
+
+        cache_dir : str
+            Directory the cache is kept in, next to the file if None
+
+        mmap_mode : str
+            Passed to numpy.load, None reads the columns into memory
+
+        Returns
+        ---------
+          A TickCache object, or None if there is no readable cache
+        """
+        path = cache_path(file, cache_dir)
+
+        try:
+            meta = np.load(os.path.join(path, "meta.npy"))
+            columns = dict()
+            for name in COLUMNS:
+                columns[name] = np.load(os.path.join(path, name + ".npy"),
+                                        mmap_mode=mmap_mode)
+
+        except (IOError, OSError, ValueError):
+            return None
+
+        return cls(file, path, columns, meta[0], meta[1])
+
+    def is_stale(self):
+        """ Check the cache against the current state of the text file
+
+        Returns
+        ---------
+          True if the file size or modification time no longer match those
+          the cache was built against
+        """
+        try:
+            fstat = os.stat(self.filename)
+
+        except OSError:
+            return True
+
+        return fstat.st_size != self.size or fstat.st_mtime != self.mtime
+
+    def read(self, start, end):
+        """ Copy rows start to end - 1 (indexed from 0) out of the cache
+
+        Returns
+        ---------
+          A structured array of TICK_DTYPE
+        """
+        result = np.empty(max(end - start, 0), dtype=TICK_DTYPE)
+        for name in COLUMNS:
+            result[name] = getattr(self, name)[start:end]
+
+        return result
+
+    def byte_range(self, start, end):
+        """ Byte range of rows start to end - 1 (indexed from 0) in the text
+        file, uncompressed
+
+        Returns
+        ---------
+          A tuple (start, end), as chunkers.read_byte_range takes
+        """
+        if end < self.nrows:
+            end_offset = int(self.offset[end])
+
+        else:
+            end_offset = chk.data_size(self.filename)
+
+        if start < end:
+            return int(self.offset[start]), end_offset
+
+        return end_offset, end_offset
+
+    def plan_row_ranges(self, nworkers, chunk_rows):
+        """ Split the rows of the cache between workers
+
+        The rows are cut where chunkers.plan_worker_ranges cuts the text
+        file: every newline aligned byte bound of its plan is mapped to the
+        row starting there. A run on the cache and a run on the text file
+        therefore scrub the same chunks. Worker i gets the i-th run of
+        consecutive ranges
+
+        Returns
+        ---------
+          A list with one list of (start, end) row ranges (indexed from 0, end
+          exclusive) per worker
+        """
+        byte_plan = chk.plan_worker_ranges(self.filename, nworkers,
+                                           chunk_rows)
+
+        result = list()
+        for byte_ranges in byte_plan:
+            bounds = np.searchsorted(self.offset, np.asarray(byte_ranges,
+                                                             dtype=np.int64))
+            result.append([(int(i[0]), int(i[1])) for i in bounds])
+
+        return result
+
+
+def get_tick_cache(file, cache_dir=None, delimiter=",", build=True):
+    """ Get the tick cache of a file, converting the file if needed
+
+    Args:
+        file (str): Path to directory and filename of the text file
+        cache_dir (str): Directory to keep the cache in, next to the file
+            if None
+        delimiter (str): Column delimiter
+        build (bool): Whether to convert the file when there is no cache or
+            the cache is stale
+
+    Returns (TickCache):
+        The memory mapped cache, or None if there is none and build is False
+    """
+    cache = TickCache.load(file, cache_dir)
+
+    if cache is not None and cache.is_stale():
+        cache = None
+
+    if cache is None and build:
+        cache = TickCache.build(file, cache_dir, delimiter)
+
+    return cache
@@ -0,0 +1,639 @@
+import re
+import numpy as np
+import chunkers as chk
+
+
+# Layout of a well formed tick row
+ROW_REGEX = r"[,]".join([
+    r"^\d{8}([:]\d{2}){3}[.]\d+",
+    r"[1-9]+[0-9.]+",
+    r"[0-9.]+\r?$"])
+
+# Byte layout of the fixed width part of the timestamp, YYYYMMDD:HH:MM:SS.
+TIMESTAMP_LAYOUT = b"dddddddd:dd:dd:dd."
+
+# Timestamp of rows whose date or time does not exist (numpy's NaT)
+NAT = np.iinfo(np.int64).min
+
+# Longest price (digits and dot) and units fields parsed with numpy, longer
+# fields are parsed in Python
+MAX_PRICE_WIDTH = 15
+MAX_UNITS_WIDTH = 18
+
+BLOCK_ROWS = 2 ** 14
+
+# Exact powers of ten, int to float conversion is correctly rounded
+_POW10 = np.array([float(10 ** i) for i in range(MAX_PRICE_WIDTH)])
+
+_DIGIT, _DOT = 48, 46
+
+# Row hashing, the masks keep the first 0 to 8 bytes of a little endian word
+_HASH_SEED = np.uint64(0xcbf29ce484222325)
+_HASH_PRIME = np.uint64(0x100000001b3)
+_HASH_SEED2 = np.uint64(0x6a09e667f3bcc909)
+_HASH_PRIME2 = np.uint64(0x9e3779b97f4a7c15)
+_WORD_MASKS = np.array([(1 << (8 * i)) - 1 for i in range(9)],
+                       dtype=np.uint64)
+_FILTER_SIZE = 2 ** 20
+_FILTER_MASK = np.uint64(_FILTER_SIZE - 1)
+
+# Timestamp parsing, 8 ASCII bytes per 64 bit word, first byte lowest
+_BYTE_INDEX = np.uint64(0x0102030405060708)
+_PAIR_MASK = np.uint64(0x00ff00ff00ff00ff)
+_QUAD_MASK = np.uint64(0x0000ffff0000ffff)
+_HALF_MASK = np.uint64(0x00000000ffffffff)
+_TIME_DIGIT_MASK = np.uint64(0xffff00ffff00ffff)
+_TIME_COLONS = np.uint64(0x0000ff0000ff0000)
+_TIME_COLON_BYTES = np.uint64(0x00003a00003a0000)
+_TIME_COLON_ZEROS = np.uint64(0x0000300000300000)
+_MIN_SECONDS = -(2 ** 63 // 10 ** 9)
+_MAX_SECONDS = 2 ** 63 // 10 ** 9 - 1
+# Bytes read from the start of a row, past the end of a block for its last
+# rows
+_TIMESTAMP_READ = 32
+
+# Days since 1970-01-01 of the first day and length of every month (16 slots
+# per year, month 1 to 12) of the years that fit in int64 nanoseconds
+_FIRST_YEAR, _LAST_YEAR = 1677, 2262
+
+
+def _month_table():
+    years = np.repeat(np.arange(_FIRST_YEAR, _LAST_YEAR + 1), 16)
+    months = np.tile(np.arange(16), _LAST_YEAR - _FIRST_YEAR + 1)
+
+    lengths = np.array([0, 31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31, 0,
+                        0, 0])[months]
+    leap = (years % 4 == 0) & ((years % 100 != 0) | (years % 400 == 0))
+    lengths += leap & (months == 2)
+
+    # Proleptic Gregorian day count, years counted from March so the leap
+    # day comes last
+    y = years - (months <= 2)
+    era = y // 400
+    year_of_era = y - era * 400
+    day_of_year = (153 * ((months + 9) % 12) + 2) // 5
+    starts = (era * 146097 + year_of_era * 365 + year_of_era // 4 -
+              year_of_era // 100 + day_of_year - 719468)
+
+    return starts, lengths
+
+
+_MONTH_STARTS, _MONTH_LENGTHS = _month_table()
+
+
+def _digits(ch):
+    # Digit values of a uint8 array, wrapping bytes below "0" past 9
+    return ch - np.uint8(_DIGIT)
+
+
+def _scan_fields(buf, first, last, max_width, values=True):
+    """ Scan one variable width field per row, byte column by byte column
+
+    Each pass looks at the j-th byte of every field, so the work is
+    vectorized over rows and loops only over the width of the widest field
+
+    Args:
+        buf (numpy.ndarray(uint8)): Buffer of rows
+        first, last (numpy.ndarray(int64)): Field i is buf[first[i]:last[i]]
+        max_width (int): Fields longer than this are only flagged too long
+        values (bool): Whether to read the digits as numbers
+
+    Returns (dict):
+        numpy arrays with one element per field: value (the digits read as an
+        int64, dots skipped, if values), ndots, nfrac (digits after the first
+        dot), nother (bytes that are neither digit nor dot) and too_long
+    """
+    n = first.size
+    length = last - first
+    width = int(min(length.max(), max_width)) if n > 0 else 0
+
+    value = np.zeros(n, dtype=np.int64)
+    ndots = np.zeros(n, dtype=np.int8)
+    nfrac = np.zeros(n, dtype=np.int8)
+    nother = np.zeros(n, dtype=np.int8)
+
+    for j in range(width):
+        inside = length > j
+        ch = buf[np.where(inside, first + j, 0)]
+        digit_value = _digits(ch)
+
+        digit = inside & (digit_value < 10)
+        dot = inside & (ch == _DOT)
+
+        if values:
+            value = np.where(digit, value * 10 + digit_value, value)
+
+        nfrac += digit & (ndots > 0)
+        ndots += dot
+        nother += inside ^ (digit | dot)
+
+    return {"value": value, "ndots": ndots, "nfrac": nfrac,
+            "nother": nother, "too_long": length > width}
+
+
+def _parse_row(a_row, row_check, delimiter):
+    # The regex and conversion path, for rows the kernel does not handle
+    if row_check.match(a_row) is None:
+        return False, np.nan, 0
+
+    fields = a_row.split(delimiter)
+
+    try:
+        units = int(fields[2])
+
+        if units >= 2 ** 63:
+            raise ValueError
+
+        return True, float(fields[1]), units
+
+    except ValueError:
+        return False, np.nan, 0
+
+
+def _parse_block(buf, starts, delimiter):
+    # parse_ticks on one block of rows, buf holds exactly these rows
+    delim = ord(delimiter)
+    n = starts.size
+
+    # Rows without their newline and optional carriage return
+    ends = chk.line_ends(buf, starts)
+    if n > 0:
+        ends -= buf[ends - 1] == 10
+
+    body_end = ends.copy()
+    if n > 0:
+        body_end -= np.logical_and(ends > starts, buf[ends - 1] == 13)
+
+    # Exactly two delimiters per row
+    delim_pos = np.flatnonzero(buf == delim)
+    first_delim = np.searchsorted(delim_pos, starts)
+    ndelims = np.searchsorted(delim_pos, ends) - first_delim
+    valid = ndelims == 2
+
+    first_delim = np.minimum(first_delim, max(delim_pos.size - 2, 0))
+    if delim_pos.size >= 2:
+        c1 = delim_pos[first_delim]
+        c2 = delim_pos[first_delim + 1]
+
+    else:
+        c1 = c2 = ends
+
+    # Fixed width part of the timestamp
+    valid &= c1 - starts > len(TIMESTAMP_LAYOUT)
+    safe_starts = np.where(valid, starts, 0)
+    for j, expected in enumerate(bytearray(TIMESTAMP_LAYOUT)):
+        if not valid.any():
+            break
+
+        ch = buf[safe_starts + j]
+
+        if expected == ord("d"):
+            valid &= _digits(ch) < 10
+
+        else:
+            valid &= ch == expected
+
+    # Fraction of a second, one or more digits
+    fraction = _scan_fields(buf, safe_starts + len(TIMESTAMP_LAYOUT),
+                            np.where(valid, c1, 0), MAX_UNITS_WIDTH,
+                            values=False)
+    valid &= fraction['ndots'] + fraction['nother'] == 0
+
+    price = _scan_fields(buf, c1 + 1, c2, MAX_PRICE_WIDTH)
+    first_ch = buf[np.where(valid, c1 + 1, 0)]
+    valid &= c2 - c1 > 2
+    valid &= _digits(first_ch) - np.uint8(1) < 9
+    valid &= np.logical_and(price['nother'] == 0, price['ndots'] <= 1)
+
+    units = _scan_fields(buf, c2 + 1, body_end, MAX_UNITS_WIDTH)
+    valid &= body_end - c2 > 1
+    valid &= np.logical_and(units['nother'] == 0, units['ndots'] == 0)
+
+    prices = price['value'] / _POW10[np.minimum(price['nfrac'],
+                                                MAX_PRICE_WIDTH - 1)]
+    prices[np.logical_not(valid)] = np.nan
+    units_traded = np.where(valid, units['value'], 0)
+
+    # Rows with fields too wide for the kernel go through the regex
+    too_long = fraction['too_long'] | price['too_long'] | units['too_long']
+    too_long = np.flatnonzero(too_long & (ndelims == 2))
+
+    if too_long.size > 0:
+        row_check = re.compile(ROW_REGEX.encode("ascii"))
+        delimiter = delimiter.encode("ascii")
+        raw = buf.tobytes()
+
+        for i in too_long:
+            a_row = raw[starts[i]:ends[i]]
+            valid[i], prices[i], units_traded[i] = _parse_row(a_row,
+                                                              row_check,
+                                                              delimiter)
+
+    return valid, prices, units_traded
+
+
+def parse_ticks(buf, starts=None, delimiter=",", block_rows=BLOCK_ROWS):
+    """ Validate and parse a buffer of tick rows in one vectorized pass
+
+    A row is valid if it matches ROW_REGEX: a YYYYMMDD:HH:MM:SS.f timestamp,
+    a price of digits and dots starting with 1-9 and units of digits and dots,
+    optionally followed by a carriage return. Valid rows whose price has more
+    than one dot or whose units have a dot cannot be converted to numbers and
+    are also reported as invalid
+
+    Prices are read as an integer mantissa divided by a power of ten, which
+    is exact to the last bit (the same double float() returns) for up to 15
+    digits. Longer fields fall back to the regex and float()/int() per row
+
+    Args:
+        buf (bytes or numpy.ndarray(uint8)): Buffer of whole rows
+        starts (numpy.ndarray(int64)): Row starts of buf, computed with
+            chunkers.line_starts if None
+        delimiter (str): Column delimiter, a single character
+        block_rows (int): Number of rows parsed at a time, small enough for
+            the temporary arrays of a block to stay in the CPU cache
+
+    Returns (tuple):
+        valid (numpy.ndarray(bool)), prices (numpy.ndarray(float64), NaN for
+        invalid rows) and units (numpy.ndarray(int64), 0 for invalid rows),
+        one element per row
+    """
+    if not isinstance(buf, np.ndarray):
+        buf = np.frombuffer(buf, dtype=np.uint8)
+
+    if starts is None:
+        starts = chk.line_starts(buf)
+
+    ends = chk.line_ends(buf, starts)
+
+    valid = list()
+    prices = list()
+    units_traded = list()
+    for i in range(0, max(starts.size, 1), block_rows):
+        block_starts = starts[i:(i + block_rows)]
+
+        if block_starts.size > 0:
+            first = block_starts[0]
+            block = buf[first:ends[i + block_starts.size - 1]]
+            block_starts = block_starts - first
+
+        else:
+            block = buf[:0]
+
+        result = _parse_block(block, block_starts, delimiter)
+        valid.append(result[0])
+        prices.append(result[1])
+        units_traded.append(result[2])
+
+    return (np.concatenate(valid), np.concatenate(prices),
+            np.concatenate(units_traded))
+
+
+def _word(byte):
+    # A uint64 with every byte set to byte
+    return np.uint64(int(byte) * 0x0101010101010101)
+
+
+def _all_digits(word):
+    # Whether all 8 bytes of a word are ASCII digits
+    high = word & _word(0xf0)
+    low = (word + _word(0x06)) & _word(0xf0)
+
+    return (high == _word(0x30)) & (low == _word(0x30))
+
+
+def _nondigit_bytes(word):
+    # 0x80 in every byte of a little endian word that is not an ASCII digit
+    high = (word & _word(0xf0)) ^ _word(0x30)
+    low = (((word & _word(0x7f)) + _word(0x06)) & _word(0xf0)) ^ _word(0x30)
+    bad = high | low
+
+    return (bad | ((bad & _word(0x7f)) + _word(0x7f))) & _word(0x80)
+
+
+def _combine_digits(word):
+    # Value of the 8 digits (byte values 0 to 9) of a little endian word,
+    # first digit first
+    word = (word * np.uint64(10) + (word >> np.uint64(8))) & _PAIR_MASK
+    word = (word * np.uint64(100) + (word >> np.uint64(16))) & _QUAD_MASK
+    word = (word * np.uint64(10000) + (word >> np.uint64(32))) & _HALF_MASK
+
+    return word.astype(np.int64)
+
+
+def _timestamp_block(block, starts, size, delimiter):
+    # parse_timestamps on the rows of block[:size], block has at least
+    # _TIMESTAMP_READ bytes past size for the reads of the last rows
+    words = np.ndarray(shape=(size + 25,), dtype="<u8", buffer=block,
+                       strides=(1,))
+
+    # Bytes 0 to 31 of every row, the timestamp and whatever follows it
+    w0 = words[starts]
+    w8 = words[starts + 8]
+    w16 = words[starts + 16]
+    w24 = words[starts + 24]
+
+    time_word = (w8 >> np.uint64(8)) | (w16 << np.uint64(56))
+    fraction_word = (w16 >> np.uint64(16)) | (w24 << np.uint64(48))
+
+    # Fixed width part: YYYYMMDD, the colon at 8, HH:MM:SS and the dot at 17
+    ok = _all_digits(w0)
+    time_digits = (time_word & _TIME_DIGIT_MASK) | _TIME_COLON_ZEROS
+    ok &= _all_digits(time_digits)
+    ok &= (time_word & _TIME_COLONS) == _TIME_COLON_BYTES
+    ok &= (w8 & np.uint64(0xff)) == np.uint64(ord(":"))
+    ok &= (w16 & np.uint64(0xff00)) == np.uint64(_DOT << 8)
+
+    # Fraction: 1 to 9 digits ended by the delimiter, a line end or the end
+    # of the block
+    nondigit = _nondigit_bytes(fraction_word)
+    lowest = (nondigit & (~nondigit + np.uint64(1))) >> np.uint64(7)
+    nfrac = ((lowest * _BYTE_INDEX) >> np.uint64(56)).astype(np.int64) - 1
+    nfrac[nfrac < 0] = 8
+
+    ninth = _digits(block[starts + 26])
+    nfrac += (nfrac == 8) & (ninth < 10)
+    ok &= nfrac > 0
+
+    end = starts + 18 + nfrac
+    terminator = block[end]
+    ok &= ((terminator == ord(delimiter)) | (terminator == 10) |
+           ((terminator == 13) & ((block[end + 1] == 10) |
+                                  (end + 1 >= size))) |
+           (end >= size))
+
+    # Fraction digits past nfrac read as zeros
+    fraction_word = ((fraction_word ^ _word(_DIGIT)) &
+                     _WORD_MASKS[np.minimum(nfrac, 8)])
+    fraction = _combine_digits(fraction_word) * 10
+    fraction += np.where(nfrac == 9, ninth, 0)
+
+    date_pairs = w0 - _word(_DIGIT)
+    date_pairs = (date_pairs * np.uint64(10) +
+                  (date_pairs >> np.uint64(8))).astype(np.int64)
+    year = (date_pairs & 0xff) * 100 + ((date_pairs >> 16) & 0xff)
+    month = (date_pairs >> 32) & 0xff
+    day = (date_pairs >> 48) & 0xff
+
+    time_digits = time_digits - _word(_DIGIT)
+    time_pairs = (time_digits * np.uint64(10) +
+                  (time_digits >> np.uint64(8))).astype(np.int64)
+    hours = time_pairs & 0xff
+    minutes = (time_pairs >> 24) & 0xff
+    seconds = (time_pairs >> 48) & 0xff
+
+    # Days since 1970-01-01 of the first of the month, and the length of the
+    # month, 0 for months that do not exist
+    ok &= (year >= _FIRST_YEAR) & (year <= _LAST_YEAR) & (month < 16)
+    month_index = np.where(ok, (year - _FIRST_YEAR) * 16 + month, 0)
+    ok &= (day > 0) & (day <= _MONTH_LENGTHS[month_index])
+    ok &= (hours < 24) & (minutes < 60) & (seconds < 60)
+
+    seconds += ((_MONTH_STARTS[month_index] + day - 1) * 86400 +
+                hours * 3600 + minutes * 60)
+    ok &= (seconds >= _MIN_SECONDS) & (seconds <= _MAX_SECONDS)
+
+    result = np.where(ok, seconds * 10 ** 9 + fraction, NAT)
+
+    return result, np.logical_not(ok)
+
+
+def parse_timestamps(buf, starts=None, delimiter=",", block_rows=BLOCK_ROWS):
+    """ Convert the YYYYMMDD:HH:MM:SS.f timestamp of every row to epoch
+    nanoseconds
+
+    The timestamp is the first field of a row and is read as naive UTC. The
+    digits are checked and combined 8 bytes at a time, in 64 bit words, with
+    no Python work per row. A timestamp is malformed unless its layout is
+    exact, the fraction has 1 to 9 digits and the date and time exist
+    (seconds up to 59) within the int64 nanosecond range (years 1677 to
+    2262). For fractions of up to 6 digits the result is that of
+    datetime.strptime with "%Y%m%d:%H:%M:%S.%f"
+
+    Args:
+        buf (bytes or numpy.ndarray(uint8)): Buffer of whole rows
+        starts (numpy.ndarray(int64)): Row starts of buf, computed with
+            chunkers.line_starts if None
+        delimiter (str): Column delimiter, a single character
+        block_rows (int): Number of rows parsed at a time
+
+    Returns (tuple):
+        timestamps (numpy.ndarray(int64), NAT for malformed timestamps) and
+        errors (numpy.ndarray(bool), the malformed timestamps), one element
+        per row
+    """
+    if not isinstance(buf, np.ndarray):
+        buf = np.frombuffer(buf, dtype=np.uint8)
+
+    if starts is None:
+        starts = chk.line_starts(buf)
+
+    timestamps = np.empty(starts.size, dtype=np.int64)
+    errors = np.empty(starts.size, dtype=bool)
+    for i in range(0, starts.size, block_rows):
+        block_starts = starts[i:(i + block_rows)]
+        first = block_starts[0]
+
+        if i + block_rows < starts.size:
+            stop = starts[i + block_rows]
+
+        else:
+            stop = buf.size
+
+        # Read past the block in place, the last block is copied and padded
+        if stop + _TIMESTAMP_READ <= buf.size:
+            block = buf[first:(stop + _TIMESTAMP_READ)]
+
+        else:
+            block = np.zeros(stop - first + _TIMESTAMP_READ, dtype=np.uint8)
+            block[:(stop - first)] = buf[first:stop]
+
+        result = _timestamp_block(block, block_starts - first, stop - first,
+                                  delimiter)
+        timestamps[i:(i + block_rows)] = result[0]
+        errors[i:(i + block_rows)] = result[1]
+
+    return timestamps, errors
+
+
+def _word_view(block):
+    # Every 8 byte little endian word of a block, one per byte offset, padded
+    # with zeros so words starting in the last 7 bytes can be read
+    padded = np.zeros(block.size + 8, dtype=np.uint8)
+    padded[:block.size] = block
+
+    return np.ndarray(shape=(block.size + 1,), dtype="<u8", buffer=padded,
+                      strides=(1,))
+
+
+def row_hashes(buf, starts, block_rows=BLOCK_ROWS, seed=_HASH_SEED,
+               prime=_HASH_PRIME, ends=None):
+    """ 64 bit hash of the bytes of every row of a buffer
+
+    Rows are read 8 bytes at a time (a word per row per pass), mixed with a
+    multiply and xor and finished with the row length and the splitmix64
+    finalizer. Equal rows always have equal hashes, different rows collide
+    with probability about 2 ** -64
+
+    Args:
+        buf (numpy.ndarray(uint8)): Buffer of whole rows
+        starts (numpy.ndarray(int64)): Row starts of buf, see
+            chunkers.line_starts. A row includes its trailing newline
+        block_rows (int): Number of rows hashed at a time
+        seed, prime (numpy.uint64): Initial state and multiplier, an odd
+            multiplier with another seed gives another hash function
+        ends (numpy.ndarray(int64)): Row ends of buf, computed with
+            chunkers.line_ends if None. Given ends, starts may be any
+            increasing subset of the rows
+
+    Returns (numpy.ndarray(uint64)):
+        One hash per row
+    """
+    if ends is None:
+        ends = chk.line_ends(buf, starts)
+
+    result = np.empty(starts.size, dtype=np.uint64)
+
+    for i in range(0, starts.size, block_rows):
+        block_starts = starts[i:(i + block_rows)]
+        block_ends = ends[i:(i + block_rows)]
+        first = block_starts[0]
+
+        block_size = block_ends[-1] - first
+        words = _word_view(buf[first:block_ends[-1]])
+        offsets = block_starts - first
+        length = block_ends - block_starts
+
+        h = np.full(block_starts.size, seed, dtype=np.uint64)
+        for k in range(0, int(length.max()), 8):
+            # Rows shorter than k read a masked out word
+            remaining = np.clip(length - k, 0, 8)
+            word = words[np.minimum(offsets + k, block_size)]
+            word &= _WORD_MASKS[remaining]
+            h = (h ^ word) * prime
+
+        h ^= length.astype(np.uint64)
+        h ^= h >> np.uint64(30)
+        h *= np.uint64(0xbf58476d1ce4e5b9)
+        h ^= h >> np.uint64(27)
+        h *= np.uint64(0x94d049bb133111eb)
+        h ^= h >> np.uint64(31)
+
+        result[i:(i + block_rows)] = h
+
+    return result
+
+
+def row_fingerprints(buf, starts):
+    """ 128 bit fingerprint of every row, two independent row_hashes
+
+    Used where rows cannot be compared byte for byte, such as rows held by
+    different MPI ranks. Equal rows always have equal fingerprints, different
+    rows collide with probability about 2 ** -128
+
+    Returns (numpy.ndarray(uint64)):
+        An n x 2 array, one fingerprint per row
+    """
+    result = np.empty((starts.size, 2), dtype=np.uint64)
+    result[:, 0] = row_hashes(buf, starts)
+    result[:, 1] = row_hashes(buf, starts, seed=_HASH_SEED2,
+                              prime=_HASH_PRIME2)
+
+    return result
+
+
+def _rows_equal(words, starts, ends, other_starts, other_ends):
+    # Byte for byte comparison of pairs of rows, 8 bytes at a time
+    length = ends - starts
+    result = length == other_ends - other_starts
+    last = words.size - 1
+
+    for k in range(0, int(length.max()) if length.size > 0 else 0, 8):
+        mask = _WORD_MASKS[np.clip(length - k, 0, 8)]
+        word = words[np.minimum(starts + k, last)] & mask
+        other = words[np.minimum(other_starts + k, last)] & mask
+        result &= word == other
+
+    return result
+
+
+def duplicate_rows(buf, starts, hashes=None, ends=None):
+    """ Flag rows whose bytes repeat an earlier row of the buffer
+
+    Only rows whose hash occurs more than once are candidates. They are
+    grouped by hash with a stable sort, and every row of a group is compared
+    byte for byte with the first row of its group. Groups holding different
+    rows (a hash collision) are resolved row by row, so a collision never
+    flags a row
+
+    Args:
+        buf (numpy.ndarray(uint8)): Buffer of whole rows
+        starts (numpy.ndarray(int64)): Row starts of buf
+        hashes (numpy.ndarray(uint64)): Hashes of the rows, computed with
+            row_hashes if None
+        ends (numpy.ndarray(int64)): Row ends of buf, computed with
+            chunkers.line_ends if None. Given ends, starts may be any
+            increasing subset of the rows, which are compared among
+            themselves only
+
+    Returns (numpy.ndarray(bool)):
+        True for every row equal to an earlier row. The first occurrence of a
+        row is never flagged
+    """
+    if ends is None:
+        ends = chk.line_ends(buf, starts)
+
+    if hashes is None:
+        hashes = row_hashes(buf, starts, ends=ends)
+
+    result = np.zeros(starts.size, dtype=bool)
+
+    sorted_hashes = np.sort(hashes)
+    repeated = sorted_hashes[1:][sorted_hashes[1:] == sorted_hashes[:-1]]
+
+    if repeated.size == 0:
+        return result
+
+    # Keep rows whose hash falls in a bucket of a repeated hash, then the
+    # ones whose hash is repeated
+    repeated = np.unique(repeated)
+    buckets = np.zeros(_FILTER_SIZE, dtype=bool)
+    buckets[repeated & _FILTER_MASK] = True
+    candidates = np.flatnonzero(buckets[hashes & _FILTER_MASK])
+
+    position = np.searchsorted(repeated, hashes[candidates])
+    position = np.minimum(position, repeated.size - 1)
+    candidates = candidates[repeated[position] == hashes[candidates]]
+
+    # Within a group of equal hashes the stable sort keeps row order, so the
+    # first row of a group is its earliest
+    order = candidates[np.argsort(hashes[candidates], kind="mergesort")]
+    sorted_hashes = hashes[order]
+    group_start = np.ones(order.size, dtype=bool)
+    group_start[1:] = sorted_hashes[1:] != sorted_hashes[:-1]
+
+    first_pos = np.maximum.accumulate(np.where(group_start,
+                                               np.arange(order.size), 0))
+    members = np.flatnonzero(np.logical_not(group_start))
+    rows = order[members]
+    firsts = order[first_pos[members]]
+
+    equal = _rows_equal(_word_view(buf), starts[rows], ends[rows],
+                        starts[firsts], ends[firsts])
+    result[rows[equal]] = True
+
+    # Hash collisions: redo their groups with exact comparisons
+    collided = np.unique(first_pos[members[np.logical_not(equal)]])
+    for a_group in collided:
+        seen = set()
+        j = a_group
+
+        while j < order.size and sorted_hashes[j] == sorted_hashes[a_group]:
+            i = order[j]
+            a_row = buf[starts[i]:ends[i]].tobytes()
+
+            result[i] = a_row in seen
+            seen.add(a_row)
+            j += 1
+
+    return result